@@ -3,7 +3,7 @@ This module contains the functions and utilities to parse an ARPA file with 21 v
 """
 import csv
 from datetime import datetime, timedelta
-from os.path import abspath, basename, dirname, join, splitext
+from os.path import abspath, basename, dirname, getsize, join, splitext
 from pathlib import PurePath
 
 from sciafeed import TEMPLATES_PATH
@@ -17,6 +17,16 @@ LIMITING_PARAMETERS = {
     'P': ('Pmin', 'Pmax'),
 }
 FORMAT_LABEL = 'ARPA-21'
+# the rows of the files are one for each time, in chronological order: `iter_parse` yields
+# the measures sorted by date
+ITER_PARSE_SORTED = True
+# cheap necessary conditions for a file to be of this format (see `parsing.guess_format`)
+FORMAT_SIGNATURE = {'extensions': ('.dat', ),
+                    'filename_pattern': r'^[^_]*_[^_]{0,5}_[^_]+_[^_]+\.dat$'}
+# files bigger than this size (in bytes) are read with the NumPy reader by default
+FAST_READER_MIN_SIZE = 100000
+# number of rows decoded at once by the NumPy reader
+FAST_READER_CHUNK_SIZE = 10000
 
 
 def load_parameter_file(parameters_filepath=PARAMETERS_FILEPATH, delimiter=';'):
@@ -157,7 +167,7 @@ def parse_row(row, parameters_map, only_valid=False, missing_value_marker=MISSIN
         metadata = metadata.copy()
     tokens = row.split()
     date_str = tokens[0]
-    date_obj = datetime.strptime(date_str, '%Y%m%d%H%M') - timedelta(hours=1)
+    date_obj = utils.strptime(date_str, '%Y%m%d%H%M') - timedelta(hours=1)
     metadata['lat'] = float(tokens[1])
     par_values = tokens[2:23]
     par_flags = tokens[23:]
@@ -194,7 +204,7 @@ def validate_row_format(row):
         err_msg = "The number of components in the row is wrong"
         return err_msg
     try:
-        datetime.strptime(tokens[0], '%Y%m%d%H%M')
+        utils.strptime(tokens[0], '%Y%m%d%H%M')
     except ValueError:
         err_msg = "The date format in the row is wrong"
         return err_msg
@@ -237,6 +247,90 @@ def rows_generator(filepath, parameters_map, metadata):
             yield i, row
 
 
+def slow_rows_generator(filepath, parameters_map, metadata, found_errors,
+                        missing_value_marker=MISSING_VALUE_MARKER):
+    """
+    A generator of the rows of an arpa21 file that are compliant with the format, validated
+    and parsed one by one with the functions `validate_row_format` and `parse_row`.
+    Each value returned is a tuple (index of the row, row, list of measures of the row).
+    The errors found are appended to `found_errors` as tuples (row index, error message).
+
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :param missing_value_marker: the string used as a marker for missing value
+    :return: iterable of (index of the row, row, list of measures of the row)
+    """
+    for i, row in rows_generator(filepath, parameters_map, metadata):
+        err_msg = validate_row_format(row)
+        if err_msg:
+            found_errors.append((i, err_msg))
+            continue
+        metadata['row'] = i
+        row_measures = parse_row(row, parameters_map, missing_value_marker=missing_value_marker,
+                                 metadata=metadata)
+        yield i, row, row_measures
+
+
+def fast_rows_generator(filepath, parameters_map, metadata, found_errors,
+                        missing_value_marker=MISSING_VALUE_MARKER,
+                        chunk_size=FAST_READER_CHUNK_SIZE):
+    """
+    A generator of the rows of an arpa21 file that are compliant with the format, decoded with
+    NumPy a chunk of rows at a time (see function `utils.decode_fixed_width_rows`).
+    Each value returned is a tuple (index of the row, row, list of measures of the row), where
+    the measures are the same returned by the function `parse_row`. The rows that are not
+    strictly fixed width are validated and parsed one by one with the functions
+    `validate_row_format` and `parse_row`.
+    The errors found are appended to `found_errors` as tuples (row index, error message).
+
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :param missing_value_marker: the string used as a marker for missing value
+    :param chunk_size: number of rows decoded at once
+    :return: iterable of (index of the row, row, list of measures of the row)
+    """
+    par_codes = [parameters_map[i + 1]['par_code'] for i in range(21)]
+    conversions = [parameters_map[i + 1]['convertion'] for i in range(21)]
+    for chunk in utils.chunked_iterable(
+            rows_generator(filepath, parameters_map, metadata), chunk_size):
+        regular, dates, lats, values, missing = utils.decode_fixed_width_rows(
+            [row for _, row in chunk], 42, missing_value_marker)
+        par_values = values[:, :21].copy()
+        for j, convertion in enumerate(conversions):
+            # vectorized, with the same rounding of `parse_row` (see `utils.Conversion`)
+            par_values[:, j] = convertion(par_values[:, j])
+        par_values = par_values.tolist()
+        par_missing = missing[:, :21].tolist()
+        par_flags = (values[:, 21:] <= 1).tolist()
+        lats = lats.tolist()
+        for k, (i, row) in enumerate(chunk):
+            if not regular[k]:
+                err_msg = validate_row_format(row)
+                if err_msg:
+                    found_errors.append((i, err_msg))
+                    continue
+                metadata['row'] = i
+                row_measures = parse_row(row, parameters_map,
+                                         missing_value_marker=missing_value_marker,
+                                         metadata=metadata)
+                yield i, row, row_measures
+                continue
+            metadata['row'] = i
+            row_metadata = metadata.copy()
+            row_metadata['lat'] = lats[k]
+            date_obj = dates[k] - timedelta(hours=1)
+            row_measures = [
+                (row_metadata, date_obj, par_code, None if is_missing else par_value, flag)
+                for par_code, par_value, is_missing, flag in zip(
+                    par_codes, par_values[k], par_missing[k], par_flags[k])
+            ]
+            yield i, row, row_measures
+
+
 # entry point candidate
 def extract_metadata(filepath, parameters_filepath):
     """
@@ -259,8 +353,67 @@ def extract_metadata(filepath, parameters_filepath):
     return ret_value
 
 
+def parsed_rows_generator(filepath, parameters_map, metadata, found_errors,
+                          missing_value_marker=MISSING_VALUE_MARKER, fast=None):
+    """
+    A generator of the rows of an arpa21 file, validated and parsed in a single pass.
+    Each value returned is a tuple (index of the row, list of measures of the row), where
+    the measures are as returned by the function `parse_row`.
+    Rows not compliant with the format are not returned: the errors found are appended
+    to `found_errors` as tuples (row index, error message).
+
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :param missing_value_marker: the string used as a marker for missing value
+    :param fast: if True, decode the rows with NumPy (see function `fast_rows_generator`);
+                 if None, decide according to the size of the file
+    :return: iterable of (index of the row, list of measures of the row)
+    """
+    if fast is None:
+        fast = getsize(filepath) >= FAST_READER_MIN_SIZE
+    start, end = metadata['start_date'], metadata['end_date']
+    # tolherance of 1 hour...
+    start -= timedelta(hours=1)
+    end += timedelta(hours=1)
+    last_row_date = None
+    last_row = None
+    official_lat = None
+    if fast:
+        decoded_rows = fast_rows_generator(
+            filepath, parameters_map, metadata, found_errors, missing_value_marker)
+    else:
+        decoded_rows = slow_rows_generator(
+            filepath, parameters_map, metadata, found_errors, missing_value_marker)
+    for i, row, row_measures in decoded_rows:
+        err_msg = ''
+        if not row_measures:
+            continue
+        current_row_date = row_measures[0][1]
+        if not official_lat:
+            # NOTE: assuming the official latitude is the one in the first row
+            official_lat = row_measures[0][0].get('lat')
+        current_row_lat = row_measures[0][0].get('lat')
+        if last_row_date and last_row_date > current_row_date:
+            err_msg = "it is not strictly after the previous"
+        elif official_lat and official_lat != current_row_lat:
+            err_msg = "the latitude changes"
+        elif last_row and last_row_date and last_row_date == current_row_date and \
+                row != last_row:
+            err_msg = "duplication of rows with different data"
+        elif not start <= current_row_date <= end:
+            err_msg = "the time is not coherent with the filename"
+        last_row_date = current_row_date
+        last_row = row
+        if err_msg:
+            found_errors.append((i, err_msg))
+            continue
+        yield i, row_measures
+
+
 # entry point candidate
-def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH, fast=None):
     """
     Open an arpa21 file and validate it against the format.
     Return the list of tuples (row index, error message) of the errors found.
@@ -268,6 +421,7 @@ def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
 
     :param filepath: path to the arpa21 file
     :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param fast: if True, use the NumPy reader (if None, decide according to the file size)
     :return: [..., (row index, error message), ...]
     """
     filename = basename(filepath)
@@ -276,52 +430,54 @@ def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
         return [(0, err_msg)]
     found_errors = []
     metadata = extract_metadata(filepath, parameters_filepath)
-    start, end = metadata['start_date'], metadata['end_date']
-    # tolherance of 1 hour...
-    start -= timedelta(hours=1)
-    end += timedelta(hours=1)
-    parameters_map = load_parameter_file(parameters_filepath)
-    with open(filepath) as fp:
-        last_row_date = None
-        last_row = None
-        official_lat = None
-        for i, row in enumerate(fp, 1):
-            if not row.strip():
-                continue
-            err_msg = validate_row_format(row)
-            if err_msg:
-                found_errors.append((i, err_msg))
-                continue
-            metadata['row'] = i
-            row_measures = parse_row(row, parameters_map, metadata=metadata)
-            if not row_measures:
-                continue
-            current_row_date = row_measures[0][1]
-            if not official_lat:
-                # NOTE: assuming the official latitude is the one in the first row
-                official_lat = row_measures[0][0].get('lat')
-            current_row_lat = row_measures[0][0].get('lat')
-            if last_row_date and last_row_date > current_row_date:
-                err_msg = "it is not strictly after the previous"
-                found_errors.append((i, err_msg))
-            elif official_lat and official_lat != current_row_lat:
-                err_msg = "the latitude changes"
-                found_errors.append((i, err_msg))
-            elif last_row and last_row_date and last_row_date == current_row_date and \
-                    row != last_row:
-                err_msg = "duplication of rows with different data"
-                found_errors.append((i, err_msg))
-            elif not start <= current_row_date <= end:
-                err_msg = "the time is not coherent with the filename"
-                found_errors.append((i, err_msg))
-            last_row_date = current_row_date
-            last_row = row
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for _ in parsed_rows_generator(filepath, parameters_map, metadata, found_errors,
+                                   fast=fast):
+        pass
     return found_errors
 
 
+# entry point candidate
+def iter_parse(filepath, parameters_filepath=PARAMETERS_FILEPATH, only_valid=False,
+               missing_value_marker=MISSING_VALUE_MARKER, fast=None, found_errors=None):
+    """
+    Read an arpa21 file located at `filepath` and yield the data stored inside, measure by
+    measure, without loading the whole file in memory. Each measure is a tuple:
+    ::
+
+      (metadata, datetime object, par_code, par_value, flag)
+
+    The errors found are appended to the list `found_errors` (if provided), as the
+    function `validate_format` returns them.
+
+    :param filepath: path to the arpa21 file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param only_valid: parse only values flagged as valid (default: False)
+    :param missing_value_marker: the string used as a marker for missing value
+    :param fast: if True, use the NumPy reader (if None, decide according to the file size)
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (metadata, datetime object, par_code, par_value, flag)
+    """
+    if found_errors is None:
+        found_errors = []
+    filename = basename(filepath)
+    err_msg = validate_filename(filename)
+    if err_msg:
+        found_errors.append((0, err_msg))
+        return
+    metadata = extract_metadata(filepath, parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for i, row_measures in parsed_rows_generator(
+            filepath, parameters_map, metadata, found_errors,
+            missing_value_marker=missing_value_marker, fast=fast):
+        if only_valid:
+            row_measures = [m for m in row_measures if m[4]]
+        yield from row_measures
+
+
 # entry point candidate
 def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH, only_valid=False,
-          missing_value_marker=MISSING_VALUE_MARKER):
+          missing_value_marker=MISSING_VALUE_MARKER, fast=None):
     """
     Read an arpa21 file located at `filepath` and returns the data stored inside and the list
     of error messages eventually found. 
@@ -336,23 +492,13 @@ def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH, only_valid=False,
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :param only_valid: parse only values flagged as valid (default: False)
     :param missing_value_marker: the string used as a marker for missing value
+    :param fast: if True, use the NumPy reader (if None, decide according to the file size)
     :return: (data, found_errors)
     """""
-    data = []
-    found_errors = validate_format(filepath, parameters_filepath)
-    found_errors_dict = dict(found_errors)
-    if 0 in found_errors_dict:
-        return data, found_errors
-    metadata = extract_metadata(filepath, parameters_filepath)
-    parameters_map = load_parameter_file(parameters_filepath)
-    for i, row in rows_generator(filepath, parameters_map, metadata):
-        if i in found_errors_dict:
-            continue
-        metadata['row'] = i
-        parsed_row = parse_row(
-            row, parameters_map, only_valid=only_valid,
-            missing_value_marker=missing_value_marker, metadata=metadata)
-        data.extend(parsed_row)
+    found_errors = []
+    data = list(iter_parse(filepath, parameters_filepath=parameters_filepath,
+                           only_valid=only_valid, missing_value_marker=missing_value_marker,
+                           fast=fast, found_errors=found_errors))
     return data, found_errors
 
 
@@ -7,7 +7,7 @@ from datetime import datetime, timedelta
 import json
 import logging
 import os
-from os.path import abspath, basename, dirname, join, splitext
+from os.path import abspath, basename, dirname, exists, join, splitext
 from pathlib import PurePath
 
 import requests
@@ -32,11 +32,21 @@ TABLE_NAME = "1396fb33-d6a1-442b-a1a1-90ff7a3d3642"
 # # taken from https://raw.githubusercontent.com/ARPA-SIMC/dballe/v8.2-1/doc/fapi_tranges.md
 # TRANGES_PATH = join(TEMPLATES_PATH, 'fapi_tranges.md')
 
-# DATASTORE_QUERY_URL = 'https://arpae.datamb.it/api/action/datastore_search_sql'
+# # name of the manifest of the historical files downloaded, and number of parallel downloads
+DOWNLOAD_MANIFEST_FILENAME = 'download_manifest.json'
+# subfolder of the download folder with the manifest and the partial downloads, so that
+# they are not scanned as data files
+DOWNLOAD_STATE_FOLDER = '.download'
+DOWNLOAD_WORKERS = 4
+DATASTORE_QUERY_URL = 'https://arpae.datamb.it/api/action/datastore_search_sql'
 DATASTORE_QUERY_URL = 'https://dati.arpae.it/api/action/datastore_search_sql'
 PARAMETERS_FILEPATH = join(TEMPLATES_PATH, 'arpaer_params.csv')
 LIMITING_PARAMETERS = {}
 FORMAT_LABEL = 'ARPA-ER'
+# max number of (bcode, level, trange) combinations memoized by a parameters matcher
+MATCHER_MEMO_SIZE = 10000
+# cheap necessary conditions for a file to be of this format (see `parsing.guess_format`)
+FORMAT_SIGNATURE = {'extensions': ('.json', '.gz'), 'filename_pattern': r'\.json(\.gz)?$'}
 
 # ##### start of online interface utilities #####
 
@@ -149,6 +159,7 @@ def get_db_results(start=None, end=None, limit=None, only_bcodes=None, bcodes_fi
     """
     sql = build_sql(TABLE_NAME, start, end, limit, only_bcodes, **kwargs)
     results = sql2results(sql, timeout=timeout, logger=logger)
+    matcher = compile_parameters_matcher(bcodes_filters or {})
     results_filtered = []
     # follow removing the results not including right BCODES, level, and trange
     for result in results:
@@ -162,16 +173,10 @@ def get_db_results(start=None, end=None, limit=None, only_bcodes=None, bcodes_fi
                 if only_bcodes is not None and var not in only_bcodes:
                     del data_item['vars'][var]
                     continue
-                if bcodes_filters and var in bcodes_filters:
-                    props = bcodes_filters[var]
-                    for prop in props:
-                        bcode_level = prop['level']
-                        bcode_trange = prop['trange']
-                        if utils.is_same_list(bcode_level, data_level, JSON_ANY_MARKER) and \
-                                utils.is_same_list(bcode_trange, data_timerange, JSON_ANY_MARKER):
-                            break
-                    else:  # never gone on break: not found the bcode in the properties
-                        del data_item['vars'][var]
+                if var in matcher and \
+                        not match_parameters(matcher, var, data_level, data_timerange):
+                    # not found the bcode in the properties
+                    del data_item['vars'][var]
             if data_item['vars']:
                 data_results.append(data_item)
         if data_results:
@@ -199,13 +204,13 @@ def save_db_results(filepath, db_results):
 def load_db_results(filepath):
     """
     Load the DB results from an ARPA-ER file located at `filepath` path.
-    The file is assumed to follow the ARPA-ER format conventions.
+    The file is assumed to follow the ARPA-ER format conventions, and it can be gzipped.
 
     :param filepath: path of the ARPA-ER file
     :return: a list of dictionaries of the DB results
     """
     results = []
-    with open(filepath) as fp:
+    with utils.open_text(filepath) as fp:
         for line in fp:
             result = json.loads(line)
             results.append(result)
@@ -227,7 +232,7 @@ def query_recent_and_save(save_path, parameters_filepath=PARAMETERS_FILEPATH, on
     :param logger: logging object where to report actions
     :param kwargs: additional filters on the table's columns
     """
-    parameters_map = load_parameter_file(parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
     if not only_bcodes:
         only_bcodes = list(parameters_map.keys())
     bcodes_filters = {k: v for k, v in parameters_map.items() if k in only_bcodes}
@@ -238,9 +243,16 @@ def query_recent_and_save(save_path, parameters_filepath=PARAMETERS_FILEPATH, on
 
 # entry point candidate
 def download_er(download_folder, start=None, end=None, parameters_filepath=PARAMETERS_FILEPATH,
-                credentials_folder=DEFAULT_CREDENTIALS_FOLDER, logger=None):
+                credentials_folder=DEFAULT_CREDENTIALS_FOLDER, logger=None, extract=False,
+                workers=DOWNLOAD_WORKERS):
     """
     Download data from Emilia-Romagna dataset from an interval of dates.
+    The historical files are kept as .json.gz archives (that can be parsed directly),
+    unless `extract` is True. They are downloaded by `workers` parallel downloads, resuming
+    the partial downloads of a previous run. The historical files downloaded are
+    reported in the manifest DOWNLOAD_MANIFEST_FILENAME: a rerun skips them.
+    The manifest and the partial downloads are kept in the subfolder DOWNLOAD_STATE_FOLDER
+    of `download_folder`.
 
     :param download_folder: download folder
     :param start: start datetime
@@ -248,6 +260,8 @@ def download_er(download_folder, start=None, end=None, parameters_filepath=PARAM
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :param credentials_folder: folder with google credential files
     :param logger: logging object where to report actions
+    :param extract: if True, extract the historical archives removing the .json.gz files
+    :param workers: number of parallel downloads of historical files
     """
     if logger is None:
         logger = logging.getLogger(LOG_NAME)
@@ -291,13 +305,38 @@ def download_er(download_folder, start=None, end=None, parameters_filepath=PARAM
         logger.warning('oldest date in history is %s' % oldest_history.date().isoformat())
         start = oldest_history
     # download history
+    state_folder = join(download_folder, DOWNLOAD_STATE_FOLDER)
+    os.makedirs(state_folder, exist_ok=True)
+    manifest_path = join(state_folder, DOWNLOAD_MANIFEST_FILENAME)
+    old_manifest_path = join(download_folder, DOWNLOAD_MANIFEST_FILENAME)
+    if exists(old_manifest_path) and not exists(manifest_path):
+        # manifest of a previous version
+        os.replace(old_manifest_path, manifest_path)
+    manifest = gdrive_utils.load_manifest(manifest_path)
+    downloads = []
     for current_required in sorted(required_in_history):
         file_id, filename = historical_months_map[current_required]
-        download_filepath = join(download_folder, filename)
+        if gdrive_utils.is_downloaded(manifest, download_folder, filename, file_id):
+            logger.info('historical %s already downloaded: skipped' % filename)
+            continue
         logger.info('downloading historical %s' % filename)
-        gdrive_utils.download_gdrive_public_file(file_id, download_filepath)
-        logger.info('unzipping %s' % filename)
-        utils.extract_gz(download_filepath, download_filepath[:-3], rm_source=True)
+        downloads.append((file_id, join(download_folder, filename)))
+    for file_id, download_filepath, result in gdrive_utils.download_gdrive_public_files(
+            downloads, workers=workers, partial_folder=state_folder):
+        filename = basename(download_filepath)
+        if isinstance(result, Exception):
+            logger.error('download of historical %s failed: %s' % (filename, result))
+            continue
+        size, sha256 = result
+        logger.info('downloaded historical %s (%s bytes)' % (filename, size))
+        saved_as = filename
+        if extract:
+            logger.info('unzipping %s' % filename)
+            utils.extract_gz(download_filepath, download_filepath[:-3], rm_source=True)
+            saved_as = filename[:-3]
+        manifest[filename] = {'file_id': file_id, 'size': size, 'sha256': sha256,
+                              'saved_as': saved_as}
+        gdrive_utils.save_manifest(manifest_path, manifest)
     # download recent
     if datetime(start.year, start.month, 1) in required_in_history:
         start = oldest_recent
@@ -343,14 +382,17 @@ def validate_filename(filename: str):
     """
     Check the name of the input arpa-er file named `filename`
     and returns the description string of the error (if found).
+    The file can be a gzip archive, with extension .json.gz .
 
     :param filename: the name of the arpa-er file
     :return: the string describing the error
     """
     err_msg = ''
     name, ext = splitext(filename)
+    if ext.lower() == '.gz':
+        name, ext = splitext(name)
     if ext.lower() != '.json':
-        err_msg = 'Extension expected must be .json, found %s' % ext
+        err_msg = 'Extension expected must be .json or .json.gz, found %s' % ext
     return err_msg
 
 
@@ -384,6 +426,77 @@ def load_parameter_file(parameters_filepath=PARAMETERS_FILEPATH, delimiter=';'):
     return ret_value
 
 
+def compile_parameters_matcher(parameters_map):
+    """
+    Compile a dictionary of ARPA-ER parameters (as returned by `load_parameter_file`) into
+    a matcher to be used by the function `match_parameters`. The matcher is a dictionary
+    of kind:
+    ::
+
+        {   BCODE: (exact_map, wildcards, memo)
+            ...
+        }
+
+    where `exact_map` indexes by (level, trange) the properties without any
+    `JSON_ANY_MARKER`, `wildcards` is the list of the other properties and `memo` stores the
+    results of the matches already computed.
+
+    :param parameters_map: dictionary {BCODE: [list of dictionary of properties]}
+    :return: the matcher dictionary
+    """
+    matcher = dict()
+    for bcode, bcode_props in parameters_map.items():
+        exact_map = dict()
+        wildcards = []
+        for props_index, props in enumerate(bcode_props):
+            level = props['level']
+            trange = props['trange']
+            if any(str(elem) == JSON_ANY_MARKER for elem in list(level) + list(trange)):
+                wildcards.append((props_index, props))
+                continue
+            key = (tuple(level), tuple(trange))
+            exact_map.setdefault(key, []).append((props_index, props))
+        matcher[bcode] = (exact_map, wildcards, dict())
+    return matcher
+
+
+def match_parameters(matcher, bcode, level, trange):
+    """
+    Return the list of properties of the parameters with BCODE `bcode` matching `level` and
+    `trange`, in the same order of the parameters file. A property matches if its 'level'
+    and 'trange' are equal to `level` and `trange`, where the elements equal to
+    `JSON_ANY_MARKER` match anything.
+
+    :param matcher: the matcher, as returned by `compile_parameters_matcher`
+    :param bcode: the BCODE
+    :param level: the level of the measurement group
+    :param trange: the time range of the measurement group
+    :return: the list of properties of the parameters matching
+    """
+    if bcode not in matcher:
+        return []
+    exact_map, wildcards, memo = matcher[bcode]
+    try:
+        key = (tuple(level), tuple(trange))
+        hash(key)
+    except TypeError:  # not hashable elements: not memoizable
+        key = None
+    if key is not None and key in memo:
+        return memo[key]
+    matched = exact_map.get(key, []) if key is not None else []
+    if wildcards:
+        matched = sorted(matched + [
+            (props_index, props) for props_index, props in wildcards
+            if utils.is_same_list(props['level'], level, JSON_ANY_MARKER)
+            and utils.is_same_list(props['trange'], trange, JSON_ANY_MARKER)])
+    ret_value = [props for props_index, props in matched]
+    if key is not None:
+        if len(memo) >= MATCHER_MEMO_SIZE:
+            memo.clear()
+        memo[key] = ret_value
+    return ret_value
+
+
 def load_parameter_thresholds(parameters_filepath=PARAMETERS_FILEPATH, delimiter=';'):
     """
     Load a CSV file containing thresholds of the ARPA-ER stored parameters.
@@ -469,7 +582,7 @@ def validate_row_format(row):
     return err_msg
 
 
-def parse_row(row, parameters_map, metadata=None):
+def parse_row(row, parameters_map, metadata=None, matcher=None):
     """
     Parse a row of a ARPA-ER file, and return the parsed data. Data structure is as a list:
     ::
@@ -477,12 +590,16 @@ def parse_row(row, parameters_map, metadata=None):
       [(metadata, datetime object, par_code, par_value, flag), ...]
 
     The function assumes the row as validated (see function `validate_row_format`).
+    Parsing many rows, pass the `matcher` compiled once from `parameters_map`.
 
     :param row: a dictionary of a DB result according to the format (loaded JSON)
     :param parameters_map: dictionary of information about stored parameters
     :param metadata: default metadata if not provided in the row
+    :param matcher: the matcher of `parameters_map` (see `compile_parameters_matcher`)
     :return: [(metadata, datetime object, par_code, par_value, flag), ...]
     """
+    if matcher is None:
+        matcher = compile_parameters_matcher(parameters_map)
     measures = []
     if metadata is None:
         metadata = dict()
@@ -501,15 +618,10 @@ def parse_row(row, parameters_map, metadata=None):
         group_trange = measurement_group['timerange']
         current_vars = measurement_group['vars']
         for bcode in current_vars:
-            if bcode not in parameters_map:
+            if bcode not in matcher:
                 continue
-            for props in parameters_map[bcode]:
+            for props in match_parameters(matcher, bcode, group_level, group_trange):
                 par_code = props['par_code']
-                par_level = props['level']
-                par_trange = props['trange']
-                if not utils.is_same_list(par_level, group_level, JSON_ANY_MARKER) or not \
-                        utils.is_same_list(par_trange, group_trange, JSON_ANY_MARKER):
-                    continue
                 par_value = current_vars[bcode]['v']
                 if par_value is not None:
                     par_value = props['convertion'](float(par_value))
@@ -523,13 +635,14 @@ def rows_generator(filepath, parameters_map, metadata):
     """
     A generator of rows of an arpa-er file containing data. Each value returned
     is a tuple (index of the row, row). `row` is a JSON-parsed dictionary.
+    If the file is a gzip archive, it is decompressed on the fly.
 
     :param filepath: the file path of the input file
     :param parameters_map: dictionary of information about stored parameters at each position
     :param metadata: default metadata if not provided in the row
     :return: iterable of (index of the row, row)
     """
-    with open(filepath) as fp:
+    with utils.open_text(filepath) as fp:
         for i, dumped_json in enumerate(fp, 1):
             if not dumped_json.strip():
                 continue
@@ -537,22 +650,23 @@ def rows_generator(filepath, parameters_map, metadata):
             yield i, row
 
 
-# entry point candidate
-def validate_format(filepath, parameters_filepath=None):
+def parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
     """
-    Open an ARPA-ER file and validate it against the format.
-    Return the list of tuples (row index, error message) of the errors found.
-    row_index=0 is used only for global formatting errors.
+    A generator of the rows of an ARPA-ER file, validated and parsed in a single pass.
+    Each value returned is a tuple (index of the row, list of measures of the row), where
+    the measures are as returned by the function `parse_row`.
+    Rows not compliant with the format are not returned: the errors found are appended
+    to `found_errors` as tuples (row index, error message).
+    If the file is a gzip archive, it is decompressed on the fly.
 
-    :param filepath: path to the arpa-er file
-    :param parameters_filepath: not used at the moment (maintained for API compliance)
-    :return: [..., (row index, error message), ...]
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (index of the row, list of measures of the row)
     """
-    err_msg = validate_filename(basename(filepath))
-    if err_msg:
-        return [(0, err_msg)]
-    ret_value = []
-    with open(filepath) as fp:
+    matcher = compile_parameters_matcher(parameters_map)
+    with utils.open_text(filepath) as fp:
         for i, dumped_json in enumerate(fp, 1):
             if not dumped_json.strip():
                 continue
@@ -560,12 +674,67 @@ def validate_format(filepath, parameters_filepath=None):
                 row = json.loads(dumped_json)
             except:
                 err_msg = 'the row is not a parsable JSON'
-                ret_value.append((i, err_msg))
+                found_errors.append((i, err_msg))
                 continue
             err_msg = validate_row_format(row)
             if err_msg:
-                ret_value.append((i, err_msg))
-    return ret_value
+                found_errors.append((i, err_msg))
+                continue
+            metadata['row'] = i
+            row_measures = parse_row(row, parameters_map, metadata, matcher)
+            yield i, row_measures
+
+
+# entry point candidate
+def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+    """
+    Open an ARPA-ER file and validate it against the format.
+    Return the list of tuples (row index, error message) of the errors found.
+    row_index=0 is used only for global formatting errors.
+
+    :param filepath: path to the arpa-er file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :return: [..., (row index, error message), ...]
+    """
+    err_msg = validate_filename(basename(filepath))
+    if err_msg:
+        return [(0, err_msg)]
+    found_errors = []
+    metadata = extract_metadata(filepath, parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for _ in parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
+        pass
+    return found_errors
+
+
+# entry point candidate
+def iter_parse(filepath, parameters_filepath=PARAMETERS_FILEPATH, found_errors=None):
+    """
+    Read an ARPA-ER file located at `filepath` and yield the data stored inside, measure by
+    measure, without loading the whole file in memory. Each measure is a tuple:
+    ::
+
+      (metadata, datetime object, par_code, par_value, flag)
+
+    The errors found are appended to the list `found_errors` (if provided), as the
+    function `validate_format` returns them.
+
+    :param filepath: the input ARPA-ER file path
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (metadata, datetime object, par_code, par_value, flag)
+    """
+    if found_errors is None:
+        found_errors = []
+    err_msg = validate_filename(basename(filepath))
+    if err_msg:
+        found_errors.append((0, err_msg))
+        return
+    metadata = extract_metadata(filepath, parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for i, row_measures in parsed_rows_generator(
+            filepath, parameters_map, metadata, found_errors):
+        yield from row_measures
 
 
 # entry point candidate
@@ -585,19 +754,9 @@ def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :return: (data, found_errors)
     """
-    data = []
-    found_errors = validate_format(filepath, parameters_filepath)
-    found_errors_dict = dict(found_errors)
-    if 0 in found_errors_dict:
-        return data, found_errors
-    metadata = extract_metadata(filepath, parameters_filepath)
-    parameters_map = load_parameter_file(parameters_filepath)
-    for i, row in rows_generator(filepath, parameters_map, metadata):
-        if i in found_errors_dict:
-            continue
-        metadata['row'] = i
-        parsed_row = parse_row(row, parameters_map, metadata)
-        data.extend(parsed_row)
+    found_errors = []
+    data = list(iter_parse(filepath, parameters_filepath=parameters_filepath,
+                           found_errors=found_errors))
     return data, found_errors
 
 
@@ -612,7 +771,7 @@ def is_format_compliant(filepath):
     if validate_filename(basename(filepath)):
         return False
     # read first line
-    with open(filepath) as fp:
+    with utils.open_text(filepath) as fp:
         try:
             line1 = fp.readline()
             result1 = json.loads(line1)
@@ -13,6 +13,9 @@ from sciafeed import utils
 PARAMETERS_FILEPATH = join(TEMPLATES_PATH, 'arpafvg_params.csv')
 LIMITING_PARAMETERS = dict()
 FORMAT_LABEL = 'ARPA-FVG'
+# cheap necessary conditions for a file to be of this format (see `parsing.guess_format`)
+FORMAT_SIGNATURE = {'extensions': ('.dat', ),
+                    'filename_pattern': r'^[^_]*_[^_]{0,5}_[^_]+_[^_]+\.dat$'}
 
 
 def load_parameter_file(parameters_filepath=PARAMETERS_FILEPATH, delimiter=';'):
@@ -150,7 +153,7 @@ def parse_row(row, parameters_map, metadata=None):
     tokens = row.split()
     metadata['lat'] = float(tokens[14])
     date_str = ''.join(tokens[:4])
-    date_obj = datetime.strptime(date_str, '%y%m%d%H.%M') - timedelta(hours=1)
+    date_obj = utils.strptime(date_str, '%y%m%d%H.%M') - timedelta(hours=1)
     par_values = tokens[5:14]
     data = []
     for i, param_i_value_str in enumerate(par_values):
@@ -179,7 +182,7 @@ def validate_row_format(row):
         err_msg = "The number of components in the row is wrong"
         return err_msg
     try:
-        datetime.strptime(''.join(tokens[:4]), '%y%m%d%H.%M')
+        utils.strptime(''.join(tokens[:4]), '%y%m%d%H.%M')
     except ValueError:
         err_msg = "The date format in the row is wrong"
         return err_msg
@@ -232,6 +235,58 @@ def extract_metadata(filepath, parameters_filepath):
     return ret_value
 
 
+def parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
+    """
+    A generator of the rows of an ARPA-FVG file, validated and parsed in a single pass.
+    Each value returned is a tuple (index of the row, list of measures of the row), where
+    the measures are as returned by the function `parse_row`.
+    Rows not compliant with the format are not returned: the errors found are appended
+    to `found_errors` as tuples (row index, error message).
+
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (index of the row, list of measures of the row)
+    """
+    start, end = metadata['start_date'], metadata['end_date']
+    # 1 hour tolherance
+    start -= timedelta(hours=1)
+    end += timedelta(hours=1)
+    last_row_date = None
+    last_row = None
+    official_lat = None
+    for i, row in rows_generator(filepath, parameters_map, metadata):
+        err_msg = validate_row_format(row)
+        if err_msg:
+            found_errors.append((i, err_msg))
+            continue
+        metadata['row'] = i
+        row_measures = parse_row(row, parameters_map, metadata=metadata)
+        if not row_measures:
+            continue
+        current_row_date = row_measures[0][1]
+        if not official_lat:
+            # NOTE: assuming the official latitude is the one in the first row
+            official_lat = row_measures[0][0].get('lat')
+        current_row_lat = row_measures[0][0].get('lat')
+        if last_row_date and last_row_date > current_row_date:
+            err_msg = "it is not strictly after the previous"
+        elif official_lat and official_lat != current_row_lat:
+            err_msg = "the latitude changes"
+        elif last_row and last_row_date and last_row_date == current_row_date and \
+                row != last_row:
+            err_msg = "duplication of rows with different data"
+        elif not start <= current_row_date <= end:
+            err_msg = "the time is not coherent with the filename"
+        last_row_date = current_row_date
+        last_row = row
+        if err_msg:
+            found_errors.append((i, err_msg))
+            continue
+        yield i, row_measures
+
+
 # entry point candidate
 def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     """
@@ -249,49 +304,43 @@ def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
         return [(0, err_msg)]
     found_errors = []
     metadata = extract_metadata(filepath, parameters_filepath)
-    start, end = metadata['start_date'], metadata['end_date']
-    # 1 hour tolherance
-    start -= timedelta(hours=1)
-    end += timedelta(hours=1)
-    parameters_map = load_parameter_file(parameters_filepath)
-    with open(filepath) as fp:
-        last_row_date = None
-        last_row = None
-        official_lat = None
-        for i, row in enumerate(fp, 1):
-            if not row.strip():
-                continue
-            err_msg = validate_row_format(row)
-            if err_msg:
-                found_errors.append((i, err_msg))
-                continue
-            metadata['row'] = i
-            row_measures = parse_row(row, parameters_map, metadata=metadata)
-            if not row_measures:
-                continue
-            current_row_date = row_measures[0][1]
-            if not official_lat:
-                # NOTE: assuming the official latitude is the one in the first row
-                official_lat = row_measures[0][0].get('lat')
-            current_row_lat = row_measures[0][0].get('lat')
-            if last_row_date and last_row_date > current_row_date:
-                err_msg = "it is not strictly after the previous"
-                found_errors.append((i, err_msg))
-            elif official_lat and official_lat != current_row_lat:
-                err_msg = "the latitude changes"
-                found_errors.append((i, err_msg))
-            elif last_row and last_row_date and last_row_date == current_row_date and \
-                    row != last_row:
-                err_msg = "duplication of rows with different data"
-                found_errors.append((i, err_msg))
-            elif not start <= current_row_date <= end:
-                err_msg = "the time is not coherent with the filename"
-                found_errors.append((i, err_msg))
-            last_row_date = current_row_date
-            last_row = row
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for _ in parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
+        pass
     return found_errors
 
 
+# entry point candidate
+def iter_parse(filepath, parameters_filepath=PARAMETERS_FILEPATH, found_errors=None):
+    """
+    Read an ARPA-FVG file located at `filepath` and yield the data stored inside, measure by
+    measure, without loading the whole file in memory. Each measure is a tuple:
+    ::
+
+      (metadata, datetime object, par_code, par_value, flag)
+
+    The errors found are appended to the list `found_errors` (if provided), as the
+    function `validate_format` returns them.
+
+    :param filepath: path to the ARPA-FVG file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (metadata, datetime object, par_code, par_value, flag)
+    """
+    if found_errors is None:
+        found_errors = []
+    filename = basename(filepath)
+    err_msg = validate_filename(filename)
+    if err_msg:
+        found_errors.append((0, err_msg))
+        return
+    metadata = extract_metadata(filepath, parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for i, row_measures in parsed_rows_generator(
+            filepath, parameters_map, metadata, found_errors):
+        yield from row_measures
+
+
 # entry point candidate
 def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     """
@@ -308,19 +357,9 @@ def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :return: (data, found_errors)
     """""
-    data = []
-    found_errors = validate_format(filepath, parameters_filepath)
-    found_errors_dict = dict(found_errors)
-    if 0 in found_errors_dict:
-        return data, found_errors
-    metadata = extract_metadata(filepath, parameters_filepath)
-    parameters_map = load_parameter_file(parameters_filepath)
-    for i, row in rows_generator(filepath, parameters_map, metadata):
-        if i in found_errors_dict:
-            continue
-        metadata['row'] = i
-        parsed_row = parse_row(row, parameters_map, metadata=metadata)
-        data.extend(parsed_row)
+    found_errors = []
+    data = list(iter_parse(filepath, parameters_filepath=parameters_filepath,
+                           found_errors=found_errors))
     return data, found_errors
 
 
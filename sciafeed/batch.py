@@ -0,0 +1,189 @@
+"""
+This module contains a columnar representation of climatologic data, alternative to the
+python structure of kind:
+::
+
+    [(metadata, datetime object, par_code, par_value, flag), ...]
+
+A `MeasureBatch` stores the same measures in NumPy arrays: the metadata of the stations are
+interned (stored once and referenced by index), the parameter codes are categorical, so the
+memory used for each measure is of few tens of bytes.
+"""
+from array import array
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+class MeasureBatch:
+    """
+    Columnar container of measures. Attributes:
+
+    - stations: list of the metadata dictionaries of the stations (without the key 'row')
+    - station_idx: int32 array of the indexes of the stations in `stations`
+    - rows: int32 array of the row indexes in the source file (-1 if not available)
+    - times: int64 array of the times of measurement, in microseconds since 1970-01-01
+    - par_codes: list of the parameter codes
+    - par_idx: int16 array of the indexes of the parameter codes in `par_codes`
+    - values: float64 array of the parameter values (NaN for None)
+    - flags: bool array of the validity flags
+    - dates_only: True if the times are dates (instances of datetime.date)
+
+    The metadata dictionaries in `stations` are shared by all the measures of the batch:
+    they must not be modified.
+    """
+    def __init__(self, stations, station_idx, rows, times, par_codes, par_idx, values, flags,
+                 dates_only=False):
+        self.stations = stations
+        self.station_idx = np.asarray(station_idx, dtype=np.int32)
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.par_codes = par_codes
+        self.par_idx = np.asarray(par_idx, dtype=np.int16)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.flags = np.asarray(flags, dtype=bool)
+        self.dates_only = dates_only
+
+    @classmethod
+    def from_measures(cls, measures):
+        """
+        Build a batch from an iterable of measures (metadata, date obj, par_code, par_value,
+        par_flag), for example as returned by the function `parse` of a format module or as
+        yielded by its function `iter_parse`.
+
+        :param measures: iterable of (metadata, date obj, par_code, par_value, par_flag)
+        :return: the MeasureBatch instance
+        """
+        stations = []
+        stations_map = dict()
+        par_codes = []
+        par_codes_map = dict()
+        station_idx = array('i')
+        rows = array('i')
+        times = array('q')
+        par_idx = array('h')
+        values = array('d')
+        flags = array('b')
+        dates_only = True
+        for metadata, row_date, par_code, par_value, par_flag in measures:
+            station_key = tuple(sorted(
+                (k, tuple(v) if isinstance(v, list) else v)
+                for k, v in metadata.items() if k != 'row'))
+            if station_key not in stations_map:
+                stations_map[station_key] = len(stations)
+                station_md = metadata.copy()
+                station_md.pop('row', None)
+                stations.append(station_md)
+            station_idx.append(stations_map[station_key])
+            rows.append(metadata.get('row', -1))
+            if not isinstance(row_date, datetime):
+                row_date = datetime(row_date.year, row_date.month, row_date.day)
+            else:
+                dates_only = False
+            times.append((row_date - EPOCH) // ONE_MICROSECOND)
+            if par_code not in par_codes_map:
+                par_codes_map[par_code] = len(par_codes)
+                par_codes.append(par_code)
+            par_idx.append(par_codes_map[par_code])
+            values.append(np.nan if par_value is None else par_value)
+            flags.append(bool(par_flag))
+        dates_only = dates_only and len(times) > 0
+        return cls(stations, np.frombuffer(station_idx, dtype=np.int32),
+                   np.frombuffer(rows, dtype=np.int32), np.frombuffer(times, dtype=np.int64),
+                   par_codes, np.frombuffer(par_idx, dtype=np.int16),
+                   np.frombuffer(values, dtype=np.float64),
+                   np.frombuffer(flags, dtype=np.int8).astype(bool), dates_only)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return self.iter_measures()
+
+    def iter_measures(self, copy_metadata=True):
+        """
+        Yield the measures of the batch as tuples
+        (metadata, date obj, par_code, par_value, par_flag).
+        If `copy_metadata` is False, the metadata yielded are the shared dictionaries of the
+        stations, without the key 'row'.
+
+        :param copy_metadata: if True, yield a copy of the metadata with the row index
+        :return: iterable of (metadata, date obj, par_code, par_value, par_flag)
+        """
+        for st_idx, row, micro_secs, p_idx, value, flag in zip(
+                self.station_idx.tolist(), self.rows.tolist(), self.times.tolist(),
+                self.par_idx.tolist(), self.values.tolist(), self.flags.tolist()):
+            metadata = self.stations[st_idx]
+            if copy_metadata:
+                metadata = metadata.copy()
+                if row >= 0:
+                    metadata['row'] = row
+            row_date = EPOCH + timedelta(microseconds=micro_secs)
+            if self.dates_only:
+                row_date = row_date.date()
+            if value != value:  # NaN
+                value = None
+            yield metadata, row_date, self.par_codes[p_idx], value, flag
+
+    def take(self, positions):
+        """
+        Return a new batch with the measures at `positions` (an array of indexes or a boolean
+        mask). The stations and the parameter codes are shared with the new batch.
+
+        :param positions: array of indexes or boolean mask
+        :return: the new MeasureBatch instance
+        """
+        return MeasureBatch(
+            self.stations, self.station_idx[positions], self.rows[positions],
+            self.times[positions], self.par_codes, self.par_idx[positions],
+            self.values[positions], self.flags[positions], self.dates_only)
+
+    def with_flags(self, flags):
+        """
+        Return a copy of the batch with the validity flags replaced by `flags`.
+
+        :param flags: bool array of the new flags
+        :return: the new MeasureBatch instance
+        """
+        return MeasureBatch(
+            self.stations, self.station_idx, self.rows, self.times, self.par_codes,
+            self.par_idx, self.values, flags, self.dates_only)
+
+    def positions_of(self, par_code):
+        """
+        Return the array of positions of the measures with parameter code `par_code`.
+
+        :param par_code: the parameter code
+        :return: int array of positions
+        """
+        if par_code not in self.par_codes:
+            return np.array([], dtype=np.intp)
+        return np.flatnonzero(self.par_idx == self.par_codes.index(par_code))
+
+    def station_groups(self, fields=('cod_utente', 'cod_rete')):
+        """
+        Return an int array with, for each measure, a group index identifying the station
+        by the values of the metadata `fields`.
+
+        :param fields: metadata fields identifying a station
+        :return: int array of group indexes
+        """
+        groups_map = dict()
+        station_groups = []
+        for metadata in self.stations:
+            key = tuple(metadata.get(field) for field in fields)
+            station_groups.append(groups_map.setdefault(key, len(groups_map)))
+        return np.asarray(station_groups, dtype=np.int64)[self.station_idx]
+
+    def row_ids(self):
+        """
+        Return an int array with, for each measure, the row index to use for reporting errors
+        (1 if the row index is not available).
+
+        :return: int array of row indexes
+        """
+        return np.where(self.rows >= 0, self.rows, 1)
+
@@ -2,7 +2,6 @@
 This module contains functions and utilities to parse a BOLZANO file
 """
 import csv
-from datetime import datetime
 from os.path import abspath, dirname, join, splitext
 from pathlib import PurePath
 
@@ -12,6 +11,10 @@ from sciafeed import utils
 PARAMETERS_FILEPATH = join(TEMPLATES_PATH, 'bolzano_params.csv')
 LIMITING_PARAMETERS = {}
 FORMAT_LABEL = 'BOLZANO'
+# cheap necessary conditions for a file to be of this format (see `parsing.guess_format`):
+# the first bytes are the ones of an OLE2 container, of a ZIP archive or of a raw BIFF stream
+FORMAT_SIGNATURE = {'extensions': ('.xls', ),
+                    'head_pattern': rb'\A(?:\xd0\xcf\x11\xe0|PK\x03\x04|\x09[\x00\x02\x04\x08])'}
 
 
 def load_parameter_file(parameters_filepath=PARAMETERS_FILEPATH, delimiter=';'):
@@ -77,7 +80,7 @@ def get_station_props(filepath):
     if ext.lower() != '.xls':
         err_msg = 'Extension expected must be .xls, found %s' % ext
         raise ValueError(err_msg)
-    rows = utils.load_excel(filepath)
+    rows = utils.load_excel(filepath, use_cache=True)
     stat_props = dict()
     # check only first 20 rows
     for i, row in enumerate(rows[:20]):
@@ -112,7 +115,7 @@ def parse_row(row, parameters_map, metadata=None):
     else:
         metadata = metadata.copy()
     # NOTE: assuming the column with the date is the second one
-    date_obj = datetime.strptime(row[1].strip(), "%d.%m.%Y").date()
+    date_obj = utils.strptime(row[1].strip(), "%d.%m.%Y").date()
     data = []
     for col_indx, par_props in parameters_map.items():
         par_code = par_props['par_code']
@@ -138,7 +141,7 @@ def validate_row_format(row):
     err_msg = ''
     try:
         # NOTE: assuming the date is always on the second column
-        datetime.strptime(row[1], "%d.%m.%Y")
+        utils.strptime(row[1], "%d.%m.%Y")
     except ValueError:
         err_msg = 'the date format is wrong'
         return err_msg
@@ -165,9 +168,9 @@ def rows_generator(filepath, parameters_map, metadata):
     """
     # NOTE: assuming the column with the date is the second one
     date_column_indx = 1
-    for i, row in enumerate(utils.load_excel(filepath), 1):
+    for i, row in enumerate(utils.load_excel(filepath, use_cache=True), 1):
         try:
-            datetime.strptime(row[date_column_indx], "%d.%m.%Y")
+            utils.strptime(row[date_column_indx], "%d.%m.%Y")
         except ValueError:
             continue
         yield i, row
@@ -194,32 +197,26 @@ def extract_metadata(filepath, parameters_filepath):
     return metadata
 
 
-# entry point candidate
-def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+def parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
     """
-    Open a BOLZANO file and validate it against the format.
-    Return the list of tuples (row index, error message) of the errors found.
-    row_index=0 is used only for global formatting errors.
+    A generator of the rows of a BOLZANO file, validated and parsed in a single pass.
+    Each value returned is a tuple (index of the row, list of measures of the row), where
+    the measures are as returned by the function `parse_row`.
+    Rows not compliant with the format are not returned: the errors found are appended
+    to `found_errors` as tuples (row index, error message).
 
-    :param filepath: path to the BOLZANO file
-    :param parameters_filepath: path to the CSV file containing info about stored parameters
-    :return: [..., (row index, error message), ...]
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (index of the row, list of measures of the row)
     """
-    try:
-        get_station_props(filepath)
-    except ValueError as err:
-        return [(0, str(err))]
-    metadata = extract_metadata(filepath, parameters_filepath)
-    parameters_map = load_parameter_file(parameters_filepath)
-    rows = utils.load_excel(filepath)
-    if not rows:
-        return []
+    rows = utils.load_excel(filepath, use_cache=True)
     j = 0
     for j, row in enumerate(rows):
         date_cell = [cell for cell in row if 'Data' in str(cell)]
         if date_cell:
             break
-    found_errors = []
     last_time = None
     last_row = None
     for i, row in enumerate(rows[j+2:], j+3):
@@ -242,9 +239,61 @@ def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
             continue
         last_time = cur_time
         last_row = row
+        yield i, row_measures
+
+
+# entry point candidate
+def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+    """
+    Open a BOLZANO file and validate it against the format.
+    Return the list of tuples (row index, error message) of the errors found.
+    row_index=0 is used only for global formatting errors.
+
+    :param filepath: path to the BOLZANO file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :return: [..., (row index, error message), ...]
+    """
+    try:
+        metadata = extract_metadata(filepath, parameters_filepath)
+    except ValueError as err:
+        return [(0, str(err))]
+    found_errors = []
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for _ in parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
+        pass
     return found_errors
 
 
+# entry point candidate
+def iter_parse(filepath, parameters_filepath=PARAMETERS_FILEPATH, found_errors=None):
+    """
+    Read a BOLZANO file located at `filepath` and yield the data stored inside, measure by
+    measure, without loading the whole file in memory. Each measure is a tuple:
+    ::
+
+      (metadata, datetime object, par_code, par_value, flag)
+
+    The errors found are appended to the list `found_errors` (if provided), as the
+    function `validate_format` returns them.
+
+    :param filepath: path to the BOLZANO file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (metadata, datetime object, par_code, par_value, flag)
+    """
+    if found_errors is None:
+        found_errors = []
+    try:
+        metadata = extract_metadata(filepath, parameters_filepath)
+    except ValueError as err:
+        found_errors.append((0, str(err)))
+        return
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for i, row_measures in parsed_rows_generator(
+            filepath, parameters_map, metadata, found_errors):
+        yield from row_measures
+
+
 # entry point candidate
 def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     """
@@ -260,19 +309,9 @@ def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :return: (data, found_errors)
     """""
-    data = []
-    found_errors = validate_format(filepath, parameters_filepath)
-    found_errors_dict = dict(found_errors)
-    if 0 in found_errors_dict:
-        return data, found_errors
-    metadata = extract_metadata(filepath, parameters_filepath)
-    parameters_map = load_parameter_file(parameters_filepath)
-    for i, row in rows_generator(filepath, parameters_filepath, metadata):
-        if i in found_errors_dict:
-            continue
-        metadata['row'] = i
-        row_data = parse_row(row, parameters_map, metadata)
-        data.extend(row_data)
+    found_errors = []
+    data = list(iter_parse(filepath, parameters_filepath=parameters_filepath,
+                           found_errors=found_errors))
     return data, found_errors
 
 
@@ -22,40 +22,37 @@ import statistics
 import numpy as np
 
 from sciafeed import LOG_NAME
+from sciafeed import batch
 from sciafeed import utils
 
 
-def data_internal_consistence_check(input_data, limiting_params=None):
+def iter_data_internal_consistence_check(measures, limiting_params=None, err_msgs=None):
     """
-    Get the internal consistent check for an input data object.
-    It assumes that `input_data` has an agreed structure, i.e.:
-    ::
-
-    [(metadata, date obj, par_code, par_value, par_flag), ....]
-
-    Return the list of error messages, and the data with flags modified.
-    The list of error messages is [(record_id, error string), ...].
-
-    `limiting_params` is a dict {code: (code_min, code_max), ...}.
-
-    :param input_data: an object containing measurements
+    Streaming version of the function `data_internal_consistence_check`: the measures
+    are checked and yielded with flags modified, without loading all of them in memory.
+    It assumes that the measures of the same station and date are contiguous in `measures`,
+    as they are yielded by the `iter_parse` functions of the format modules.
+    The error messages found are appended to the list `err_msgs` (if provided), as
+    tuples (record_id, error string).
+
+    :param measures: iterable of (metadata, date obj, par_code, par_value, par_flag)
     :param limiting_params: dictionary of limiting parameters for each parameter code
-    :return: (err_msgs, data_modified)
+    :param err_msgs: list where to append the tuples (record_id, error string)
+    :return: iterable of (metadata, date obj, par_code, par_value, par_flag)
     """
     if limiting_params is None:
         limiting_params = dict()
-    err_msgs = []
-    data_modified = []
-    input_data = sorted(input_data, key=utils.different_data_record_info)
-    for (station_id, row_date), measures in itertools.groupby(
-            input_data, key=utils.different_data_record_info):
+    if err_msgs is None:
+        err_msgs = []
+    for (station_id, row_date), group_measures in itertools.groupby(
+            measures, key=utils.different_data_record_info):
         # here measures have all the same station and date
-        props = {m[2]: (m[3], m[4], m[0]) for m in measures}
+        props = {m[2]: (m[3], m[4], m[0]) for m in group_measures}
         for par_code, (par_value, par_flag, metadata) in props.items():
             if par_code not in limiting_params or not par_flag or par_value is None:
                 # no check if the parameter is flagged invalid or no in the limiting_params
                 measure = (metadata, row_date, par_code, par_value, par_flag)
-                data_modified.append(measure)
+                yield measure
                 continue
             par_code_min, par_code_max = limiting_params[par_code]
             par_code_min_value, par_code_min_flag, md_min = props[par_code_min]
@@ -79,37 +76,131 @@ def data_internal_consistence_check(input_data, limiting_params=None):
                               % (par_code, par_code_max)
                     err_msgs.append((row_id, err_msg))
             measure = (metadata, row_date, par_code, par_value, par_flag)
-            data_modified.append(measure)
-    return err_msgs, data_modified
+            yield measure
 
 
-def data_weak_climatologic_check(input_data, parameters_thresholds=None):
+def data_internal_consistence_check(input_data, limiting_params=None):
     """
-    Get the weak climatologic check for an input data object, i.e. it flags
-    as invalid a value if it is out of a defined range.
-    It assumes that `input_data` has an agreed structure i.e.:
+    Get the internal consistent check for an input data object.
+    It assumes that `input_data` has an agreed structure, i.e.:
     ::
 
     [(metadata, date obj, par_code, par_value, par_flag), ....]
 
-    Return the list of error messages, and the resulting data with flags updated.
+    Return the list of error messages, and the data with flags modified.
     The list of error messages is [(record_id, error string), ...].
-    `parameters_thresholds` is a dict {code: (min, max), ...}.
+    `input_data` can also be a `batch.MeasureBatch`: in this case also the data returned
+    is a MeasureBatch.
+
+    `limiting_params` is a dict {code: (code_min, code_max), ...}.
 
     :param input_data: an object containing measurements
-    :param parameters_thresholds: dictionary of thresholds for each parameter code
+    :param limiting_params: dictionary of limiting parameters for each parameter code
     :return: (err_msgs, data_modified)
     """
+    if isinstance(input_data, batch.MeasureBatch):
+        return batch_data_internal_consistence_check(input_data, limiting_params)
+    err_msgs = []
+    input_data = sorted(input_data, key=utils.different_data_record_info)
+    data_modified = list(iter_data_internal_consistence_check(
+        input_data, limiting_params, err_msgs=err_msgs))
+    return err_msgs, data_modified
+
+
+def batch_data_internal_consistence_check(measure_batch, limiting_params=None):
+    """
+    Version of the function `data_internal_consistence_check` working on a
+    `batch.MeasureBatch` with NumPy operations.
+    Return the list of error messages (in the order of the measures in the batch), and
+    a new batch with flags modified.
+    As the not vectorized version, only the last measure of a parameter for the same
+    station and date is kept, and a KeyError is raised if a valid measure to check has
+    no measure of its limiting parameters for the same station and date.
+
+    :param measure_batch: a MeasureBatch instance
+    :param limiting_params: dictionary of limiting parameters for each parameter code
+    :return: (err_msgs, batch_modified)
+    """
+    if limiting_params is None:
+        limiting_params = dict()
+    # one group index for each couple (station, date)
+    _, group_ids = np.unique(
+        np.stack([measure_batch.station_groups(), measure_batch.times], axis=1),
+        axis=0, return_inverse=True)
+    group_ids = group_ids.ravel()
+    # duplicated parameters for the same station and date: the last occurrence wins
+    _, last_reversed = np.unique(
+        np.stack([group_ids, measure_batch.par_idx], axis=1)[::-1], axis=0, return_index=True)
+    if len(last_reversed) < len(measure_batch):
+        kept = np.sort(len(measure_batch) - 1 - last_reversed)
+        measure_batch = measure_batch.take(kept)
+        group_ids = group_ids[kept]
+    values = measure_batch.values
+    flags = measure_batch.flags
+    new_flags = flags.copy()
+    row_ids = measure_batch.row_ids()
+
+    def limit_positions(par_code, target_groups):
+        # positions of the measures of `par_code` in the groups `target_groups` (-1 if missing)
+        candidates = measure_batch.positions_of(par_code)
+        if not len(candidates):
+            return np.full(len(target_groups), -1)
+        order = np.argsort(group_ids[candidates], kind='stable')
+        candidates = candidates[order]
+        candidate_groups = group_ids[candidates]
+        indexes = np.searchsorted(candidate_groups, target_groups, side='right') - 1
+        indexes_clipped = np.clip(indexes, 0, None)
+        found = (indexes >= 0) & (candidate_groups[indexes_clipped] == target_groups)
+        return np.where(found, candidates[indexes_clipped], -1)
+
+    errors = []
+    for par_code, (par_code_min, par_code_max) in limiting_params.items():
+        positions = measure_batch.positions_of(par_code)
+        positions = positions[flags[positions] & ~np.isnan(values[positions])]
+        if not len(positions):
+            continue
+        par_values = values[positions]
+        for limit_order, limit_code in enumerate((par_code_min, par_code_max)):
+            limit_pos = limit_positions(limit_code, group_ids[positions])
+            if (limit_pos < 0).any():
+                raise KeyError(limit_code)
+            limit_values = values[limit_pos]
+            checkable = flags[limit_pos] & ~np.isnan(limit_values)
+            if limit_order == 0:
+                wrong = checkable & (par_values < limit_values)
+            else:
+                wrong = checkable & (par_values > limit_values)
+            wrong_positions = positions[wrong]
+            new_flags[wrong_positions] = False
+            err_msg = "The values of %r and %r are not consistent" % (par_code, limit_code)
+            errors.extend((pos, limit_order, err_msg) for pos in wrong_positions.tolist())
+    errors.sort(key=operator.itemgetter(0, 1))
+    err_msgs = [(int(row_ids[pos]), err_msg) for pos, _, err_msg in errors]
+    return err_msgs, measure_batch.with_flags(new_flags)
+
+
+def iter_data_weak_climatologic_check(measures, parameters_thresholds=None, err_msgs=None):
+    """
+    Streaming version of the function `data_weak_climatologic_check`: the measures
+    are checked and yielded with flags updated, without loading all of them in memory.
+    The error messages found are appended to the list `err_msgs` (if provided), as
+    tuples (record_id, error string).
+
+    :param measures: iterable of (metadata, date obj, par_code, par_value, par_flag)
+    :param parameters_thresholds: dictionary of thresholds for each parameter code
+    :param err_msgs: list where to append the tuples (record_id, error string)
+    :return: iterable of (metadata, date obj, par_code, par_value, par_flag)
+    """
     if not parameters_thresholds:
         parameters_thresholds = dict()
-    err_msgs = []
-    data_modified = []
-    for measure in input_data:
+    if err_msgs is None:
+        err_msgs = []
+    for measure in measures:
         metadata, row_date, par_code, par_value, par_flag = measure
         row_id = metadata.get('row', 1)  # TODO: an ID when it comes from the db
         if par_code not in parameters_thresholds or not par_flag or par_value is None:
             # no check if limiting parameters are flagged invalid or value is None
-            data_modified.append(measure)
+            yield measure
             continue
         min_threshold, max_threshold = map(float, parameters_thresholds[par_code])
         if not (min_threshold <= par_value <= max_threshold):
@@ -118,7 +209,66 @@ def data_weak_climatologic_check(input_data, parameters_thresholds=None):
                       % (par_code, min_threshold, max_threshold)
             err_msgs.append((row_id, err_msg))
         new_measure = (metadata, row_date, par_code, par_value, par_flag)
-        data_modified.append(new_measure)
+        yield new_measure
+
+
+def batch_data_weak_climatologic_check(measure_batch, parameters_thresholds=None):
+    """
+    Version of the function `data_weak_climatologic_check` working on a
+    `batch.MeasureBatch` with NumPy operations.
+    Return the list of error messages (in the order of the measures in the batch), and
+    a new batch with flags updated.
+
+    :param measure_batch: a MeasureBatch instance
+    :param parameters_thresholds: dictionary of thresholds for each parameter code
+    :return: (err_msgs, batch_modified)
+    """
+    if not parameters_thresholds:
+        parameters_thresholds = dict()
+    values = measure_batch.values
+    new_flags = measure_batch.flags.copy()
+    row_ids = measure_batch.row_ids()
+    errors = []
+    for par_code, thresholds in parameters_thresholds.items():
+        min_threshold, max_threshold = map(float, thresholds)
+        positions = measure_batch.positions_of(par_code)
+        positions = positions[new_flags[positions] & ~np.isnan(values[positions])]
+        par_values = values[positions]
+        wrong_positions = positions[(par_values < min_threshold)
+                                    | (par_values > max_threshold)]
+        new_flags[wrong_positions] = False
+        err_msg = "The value of %r is out of range [%s, %s]" \
+                  % (par_code, min_threshold, max_threshold)
+        errors.extend((pos, err_msg) for pos in wrong_positions.tolist())
+    errors.sort(key=operator.itemgetter(0))
+    err_msgs = [(int(row_ids[pos]), err_msg) for pos, err_msg in errors]
+    return err_msgs, measure_batch.with_flags(new_flags)
+
+
+def data_weak_climatologic_check(input_data, parameters_thresholds=None):
+    """
+    Get the weak climatologic check for an input data object, i.e. it flags
+    as invalid a value if it is out of a defined range.
+    It assumes that `input_data` has an agreed structure i.e.:
+    ::
+
+    [(metadata, date obj, par_code, par_value, par_flag), ....]
+
+    Return the list of error messages, and the resulting data with flags updated.
+    The list of error messages is [(record_id, error string), ...].
+    `input_data` can also be a `batch.MeasureBatch`: in this case also the data returned
+    is a MeasureBatch.
+    `parameters_thresholds` is a dict {code: (min, max), ...}.
+
+    :param input_data: an object containing measurements
+    :param parameters_thresholds: dictionary of thresholds for each parameter code
+    :return: (err_msgs, data_modified)
+    """
+    if isinstance(input_data, batch.MeasureBatch):
+        return batch_data_weak_climatologic_check(input_data, parameters_thresholds)
+    err_msgs = []
+    data_modified = list(iter_data_weak_climatologic_check(
+        input_data, parameters_thresholds, err_msgs=err_msgs))
     return err_msgs, data_modified
 
 
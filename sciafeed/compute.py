@@ -6,14 +6,16 @@ records.
 
     (metadata, datetime object, par_code, par_value, flag) .
 """
+from bisect import bisect_left
 from datetime import datetime, timedelta
 import itertools
 from math import pi, acos, cos, sin, tan
 import operator
 import statistics
 
-from sqlalchemy import MetaData, Table
+import numpy as np
 
+from sciafeed import batch
 from sciafeed import querying
 
 ROUND_PRECISION = 1
@@ -40,9 +42,38 @@ INDICATORS_TABLES = {
     'ds__vnt10': ['data_i', 'cod_staz', 'cod_aggr', 'vntmxgg',
                   'vnt', 'prs_ff', 'prs_dd', 'vntmd']
 }
+# upper limits of the classes of `wet_distribution` (the last class is unbounded)
+WET_CLASSES_LIMITS = (1, 5, 10, 20, 50)
+# upper limits of the classes of `wind_ff_distribution` (the first class is not counted)
+WIND_FF_CLASSES_LIMITS = (0.5, 3, 5, 10)
 # -------------- GENERIC UTILITIES --------------
 
 
+def bucket_by_par_code(measures):
+    """
+    Group the valid measures (with not null value and valid flag) by parameter code,
+    with a single scan of `measures`. Return a dictionary of kind:
+    ::
+
+        {par_code: [measure1, measure2, ...], ...}
+
+    where the measures of each parameter code are in the same order of `measures`.
+
+    :param measures: iterable of measures
+    :return: the dictionary of the valid measures for each parameter code
+    """
+    buckets = dict()
+    for measure in measures:
+        if measure[3] is None or not measure[4]:
+            continue
+        bucket = buckets.get(measure[2])
+        if bucket is None:
+            buckets[measure[2]] = [measure]
+        else:
+            bucket.append(measure)
+    return buckets
+
+
 def sum_records_by_hour_groups(day_records, hours_interval):
     """
     Return a new set of records obtaining sum of values if they belong to the same
@@ -61,15 +92,14 @@ def sum_records_by_hour_groups(day_records, hours_interval):
         return day_records
     par_code = day_records[0][2]
     start_time = datetime(day.year, day.month, day.day, 0, 0)
+    totals = dict()
+    for record in day_records:
+        min_hour = record[1].hour - record[1].hour % hours_interval
+        totals[min_hour] = totals.get(min_hour, 0) + record[3]
     new_records = []
-    for min_hour in range(0, 24, hours_interval):
-        max_hour = min_hour + hours_interval
-        subrecords = [r for r in day_records if min_hour <= r[1].hour < max_hour]
-        if not subrecords:
-            continue
-        tot = sum([s[3] for s in subrecords])
+    for min_hour in sorted(totals):
         new_time = start_time + timedelta(hours=min_hour)
-        new_record = (metadata, new_time, par_code, tot, True)
+        new_record = (metadata, new_time, par_code, totals[min_hour], True)
         new_records.append(new_record)
     return new_records
 
@@ -91,13 +121,10 @@ def wet_distribution(input_records):
     :param input_records: input records of PREC
     :return: (dry, wet_01, wet_02, wet_03, wet_04, wet_05)
     """
-    dry = len([d for d in input_records if d[3] <= 1])
-    wet_01 = len([d for d in input_records if 1 < d[3] <= 5])
-    wet_02 = len([d for d in input_records if 5 < d[3] <= 10])
-    wet_03 = len([d for d in input_records if 10 < d[3] <= 20])
-    wet_04 = len([d for d in input_records if 20 < d[3] <= 50])
-    wet_05 = len([d for d in input_records if d[3] > 50])
-    return dry, wet_01, wet_02, wet_03, wet_04, wet_05
+    counts = [0] * (len(WET_CLASSES_LIMITS) + 1)
+    for record in input_records:
+        counts[bisect_left(WET_CLASSES_LIMITS, record[3])] += 1
+    return tuple(counts)
 
 
 def compute_flag(day_records, at_least_perc):
@@ -366,10 +393,14 @@ def compute_temperature_flag(input_records, perc_day=0.75, perc_night=0.75,
     if not day_hours or not night_hours:
         # empty interval of day or night
         return ndati, 0
-    day_records = [r for r in valid_records if r[1].hour in day_hours]
-    night_records = [r for r in valid_records if r[1].hour in night_hours]
-    data_perc_day = len(day_records) / len(day_hours)
-    data_perc_night = len(night_records) / len(night_hours)
+    num_day_records = 0
+    for record in valid_records:
+        if record[1].hour in day_hours:
+            num_day_records += 1
+    # all the hours of a datetime not in the daylight are in the night
+    num_night_records = ndati - num_day_records
+    data_perc_day = num_day_records / len(day_hours)
+    data_perc_night = num_night_records / len(night_hours)
     if data_perc_day < perc_day or data_perc_night < perc_night:
         return ndati, 0
     return ndati, 1
@@ -822,11 +853,10 @@ def wind_ff_distribution(input_records):
     :param input_records: input records of FF
     :return: [c1, c2, c3, c4, c5]
     """
-    c1 = len([d for d in input_records if 0.5 < d[3] <= 3])
-    c2 = len([d for d in input_records if 3 < d[3] <= 5])
-    c3 = len([d for d in input_records if 5 < d[3] <= 10])
-    c4 = len([d for d in input_records if d[3] > 10])
-    return [c1, c2, c3, c4]
+    counts = [0] * (len(WIND_FF_CLASSES_LIMITS) + 1)
+    for record in input_records:
+        counts[bisect_left(WIND_FF_CLASSES_LIMITS, record[3])] += 1
+    return counts[1:]
 
 
 def wind_dd_partition(input_records):
@@ -853,10 +883,9 @@ def wind_dd_partition(input_records):
             sector_indx -= 1
         return sector_indx
 
-    input_records = sorted(input_records, key=get_sector_index)
     ret_value = [[] for _ in range(16)]
-    for sector_index, dd_measures in itertools.groupby(input_records, key=get_sector_index):
-        ret_value[sector_index] = list(dd_measures)
+    for dd_record in input_records:
+        ret_value[get_sector_index(dd_record)].append(dd_record)
     return ret_value
 
 
@@ -933,10 +962,10 @@ def compute_day_indicators(measures):
     :return: dictionaries of tables where to put indicators.
     """
     ret_value = dict()
-    measures = [m for m in measures if m[3] is not None and m[4]]
+    buckets = bucket_by_par_code(measures)
 
     # PREC
-    prec_day_records = [m for m in measures if m[2] == 'PREC']
+    prec_day_records = buckets.get('PREC', [])
     prec_flag = compute_flag(prec_day_records, at_least_perc=0.9)
     if prec_flag[0]:
         ret_value['ds__preci'] = {
@@ -950,9 +979,9 @@ def compute_day_indicators(measures):
         }
 
     # TEMPERATURE
-    tmedia_day_records = [m for m in measures if m[2] == 'Tmedia']
-    tmin_day_records = [m for m in measures if m[2] == 'Tmin']
-    tmax_day_records = [m for m in measures if m[2] == 'Tmax']
+    tmedia_day_records = buckets.get('Tmedia', [])
+    tmin_day_records = buckets.get('Tmin', [])
+    tmax_day_records = buckets.get('Tmax', [])
     if tmedia_day_records or tmin_day_records or tmax_day_records:
         ret_value['ds__t200'] = dict()
         if tmedia_day_records:
@@ -965,48 +994,48 @@ def compute_day_indicators(measures):
                 tmax_day_records or tmedia_day_records)
 
     # PRESSURE
-    pmedia_day_records = [m for m in measures if m[2] == 'P']
-    pmin_day_records = [m for m in measures if m[2] == 'Pmin']
-    pmax_day_records = [m for m in measures if m[2] == 'Pmax']
+    pmedia_day_records = buckets.get('P', [])
+    pmin_day_records = buckets.get('Pmin', [])
+    pmax_day_records = buckets.get('Pmax', [])
     if pmedia_day_records or pmax_day_records or pmin_day_records:
         ret_value['ds__press'] = {
             'press': compute_press(pmedia_day_records, pmax_day_records, pmin_day_records)
         }
 
     # BAGNATURA FOGLIARE
-    bagna_day_records = [m for m in measures if m[2] == 'Bagnatura_f']
+    bagna_day_records = buckets.get('Bagnatura_f', [])
     if bagna_day_records:
         ret_value['ds__bagna'] = {
             'bagna': compute_bagna(bagna_day_records),
         }
 
     # ELIOFANIA
-    elio_day_records = [m for m in measures if m[2] == 'INSOL']
-    elio00_day_records = [m for m in measures if m[2] == 'INSOL_00']
+    elio_day_records = buckets.get('INSOL', [])
+    elio00_day_records = buckets.get('INSOL_00', [])
     if elio_day_records or elio00_day_records:
         ret_value['ds__elio'] = {
             'elio': compute_elio(elio_day_records or elio00_day_records)
         }
 
     # RADIAZIONE SOLARE
-    radsol_day_records = [m for m in measures if m[2] == 'RADSOL']
+    radsol_day_records = buckets.get('RADSOL', [])
     if radsol_day_records:
         ret_value['ds__radglob'] = {
             'radglob': compute_radglob(radsol_day_records)
         }
 
     # UMIDITA' RELATIVA
-    urmedia_day_records = [m for m in measures if m[2] == 'UR media']
-    urmin_day_records = [m for m in measures if m[2] == 'UR min']
-    urmax_day_records = [m for m in measures if m[2] == 'UR max']
+    urmedia_day_records = buckets.get('UR media', [])
+    urmin_day_records = buckets.get('UR min', [])
+    urmax_day_records = buckets.get('UR max', [])
     if urmedia_day_records or urmax_day_records or urmin_day_records:
         ret_value['ds__urel'] = {
             'ur': compute_ur(urmedia_day_records, urmax_day_records, urmin_day_records)
         }
 
     # VENTO
-    ff_day_records = [m for m in measures if m[2] == 'FF']
-    dd_day_records = [m for m in measures if m[2] == 'DD']
+    ff_day_records = buckets.get('FF', [])
+    dd_day_records = buckets.get('DD', [])
     if ff_day_records:
         ret_value['ds__vnt10'] = dict()
         ret_value['ds__vnt10']['vntmd'] = compute_vntmd(ff_day_records)
@@ -1081,7 +1110,7 @@ def compute_deltaidro(prec24, etp):
     return flag, val_md, val_vr, val_mx, val_mn
 
 
-def compute_and_store(conn, data, writers, table_map, logger=None):
+def compute_and_store(conn, data, writers, table_map, logger=None, station_index=None):
     """
     Extract indicators from `data` object, write on CSV files with
     a structure that simulates the database tables.
@@ -1094,14 +1123,31 @@ def compute_and_store(conn, data, writers, table_map, logger=None):
     Return the dictionaries of computed indicators.
 
     :param conn: db connection object
-    :param data: list of measures
+    :param data: list of measures (or a `batch.MeasureBatch`)
     :param writers: dictionary of CSV writers
     :param table_map: dictionary of columns of the tables where to insert the indicators
     :param logger: logging object where to report actions
+    :param station_index: `querying.StationIndex` of the stations (if None, it's loaded)
     """
     def group_by_station(r):
         return r[0]['cod_utente'], r[0]['cod_rete'], r[0]['lat'], r[0]['lon']
 
+    def group_batch_by_station(measure_batch):
+        # same as itertools.groupby on the sorted data, without building the list of measures
+        station_keys = [group_by_station((md, )) for md in measure_batch.stations]
+        sorted_keys = sorted(set(station_keys))
+        keys_ranks = {key: rank for rank, key in enumerate(sorted_keys)}
+        stations_ranks = np.array([keys_ranks[key] for key in station_keys], dtype=np.int64)
+        measures_ranks = stations_ranks[measure_batch.station_idx]
+        order = np.argsort(measures_ranks, kind='stable')
+        bounds = np.flatnonzero(np.diff(measures_ranks[order])) + 1
+        for positions in np.split(order, bounds):
+            if not len(positions):
+                continue
+            station_key = sorted_keys[measures_ranks[positions[0]]]
+            station_batch = measure_batch.take(positions)
+            yield station_key, station_batch.iter_measures(copy_metadata=False)
+
     def group_by_date(r):
         row_day = r[1]
         if isinstance(row_day, datetime):
@@ -1109,27 +1155,18 @@ def compute_and_store(conn, data, writers, table_map, logger=None):
         return row_day
 
     computed_indicators = {}
-    meta = MetaData()
-    anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
-                       schema='dailypdbadmclima')
-    data_sorted = sorted(data, key=group_by_station)
-    for (cod_utente, cod_rete, lat, lon), stat_measures in itertools.groupby(
-            data_sorted, group_by_station):
+    if station_index is None:
+        station_index = querying.StationIndex(conn)
+    if isinstance(data, batch.MeasureBatch):
+        stations_measures = group_batch_by_station(data)
+    else:
+        data_sorted = sorted(data, key=group_by_station)
+        stations_measures = itertools.groupby(data_sorted, group_by_station)
+    for (cod_utente, cod_rete, lat, lon), stat_measures in stations_measures:
         # measures are all of the same station
         stat_measures = sorted(stat_measures, key=group_by_date)
         station_md = stat_measures[0][0]
-        station_props = {
-            'cod_rete': cod_rete
-        }
-        if station_md['format'] not in ('ARPA-ER', 'RMN'):
-            station_props['cod_utente'] = cod_utente
-        else:  # workaround to manage Emilia Romagna/RMN: try to find by name
-            station_props['nome'] = station_md['cod_utente']
-            if station_md['lat']:
-                station_props['lat'] = lat
-            if station_md['lon']:
-                station_props['lon'] = lon
-        station = querying.get_db_station(conn, anag_table, **station_props)
+        _, station = querying.resolve_station(station_index, station_md)
         # {'cod_rete': '20', 'nome': 'Corniolo', 'lat': '43.90708', 'lon': '11.79314'}
         if not station:
             logger.error('station not found: cod_utente=%s cod_rete=%s' % (cod_utente, cod_rete))
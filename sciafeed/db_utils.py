@@ -2,7 +2,10 @@
 This module contains functions and utilities to interface with a database
 """
 
+import contextlib
+
 from sqlalchemy import engine_from_config, MetaData, Table
+from sqlalchemy.engine.url import make_url
 
 
 USER = 'postgres'
@@ -13,17 +16,30 @@ DB_NAME = 'sciapg'
 
 DEFAULT_DB_URI = "postgresql://%s:%s@%s:%s/%s" % (USER, PASSWORD, ADDRESS, PORT, DB_NAME)
 ENGINE = None
+# connections kept in the pool, and additional connections allowed when the pool is in use
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+# seconds to wait for a connection when all the connections of the pool are in use
+POOL_TIMEOUT = 30
+# number of rows fetched from the server-side cursors at each round trip by `read_results`
+ITERSIZE = 2000
 
 
-def configure(db_uri=None):
+def configure(db_uri=None, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, itersize=None):
     """
     Configure the connection to the database, setting the value of the ENGINE
     global variable.
     This method should be launched before the first use of this module.
+    The connections are taken from a pool of `pool_size` connections, plus at most
+    `max_overflow` connections: when all of them are in use, a new connection waits
+    for one to be released (at most POOL_TIMEOUT seconds).
 
     :param db_uri: postgresql connection URI
+    :param pool_size: number of connections kept in the pool
+    :param max_overflow: number of connections allowed in addition to `pool_size`
+    :param itersize: if not None, set the rows fetched at each round trip by `read_results`
     """
-    global ENGINE
+    global ENGINE, ITERSIZE
     if not db_uri:
         db_uri = DEFAULT_DB_URI
     db_config = {
@@ -32,20 +48,21 @@ def configure(db_uri=None):
             'sqlalchemy.echo': False,
             'sqlalchemy.pool_recycle': 300,
     }
+    if make_url(db_uri).get_backend_name() != 'sqlite':
+        # sqlite uses pools of a single connection
+        db_config.update({
+            'sqlalchemy.pool_size': pool_size,
+            'sqlalchemy.max_overflow': max_overflow,
+            'sqlalchemy.pool_timeout': POOL_TIMEOUT,
+            'sqlalchemy.pool_pre_ping': True,
+        })
+    if itersize is not None:
+        ITERSIZE = itersize
     ENGINE = engine_from_config(db_config)
 
 
 configure()
 
-# import sqlalchemy.pool as pool
-# import psycopg2
-#
-# def getconn():
-#     c = psycopg2.connect(user=USER, host=ADDRESS, dbname=DB_NAME, password=PASSWORD, port=PORT)
-#     return c
-#
-# mypool = pool.QueuePool(getconn, max_overflow=10, pool_size=5)
-
 
 def ensure_engine(db_uri='sqlite:///:memory:'):
     """
@@ -71,19 +88,84 @@ def ensure_connection(db_uri='sqlite:///:memory:'):
     return conn
 
 
-def get_safe_memory_read_connection(conn):
+@contextlib.contextmanager
+def read_connection(conn):
     """
-    Return a sqlalchemy connection object memory-optimized for select query only.
-    It return the input connection `conn` if it is already optimized.
+    Context manager of a sqlalchemy connection object memory-optimized for select query only:
+    results are fetched from server-side cursors (iterating a result, sqlalchemy fetches
+    the rows in buffers of at most 1000 rows; see `read_results` to set the fetch size).
+    The connection is taken from the pool of the engine of `conn`, and it is released
+    at the exit of the context. It uses the input connection `conn` if it is already optimized.
+    Usage:
+    ::
+
+        with read_connection(conn) as conn_r:
+            for record in conn_r.execute(sql):
+                ...
 
     :param conn: the input connection object
     :return: the connection object memory-optimized for select query only
     """
     if conn._execution_options.get('stream_results'):
-        return conn
+        yield conn
+        return
     new_conn = conn.engine.connect()
-    new_conn = new_conn.execution_options(stream_results=True)
-    return new_conn
+    try:
+        yield new_conn.execution_options(stream_results=True)
+    finally:
+        new_conn.close()
+
+
+def read_results(conn, sql, itersize=None):
+    """
+    Yield the records of the select query `sql`, executed on a read connection
+    (see `read_connection`), fetching `itersize` rows at each round trip (default ITERSIZE).
+    The connection is released when the records are exhausted or when the iteration
+    is closed.
+
+    :param conn: the input connection object
+    :param sql: the select query
+    :param itersize: number of rows fetched at each round trip
+    :return: the iterable of the results
+    """
+    itersize = itersize or ITERSIZE
+    with read_connection(conn) as conn_r:
+        results = conn_r.execute(sql)
+        try:
+            # sqlalchemy has already fetched the first row, to read the description of the
+            # results: the next ones are fetched directly from the cursor
+            row = results.fetchone()
+            if row is None:
+                return
+            yield row
+            rows = results.cursor.fetchmany(itersize)
+            while rows:
+                yield from results.process_rows(rows)
+                rows = results.cursor.fetchmany(itersize)
+        finally:
+            results.close()
+
+
+def pool_status(engine=None):
+    """
+    Return the statistics of the connection pool of `engine` (default is the configured
+    ENGINE), as a dictionary with keys 'size', 'checked_in', 'checked_out', 'overflow'.
+    Pools without statistics (like the ones of sqlite) return an empty dictionary.
+
+    :param engine: the engine object
+    :return: dictionary of statistics
+    """
+    if engine is None:
+        engine = ensure_engine()
+    pool = engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return dict()
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+    }
 
 
 def get_table_columns(table_name, schema='public'):
@@ -1156,10 +1156,7 @@ def process_dma_bagnatura(conn, startschema, targetschema, policy, stations_ids,
         record['provenienza'] = 'DAILY'
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'bagna'])
     logger.info('update records....')
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__bagna', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__bagna', targetschema, fields, data, policy)
     logger.info('end process DMA bagnatura fogliare')
 
 
@@ -1189,10 +1186,7 @@ def process_dma_bilancio_idrico(conn, startschema, targetschema, policy, station
         record['provenienza'] = 'DAILY'
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'deltaidro'])
     logger.info('update records....')
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__delta_idro', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__delta_idro', targetschema, fields, data, policy)
     logger.info('end process DMA bilancio idrico')
 
 
@@ -1222,10 +1216,7 @@ def process_dma_eliofania(conn, startschema, targetschema, policy, stations_ids,
         record['provenienza'] = 'DAILY'
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'elio'])
     logger.info('update records....')
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__elio', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__elio', targetschema, fields, data, policy)
     logger.info('end process DMA eliofania')
 
 
@@ -1255,10 +1246,7 @@ def process_dma_radiazione_globale(conn, startschema, targetschema, policy, stat
         record['provenienza'] = 'DAILY'
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'radglob'])
     logger.info('update records....')
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__radglob', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__radglob', targetschema, fields, data, policy)
     logger.info('end process DMA radiazione globale')
 
 
@@ -1288,10 +1276,7 @@ def process_dma_evapotraspirazione(conn, startschema, targetschema, policy, stat
         record['provenienza'] = 'DAILY'
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'etp'])
     logger.info('update records....')
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__etp', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__etp', targetschema, fields, data, policy)
     logger.info('end process DMA evapotraspirazione')
 
 
@@ -1322,10 +1307,7 @@ def process_dma_gradi_giorno(conn, startschema, targetschema, policy, stations_i
         record['provenienza'] = 'DAILY'
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'grgg'])
     logger.info('update records....')
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__grgg', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__grgg', targetschema, fields, data, policy)
     logger.info('end process DMA gradi giorno')
 
 
@@ -1356,10 +1338,7 @@ def process_dma_pressione(conn, startschema, targetschema, policy, stations_ids,
         record['provenienza'] = 'DAILY'
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'press'])
     logger.info('update records....')
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__press', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__press', targetschema, fields, data, policy)
     logger.info('end process DMA pressione atmosferica')
 
 
@@ -1391,10 +1370,7 @@ def process_dma_umidita_relativa(conn, startschema, targetschema, policy, statio
 
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'ur'])
     logger.info('update records....')
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__urel', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__urel', targetschema, fields, data, policy)
     logger.info('end process DMA umidità relativa')
 
 
@@ -1409,7 +1385,6 @@ def process_dma_bioclimatologia(conn, startschema, targetschema, policy, station
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
     """
-    conn_r = db_utils.get_safe_memory_read_connection(conn)
     logger.info('starting process DMA bioclimatologia')
     logger.info('selecting for input records...')
     station_ids_tuple = '(%s)' % repr(stations_ids)[1:-1]
@@ -1421,7 +1396,7 @@ def process_dma_bioclimatologia(conn, startschema, targetschema, policy, station
     WHERE (tmdgg1).val_md IS NOT NULL AND (ur).val_md IS NOT NULL
     AND cod_staz in %s
     ORDER BY cod_staz, data_i""" % (startschema, startschema, station_ids_tuple)
-    table_records = conn_r.execute(sql)
+    table_records = db_utils.read_results(conn, sql)
     map_funct = {
         'ifs': compute_ifs,
         'ifu': compute_ifu,
@@ -1438,10 +1413,7 @@ def process_dma_bioclimatologia(conn, startschema, targetschema, policy, station
     for record in data:
         record['provenienza'] = 'DAILY'
     logger.info('update records....')
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__bioclima', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__bioclima', targetschema, fields, data, policy)
     logger.info('end process DMA bioclimatologia')
 
 
@@ -1538,10 +1510,7 @@ def process_dma_precipitazione(conn, startschema, targetschema, policy, stations
 
     logger.info('updating table ds__prs_prec')
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'prs_prec', 'provenienza'])
-    for sub_data_prs_prec in utils.chunked_iterable(data_prs_prec, 10000):
-        sql = upsert.create_upsert('ds__prs_prec', targetschema, fields, sub_data_prs_prec, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__prs_prec', targetschema, fields, data_prs_prec, policy)
 
     logger.info('merging records before update of table ds__prec...')
     data = functools.reduce(merge_data_items, [data_prec01, data_prec24, data_prec12, data_prec06])
@@ -1553,10 +1522,7 @@ def process_dma_precipitazione(conn, startschema, targetschema, policy, stations
     fields = upsert.expand_fields(
         ['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'prec01', 'prec24', 'cl_prec24',
          'prec12', 'cl_prec12', 'prec06', 'cl_prec06'])
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__preci', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__preci', targetschema, fields, data, policy)
 
     logger.info('end process DMA precipitazione')
 
@@ -1629,10 +1595,7 @@ def process_dma_vento(conn, startschema, targetschema, policy, stations_ids, log
     logger.info('update records...')
     fields = upsert.expand_fields(
         ['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'vntmxgg', 'vntmd', 'vnt'])
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__vnt10', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__vnt10', targetschema, fields, data, policy)
     logger.info('end process DMA vento')
 
 
@@ -1689,11 +1652,8 @@ def process_dma_temperatura(conn, startschema, targetschema, policy, stations_id
     logger.info('update records of table ds__prs_t200...')
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'prs_t200mx',
                                    'prs_t200mn'])
-    for sub_data_prs in utils.chunked_iterable(data_prs, 10000):
-        sql = upsert.create_upsert('ds__prs_t200', targetschema, fields, sub_data_prs, policy)
-        if sql:
-            logger.info('updating DMA table %s.%s' % (targetschema, 'ds__prs_t200'))
-            conn.execute(sql)
+    logger.info('updating DMA table %s.%s' % (targetschema, 'ds__prs_t200'))
+    upsert.copy_upsert(conn, 'ds__prs_t200', targetschema, fields, data_prs, policy)
 
     logger.info('computing aggregations (tmdgg)...')
 
@@ -1742,10 +1702,7 @@ def process_dma_temperatura(conn, startschema, targetschema, policy, stations_id
     fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'tmdgg',
                                    'tmxgg', 'tmngg', 'cl_tmxgg', 'cl_tmngg', 'tmdgg1', 'deltagg',
                                    'day_gelo'])
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__t200', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__t200', targetschema, fields, data, policy)
     logger.info('end process DMA temperatura')
 	
 	
@@ -49,7 +49,11 @@ def make_report(in_filepath, report_path, outdata_filepath, parameters_filepath)
               help="file path of the output report. If not provided, prints on screen")
 @click.option('--outdata_folder', '-d', type=click.Path(exists=False, file_okay=False),
               help="folder path where to put the output data files")
-def make_reports(in_folder, report_path, outdata_folder):
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=1,
+              help="number of files processed in parallel. Default is 1")
+@click.option('--binary', '-b', is_flag=True,
+              help="export the parsed data in binary .npz files instead of CSV files")
+def make_reports(in_folder, report_path, outdata_folder, workers, binary):
     """
     Parse a folder containing data located at `in_folder` and generate a report.
     If outdata_folder is specified, it also export parsed data.
@@ -59,16 +63,18 @@ def make_reports(in_folder, report_path, outdata_folder):
     if outdata_folder and not exists(outdata_folder):
         mkdir(outdata_folder)
     children = sorted(listdir(in_folder))
+    in_filepaths = []
+    outdata_filepaths = []
     for child in children:
         in_filepath = join(in_folder, child)
         if not isfile(in_filepath):
             continue
-        logger.info('processing file %r' % child)
+        in_filepaths.append(in_filepath)
         if outdata_folder:
-            outdata_filepath = join(outdata_folder, child + '.csv')
+            outdata_filepaths.append(join(outdata_folder, child + (binary and '.npz' or '.csv')))
         else:
-            outdata_filepath = None
-        process.make_report(in_filepath, outdata_filepath=outdata_filepath, logger=logger)
+            outdata_filepaths.append(None)
+    process.make_reports(in_filepaths, outdata_filepaths, logger=logger, workers=workers)
     logger.info('END PROCESS')
 
 @click.command()
@@ -81,7 +87,13 @@ def make_reports(in_folder, report_path, outdata_folder):
               help="list of the locations to download. Default is all the locations of the region")
 @click.option('--report_path', '-r', type=click.Path(exists=False, dir_okay=False),
               help="file path of the output report. If not provided, prints on screen")
-def download_hiscentral(out_csv_folder, region_id, variables, locations, report_path):
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=hiscentral.DOWNLOAD_WORKERS,
+              help="number of series downloaded at the same time. Default is %s"
+                   % hiscentral.DOWNLOAD_WORKERS)
+@click.option('--overwrite', '-o', is_flag=True,
+              help="download also the series already downloaded")
+def download_hiscentral(out_csv_folder, region_id, variables, locations, report_path, workers,
+                        overwrite):
     """
     Download CSV of the HISCENTRAL for region, locations and variables selected into an
     output folder.
@@ -99,7 +111,8 @@ def download_hiscentral(out_csv_folder, region_id, variables, locations, report_
     if not exists(out_csv_folder):
         mkdir(out_csv_folder)
     ret_value = hiscentral.download_hiscentral(
-        region_id, out_csv_folder, variables, locations, logger=logger)
+        region_id, out_csv_folder, variables, locations, logger=logger, workers=workers,
+        overwrite=overwrite)
     logger.info('download completed')
     return ret_value
 
@@ -112,7 +125,12 @@ def download_hiscentral(out_csv_folder, region_id, variables, locations, report_
                    "default is %s" % db_utils.DEFAULT_DB_URI)
 @click.option('--report_path', '-r', type=click.Path(exists=False, dir_okay=False),
               help="file path of the output report. If not provided, prints on screen")
-def compute_daily_indicators(data_folder, indicators_folder, dburi, report_path):
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=1,
+              help="number of stations processed in parallel. Default is 1")
+@click.option('--temp_folder', '-t', type=click.Path(exists=True, file_okay=False),
+              help="folder for the temporary files. If not provided, uses the system default")
+def compute_daily_indicators(data_folder, indicators_folder, dburi, report_path, workers,
+                             temp_folder):
     """
     Compute daily indicators from data files located at folder `data_folder`,
     and put results as CSV files in the specified `indicators_folder`.
@@ -123,7 +141,8 @@ def compute_daily_indicators(data_folder, indicators_folder, dburi, report_path)
     conn = db_utils.ensure_connection()
     logger = utils.setup_log(report_path)
     logger.info('starting process of compute daily indicators')
-    process.compute_daily_indicators(conn, data_folder, indicators_folder, logger)
+    process.compute_daily_indicators(conn, data_folder, indicators_folder, logger,
+                                     workers=workers, temp_folder=temp_folder)
     logger.info('end process of compute daily indicators')
 
 
@@ -138,7 +157,12 @@ def compute_daily_indicators(data_folder, indicators_folder, dburi, report_path)
               help="file path of the output report. If not provided, prints on screen")
 @click.option('--er', default=False, is_flag=True,
               help="""if specified, consider ER stations (debug mode)""")
-def find_new_stations(data_folder, dburi, stations_path, report_path, er):
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=1,
+              help="number of files scanned in parallel. Default is 1")
+@click.option('--radius', type=click.FloatRange(min=0),
+              help="if specified, ARPA-ER and RMN stations are matched by name with the nearest "
+                   "station inside this radius (meters), instead of by exact coordinates")
+def find_new_stations(data_folder, dburi, stations_path, report_path, er, workers, radius):
     """
     Examine stations on data included in folder `data_folder` and creates a CSV with the new
     stations not found in the database.
@@ -150,9 +174,10 @@ def find_new_stations(data_folder, dburi, stations_path, report_path, er):
     print(msg0[0])
     db_utils.configure(dburi)
     if er:
-        msgs1, not_found_stations = querying.find_new_er_stations(data_folder, dburi)
+        msgs1, not_found_stations = querying.find_new_er_stations(data_folder, dburi, workers)
     else:
-        msgs1, not_found_stations = querying.find_new_stations(data_folder, dburi)
+        msgs1, not_found_stations = querying.find_new_stations(
+            data_folder, dburi, workers, radius)
     for msg in msgs1:
         print(msg)
     export.stations2csv(not_found_stations, stations_path, extra_fields=['source'])
@@ -233,7 +258,12 @@ def check_chain(dburi, report_path, station_where, schema, omit_flagsync):
               help="folder containing gdrive credentials."
                    "default is %s" % arpaer.DEFAULT_CREDENTIALS_FOLDER,
               default=arpaer.DEFAULT_CREDENTIALS_FOLDER)
-def download_er(start, end, download_folder, report_path, parameters_filepath, credentials_folder):
+@click.option('--extract', '-x', is_flag=True,
+              help="extract the historical .json.gz archives after the download")
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=arpaer.DOWNLOAD_WORKERS,
+              help="number of parallel downloads. Default is %s" % arpaer.DOWNLOAD_WORKERS)
+def download_er(start, end, download_folder, report_path, parameters_filepath, credentials_folder,
+                extract, workers):
     """
     Download utility for ARPA Emilia-Romagna.
     """
@@ -261,7 +291,8 @@ def download_er(start, end, download_folder, report_path, parameters_filepath, c
         sys.exit(2)
     arpaer.download_er(
         download_folder, start, end, parameters_filepath=parameters_filepath,
-        credentials_folder=credentials_folder, logger=logger)
+        credentials_folder=credentials_folder, logger=logger, extract=extract,
+        workers=workers)
     logger.info('download completed')
 
 
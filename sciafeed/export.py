@@ -12,51 +12,139 @@ This module contains the functions and utilities to export data structure to fil
 - flag: a boolean flag to consider valid or not the value
 """
 import csv
-from datetime import datetime
+from datetime import datetime, timedelta
+import itertools
+import mmap
 import operator
+import os
+import re
+
+import numpy as np
+
+from sciafeed import batch
+from sciafeed import utils
 
 ROUND_PRECISION = 1
+CSV_FIELDNAMES = ['cod_utente', 'cod_rete', 'date', 'time', 'parameter', 'value', 'valid',
+                  'source', 'format', 'lat', 'lon']
+# metadata of the stations stored in the binary files (see `export2npz`)
+NPZ_STATION_FIELDS = ['cod_utente', 'cod_rete', 'source', 'format', 'lat', 'lon']
+# extensions of the files of data exported (see `export_data` and `load_data`)
+DATA_EXTENSIONS = ('.csv', '.npz')
 
 
-def export2csv(data, out_filepath, omit_parameters=(), omit_missing=True):
+def station_fields(metadata):
+    """
+    Return the values of the fields NPZ_STATION_FIELDS of a station, as written by the
+    function `export2csv`.
+
+    :param metadata: the metadata of the station
+    :return: the list of strings of the values
+    """
+    cod_utente = metadata.get('cod_utente_prefix', '') + metadata.get('cod_utente', '')
+    ret_value = [cod_utente]
+    for field in NPZ_STATION_FIELDS[1:]:
+        value = metadata.get(field, '')
+        ret_value.append('' if value is None else str(value))
+    return ret_value
+
+
+def date_fields(current_date):
+    """
+    Return the strings of date and time of `current_date`, as written by the function
+    `export2csv`. The time is '' if `current_date` is a datetime.date.
+
+    :param current_date: datetime.datetime or datetime.date object
+    :return: (date string, time string)
+    """
+    if isinstance(current_date, datetime):
+        return current_date.strftime('%Y-%m-%d'), current_date.strftime('%H:%M:%S')
+    return current_date.strftime('%Y-%m-%d'), ''
+
+
+def prepare_batch(measure_batch, omit_parameters=(), omit_missing=True, presorted=False):
+    """
+    Return a copy of `measure_batch` with the measures to export, as the function `export2csv`
+    selects them: sorted by date, without the parameters to omit and with the values rounded
+    to ROUND_PRECISION.
+
+    :param measure_batch: `batch.MeasureBatch` instance
+    :param omit_parameters: list of the parameters to omit
+    :param omit_missing: if False, include also values marked as missing
+    :param presorted: if True, assume `measure_batch` already sorted by date
+    :return: the new `batch.MeasureBatch` instance
+    """
+    if not presorted:
+        measure_batch = measure_batch.take(np.argsort(measure_batch.times, kind='stable'))
+    omitted_idx = [i for i, par_code in enumerate(measure_batch.par_codes)
+                   if par_code in omit_parameters]
+    selected = ~np.isin(measure_batch.par_idx, omitted_idx)
+    if omit_missing:
+        selected &= ~np.isnan(measure_batch.values)
+    measure_batch = measure_batch.take(selected)
+    measure_batch.values = utils.Conversion('X', round_precision=ROUND_PRECISION)(
+        measure_batch.values)
+    return measure_batch
+
+
+def export2csv(data, out_filepath, omit_parameters=(), omit_missing=True, presorted=False):
     """
     Write `data` as CSV file on the path `out_filepath` according to agreed conventions.
     `data` is formatted according to the output of the function `parse`.
+    If `presorted` is True, `data` can be any iterable of measures already sorted by date
+    (for example as yielded by `parsing.iter_parse`): the measures are written as they come,
+    without loading them all in memory.
+    `data` can also be a `batch.MeasureBatch`.
 
     :param data: python structure for climatologic data
     :param out_filepath: output file where to write the data
     :param omit_parameters: list of the parameters to omit
     :param omit_missing: if False, include also values marked as missing
+    :param presorted: if True, assume `data` already sorted by date
     """
-    fieldnames = ['cod_utente', 'cod_rete', 'date', 'time', 'parameter', 'value', 'valid',
-                  'source', 'format', 'lat', 'lon']
     with open(out_filepath, 'w') as csv_out_file:
-        writer = csv.DictWriter(csv_out_file, fieldnames=fieldnames, delimiter=';')
-        writer.writeheader()
-        for measure in sorted(data, key=operator.itemgetter(1)):
-            metadata, current_date, par_code, par_value, par_flag = measure
+        writer = csv.writer(csv_out_file, delimiter=';')
+        writer.writerow(CSV_FIELDNAMES)
+        if isinstance(data, batch.MeasureBatch):
+            measure_batch = prepare_batch(data, omit_parameters, omit_missing, presorted)
+            stations_fields = [station_fields(metadata) for metadata in measure_batch.stations]
+            # the strings of each distinct time are computed once
+            times, times_idx = np.unique(measure_batch.times, return_inverse=True)
+            row_dates = [batch.EPOCH + timedelta(microseconds=micro_secs)
+                         for micro_secs in times.tolist()]
+            if measure_batch.dates_only:
+                row_dates = [row_date.date() for row_date in row_dates]
+            times_fields = [date_fields(row_date) for row_date in row_dates]
+            for st_idx, time_idx, p_idx, value, flag in zip(
+                    measure_batch.station_idx.tolist(), times_idx.ravel().tolist(),
+                    measure_batch.par_idx.tolist(), measure_batch.values.tolist(),
+                    measure_batch.flags.tolist()):
+                cod_utente, cod_rete, source, format_label, lat, lon = stations_fields[st_idx]
+                date_str, time_str = times_fields[time_idx]
+                writer.writerow([
+                    cod_utente, cod_rete, date_str, time_str, measure_batch.par_codes[p_idx],
+                    None if value != value else value, flag and '1' or '0', source,
+                    format_label, lat, lon])
+            return
+        if not presorted:
+            data = sorted(data, key=operator.itemgetter(1))
+        last_date = last_metadata = None
+        for metadata, current_date, par_code, par_value, par_flag in data:
             if par_code in omit_parameters:
                 continue
-            if omit_missing and par_value is None:
-                continue
             if par_value is not None:
                 par_value = round(par_value, ROUND_PRECISION)
-            cod_utente = metadata.get('cod_utente_prefix', '') + metadata.get('cod_utente', '')
-            ttime = isinstance(current_date, datetime) and current_date.strftime('%H:%M:%S') or ''
-            row = {
-                'cod_utente': cod_utente,
-                'cod_rete': metadata.get('cod_rete', ''),
-                'date': current_date.strftime('%Y-%m-%d'),
-                'time': ttime,
-                'parameter': par_code,
-                'value': par_value,
-                'valid': par_flag and '1' or '0',
-                'source': metadata.get('source', ''),
-                'format': metadata.get('format', ''),
-                'lat': metadata.get('lat', ''),
-                'lon': metadata.get('lon', ''),
-            }
-            writer.writerow(row)
+            elif omit_missing:
+                continue
+            # the measures of the same time and station are consecutive
+            if current_date != last_date:
+                date_str, time_str = date_fields(current_date)
+                last_date = current_date
+            if metadata is not last_metadata:
+                cod_utente, cod_rete, source, format_label, lat, lon = station_fields(metadata)
+                last_metadata = metadata
+            writer.writerow([cod_utente, cod_rete, date_str, time_str, par_code, par_value,
+                             par_flag and '1' or '0', source, format_label, lat, lon])
 
 
 def csv2data(csv_path):
@@ -67,6 +155,9 @@ def csv2data(csv_path):
     :return: the data object
     """
     data = []
+    # a parser for each file: the hourly rows of the same day share the decoding of the day
+    parse_datetime = utils.date_parser('%Y-%m-%dT%H:%M:%S')
+    parse_day = utils.date_parser('%Y-%m-%d')
     with open(csv_path) as csv_in_file:
         reader = csv.DictReader(csv_in_file, delimiter=';')
         for row in reader:
@@ -83,10 +174,9 @@ def csv2data(csv_path):
                 'lon': row['lon'],
             }
             if row['time']:
-                current_date = datetime.strptime("%sT%s" % (row['date'], row['time']),
-                                                 '%Y-%m-%dT%H:%M:%S')
+                current_date = parse_datetime("%sT%s" % (row['date'], row['time']))
             else:
-                current_date = datetime.strptime("%sT00:00" % row['date'], '%Y-%m-%dT%H:%M').date()
+                current_date = parse_day(row['date']).date()
             par_code = row['parameter']
             par_value = par_value
             par_flag = row['valid'] == '1' and True or False
@@ -95,6 +185,190 @@ def csv2data(csv_path):
     return data
 
 
+def export2npz(data, out_filepath, omit_parameters=(), omit_missing=True, presorted=False):
+    """
+    As the function `export2csv`, but the file written is a binary columnar file with the
+    same content, in NumPy .npz format: the function `npz2batch` reads it without any
+    parsing.
+
+    :param data: python structure for climatologic data (or `batch.MeasureBatch`)
+    :param out_filepath: output file where to write the data
+    :param omit_parameters: list of the parameters to omit
+    :param omit_missing: if False, include also values marked as missing
+    :param presorted: if True, assume `data` already sorted by date
+    """
+    if not isinstance(data, batch.MeasureBatch):
+        data = batch.MeasureBatch.from_measures(data)
+    measure_batch = prepare_batch(data, omit_parameters, omit_missing, presorted)
+    # the stations are identified by the fields written
+    stations = []
+    stations_map = dict()
+    new_station_idx = []
+    for metadata in measure_batch.stations:
+        fields = tuple(station_fields(metadata))
+        new_station_idx.append(stations_map.setdefault(fields, len(stations_map)))
+        if len(stations_map) > len(stations):
+            stations.append(fields)
+    station_idx = np.asarray(new_station_idx, dtype=np.int32)[measure_batch.station_idx]
+    # the times are written in seconds
+    times = measure_batch.times - measure_batch.times % 1000000
+    with open(out_filepath, 'wb') as npz_out_file:
+        np.savez(npz_out_file,
+                 stations=np.array(stations, dtype=str).reshape(-1, len(NPZ_STATION_FIELDS)),
+                 station_idx=station_idx, times=times,
+                 par_codes=np.array(measure_batch.par_codes, dtype=str),
+                 par_idx=measure_batch.par_idx, values=measure_batch.values,
+                 flags=measure_batch.flags, dates_only=measure_batch.dates_only)
+
+
+def npz2batch(npz_path):
+    """
+    Read a file written by the function `export2npz` and return its measures as a
+    `batch.MeasureBatch`. The metadata of the stations contain the fields NPZ_STATION_FIELDS,
+    as the ones returned by the function `csv2data`.
+
+    :param npz_path: path of the .npz file
+    :return: the `batch.MeasureBatch` instance
+    """
+    with np.load(npz_path) as npz_file:
+        stations = [dict(zip(NPZ_STATION_FIELDS, fields))
+                    for fields in npz_file['stations'].tolist()]
+        times = npz_file['times']
+        return batch.MeasureBatch(
+            stations, npz_file['station_idx'], np.full(len(times), -1), times,
+            npz_file['par_codes'].tolist(), npz_file['par_idx'], npz_file['values'],
+            npz_file['flags'], bool(npz_file['dates_only']))
+
+
+def npz2data(npz_path):
+    """
+    inverse of function `export2npz`: as the function `csv2data`, for the .npz files.
+
+    :param npz_path: path of the .npz file
+    :return: the data object
+    """
+    return list(npz2batch(npz_path).iter_measures())
+
+
+def unique_counted(iterable):
+    """
+    Return the list of the distinct elements of `iterable`, in order of first appearance, and
+    the number of elements of `iterable`.
+
+    :param iterable: iterable of hashable elements
+    :return: ([distinct element, ...], number of elements)
+    """
+    counter = itertools.count()
+    # the counter is advanced once for each element (zip stops before advancing it again)
+    unique_elements = list(dict.fromkeys(element for element, _ in zip(iterable, counter)))
+    return unique_elements, next(counter)
+
+
+def csv2stations(csv_path):
+    """
+    Scan a CSV file written by the function `export2csv` reading only the metadata of the
+    stations. Return the number of measures and the list of the distinct metadata of the
+    stations, in order of first appearance: each metadata is a dictionary with keys
+    NPZ_STATION_FIELDS, equal to the metadata returned by the function `csv2data`.
+    The file is memory-mapped and only the fields of the stations are extracted from the rows.
+
+    :param csv_path: file to the CSV containing the data
+    :return: (number of measures, [metadata of station, ...])
+    """
+    with open(csv_path, 'rb') as csv_in_file:
+        if os.fstat(csv_in_file.fileno()).st_size == 0:
+            return 0, []
+        with mmap.mmap(csv_in_file.fileno(), 0, access=mmap.ACCESS_READ) as csv_map:
+            header_end = csv_map.find(b'\n') + 1 or len(csv_map)
+            header = csv_map[:header_end].decode().rstrip('\r\n').split(';')
+            columns = sorted(header.index(field) for field in NPZ_STATION_FIELDS)
+            if csv_map.find(b'"', header_end) == -1:
+                # no quoted fields: the rows are matched directly on the mapped file, each
+                # group of consecutive columns of the stations is captured as a whole
+                row_pattern = b'^'
+                for column in range(len(header)):
+                    if column in columns and column - 1 not in columns:
+                        row_pattern += b'('
+                    row_pattern += b'[^;\r\n]*'
+                    if column in columns and column + 1 not in columns:
+                        row_pattern += b')'
+                    if column < len(header) - 1:
+                        row_pattern += b';'
+                row_pattern = re.compile(row_pattern + b'\r?$', re.MULTILINE)
+                keys = (match.groups() for match in row_pattern.finditer(csv_map, header_end))
+                stations_values, num_records = unique_counted(keys)
+                stations_values = [b';'.join(key).decode().split(';') for key in stations_values]
+            else:
+                csv_map.seek(header_end)
+                rows = csv.reader((line.decode() for line in iter(csv_map.readline, b'')),
+                                  delimiter=';')
+                keys = (tuple(row[column] for column in columns) for row in rows if row)
+                stations_values, num_records = unique_counted(keys)
+    fields_order = [columns.index(header.index(field)) for field in NPZ_STATION_FIELDS]
+    stations = [dict(zip(NPZ_STATION_FIELDS, (values[i] for i in fields_order)))
+                for values in stations_values]
+    return num_records, stations
+
+
+def npz2stations(npz_path):
+    """
+    As the function `csv2stations`, for a file written by the function `export2npz`:
+    only the metadata of the stations are read from the file.
+
+    :param npz_path: path of the .npz file
+    :return: (number of measures, [metadata of station, ...])
+    """
+    with np.load(npz_path) as npz_file:
+        station_idx = npz_file['station_idx']
+        stations_fields = npz_file['stations'].tolist()
+    found_idx, first_positions = np.unique(station_idx, return_index=True)
+    stations = [dict(zip(NPZ_STATION_FIELDS, stations_fields[idx]))
+                for idx in found_idx[np.argsort(first_positions)].tolist()]
+    return len(station_idx), stations
+
+
+def load_stations(data_path):
+    """
+    Return the number of measures and the distinct metadata of the stations of a file written
+    by the function `export2csv` or `export2npz`, according to the extension
+    (see `csv2stations`).
+
+    :param data_path: path of the file
+    :return: (number of measures, [metadata of station, ...])
+    """
+    if data_path.lower().endswith('.npz'):
+        return npz2stations(data_path)
+    return csv2stations(data_path)
+
+
+def export_data(data, out_filepath, **kwargs):
+    """
+    Write `data` on the path `out_filepath` with the function `export2npz` if its extension is
+    '.npz', otherwise with the function `export2csv`.
+
+    :param data: python structure for climatologic data (or `batch.MeasureBatch`)
+    :param out_filepath: output file where to write the data
+    :param kwargs: other parameters of `export2csv`
+    """
+    if out_filepath.lower().endswith('.npz'):
+        export2npz(data, out_filepath, **kwargs)
+    else:
+        export2csv(data, out_filepath, **kwargs)
+
+
+def load_data(data_path):
+    """
+    inverse of function `export_data`: read the data of a file written by the function
+    `export2csv` or `export2npz`, according to the extension.
+
+    :param data_path: path of the file
+    :return: the data object
+    """
+    if data_path.lower().endswith('.npz'):
+        return npz2data(data_path)
+    return csv2data(data_path)
+
+
 def stations2csv(stations, stations_path, extra_fields=()):
     """
     Export the list of information about stations into a CSV located at `stations_path`.
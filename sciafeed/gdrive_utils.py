@@ -1,12 +1,28 @@
-from os.path import exists, join
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import os
+from os.path import basename, exists, getsize, join
 import pickle
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 
+DOWNLOAD_URL = 'https://docs.google.com/uc?export=download'
+CHUNK_SIZE = 32768
+# suffix of the files partially downloaded
+PARTIAL_SUFFIX = '.part'
+# default number of retries of a failed download and base seconds of the backoff
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 1.
+# default seconds to wait the server before retrying
+DOWNLOAD_TIMEOUT = 60
+
 
 def get_gdrive_credentials(credentials_folder):
     creds = None
@@ -65,13 +81,183 @@ def get_gdrive_filelist(folder_id, credentials_folder):
     return ret_value
 
 
-def download_gdrive_public_file(file_id, output_path):
-    """download a public shared google drive file"""
-    session = requests.Session()
-    DOWNLOAD_URL = 'https://docs.google.com/uc?export=download'
-    CHUNK_SIZE = 32768
-    response = session.get(DOWNLOAD_URL, params={'id': file_id}, stream=True)
-    with open(output_path, 'wb') as f:
-        for chunk in response.iter_content(CHUNK_SIZE):
-            if chunk:  # filter out keep-alive new chunks
-                f.write(chunk)
+def file_sha256(filepath, chunk_size=CHUNK_SIZE):
+    """
+    Return the SHA-256 hex digest of the file located at `filepath`.
+
+    :param filepath: path of the file
+    :param chunk_size: number of bytes read at once
+    :return: the hex digest string
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_gdrive_public_file(file_id, output_path, session=None, url=None,
+                                max_retries=DOWNLOAD_RETRIES, backoff=DOWNLOAD_BACKOFF,
+                                timeout=DOWNLOAD_TIMEOUT, partial_folder=None):
+    """
+    Download a public shared google drive file into `output_path`.
+    Data are written in the file `output_path` + PARTIAL_SUFFIX (inside `partial_folder`,
+    if not None), moved to `output_path` when the download is completed: if a partial file
+    is found, the download resumes from its end (when the server supports range requests,
+    otherwise it restarts from the beginning).
+    A failed request is retried `max_retries` times, waiting `backoff` seconds before the
+    first retry and doubling the wait at each one.
+    Return the tuple (size, SHA-256 hex digest) of the file downloaded.
+
+    :param file_id: id of the google drive file
+    :param output_path: path of the file to write
+    :param session: the requests.Session to use (if None, a new one is created)
+    :param url: the download url (default is DOWNLOAD_URL)
+    :param max_retries: max number of retries of a failed request
+    :param backoff: seconds to wait before the first retry
+    :param timeout: seconds to wait for a server feedback before considering it failed
+    :param partial_folder: folder of the partial file (default is the folder of `output_path`)
+    :return: (size, sha256)
+    """
+    if session is None:
+        session = requests.Session()
+    if url is None:
+        url = DOWNLOAD_URL
+    part_path = output_path + PARTIAL_SUFFIX
+    if partial_folder is not None:
+        part_path = join(partial_folder, basename(part_path))
+    attempt = 0
+    while True:
+        offset = getsize(part_path) if exists(part_path) else 0
+        headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+        try:
+            with session.get(url, params={'id': file_id}, headers=headers, stream=True,
+                             timeout=timeout) as response:
+                if response.status_code == 416:  # range not satisfiable
+                    total_size = response.headers.get('Content-Range', '').split('/')[-1]
+                    if total_size == str(offset):  # partial file already completed
+                        break
+                    os.remove(part_path)
+                    continue
+                response.raise_for_status()
+                mode = 'wb'
+                if response.status_code == 206:
+                    # bytes <start>-<end>/<total size>
+                    content_range = response.headers.get('Content-Range', '')
+                    range_start = content_range.split(' ')[-1].split('-')[0]
+                    if range_start != str(offset):
+                        if not offset:
+                            raise requests.HTTPError(
+                                'unexpected Content-Range %r' % content_range, response=response)
+                        # not the range requested: restart from the beginning
+                        os.remove(part_path)
+                        continue
+                    mode = 'ab'
+                with open(part_path, mode) as fp:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        if chunk:  # filter out keep-alive new chunks
+                            fp.write(chunk)
+            break
+        except requests.RequestException as err:
+            status_code = getattr(err.response, 'status_code', None)
+            if status_code and 400 <= status_code < 500 and status_code != 429:
+                raise
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            time.sleep(backoff * 2 ** (attempt - 1))
+    os.replace(part_path, output_path)
+    return getsize(output_path), file_sha256(output_path)
+
+
+def download_gdrive_public_files(downloads, workers=4, session=None, **kwargs):
+    """
+    Download a list of public shared google drive files in parallel, using a pool of
+    `workers` threads sharing the same `session`. `downloads` is a list of tuples
+    (file id, output path). Yield, as soon as each download ends, the tuples
+    (file id, output path, result), where result is the tuple (size, sha256) returned by
+    `download_gdrive_public_file` or the exception raised by the failed download.
+
+    :param downloads: list of (file id, output path)
+    :param workers: number of downloads running at the same time
+    :param session: the requests.Session to use (if None, a new one is created)
+    :param kwargs: additional parameters of the function `download_gdrive_public_file`
+    :return: iterable of (file id, output path, result)
+    """
+    if session is None:
+        session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(download_gdrive_public_file, file_id, output_path,
+                            session=session, **kwargs): (file_id, output_path)
+            for file_id, output_path in downloads}
+        for future in as_completed(futures):
+            file_id, output_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as err:
+                result = err
+            yield file_id, output_path, result
+
+
+def load_manifest(manifest_path):
+    """
+    Load the manifest of the downloaded files, i.e. a JSON dictionary of kind:
+    ::
+
+        {filename: {'file_id': ..., 'size': ..., 'sha256': ..., 'saved_as': ...}, ...}
+
+    where 'saved_as' is the name of the file kept on disk (it differs from the filename
+    if the downloaded file has been extracted). Return an empty dictionary if the
+    manifest does not exist.
+
+    :param manifest_path: path of the manifest
+    :return: the manifest dictionary
+    """
+    if not exists(manifest_path):
+        return dict()
+    with open(manifest_path) as fp:
+        return json.load(fp)
+
+
+def save_manifest(manifest_path, manifest):
+    """
+    Save the manifest of the downloaded files (see `load_manifest`) at `manifest_path`.
+    The manifest is replaced atomically, so an interrupted run does not corrupt it.
+
+    :param manifest_path: path of the manifest
+    :param manifest: the manifest dictionary
+    """
+    tmp_path = manifest_path + PARTIAL_SUFFIX
+    with open(tmp_path, 'w') as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def is_downloaded(manifest, folder, filename, file_id):
+    """
+    Return True if the manifest reports the file `filename` with id `file_id` as downloaded
+    in `folder`, and the file kept is still there (with the same size and SHA-256 digest,
+    if not extracted).
+
+    :param manifest: the manifest dictionary (see `load_manifest`)
+    :param folder: folder of the downloads
+    :param filename: name of the downloaded file
+    :param file_id: id of the file
+    :return: True if the file is already downloaded, False otherwise
+    """
+    entry = manifest.get(filename)
+    if not entry or entry.get('file_id') != file_id:
+        return False
+    saved_path = join(folder, entry.get('saved_as', filename))
+    if not exists(saved_path):
+        return False
+    if entry.get('saved_as', filename) != filename:
+        # extracted: the digest recorded is of the compressed file
+        return True
+    if getsize(saved_path) != entry.get('size'):
+        return False
+    return file_sha256(saved_path) == entry.get('sha256')
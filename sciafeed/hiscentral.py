@@ -1,13 +1,18 @@
 """
 This module contains the functions and utilities to download and parse a HISCENTRAL file
 """
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import csv
-from datetime import datetime
+import itertools
 import logging
-import xml.dom.minidom
-from os.path import abspath, basename, dirname, join, splitext
+import os
+import threading
+from xml.etree import ElementTree
+from os.path import abspath, basename, dirname, exists, join, splitext
 from pathlib import PurePath
 import zeep
+import zeep.cache
+import zeep.transports
 
 from sciafeed import TEMPLATES_PATH, LOG_NAME
 from sciafeed import utils
@@ -16,6 +21,8 @@ from sciafeed import utils
 MISSING_VALUE_MARKER = '-9999'
 FORMAT_LABEL = 'HISCENTRAL'
 ALLOWED_PARAMETERS = ('Precipitation', 'Tmax', 'Tmin')
+# cheap necessary conditions for a file to be of this format (see `parsing.guess_format`)
+FORMAT_SIGNATURE = {'extensions': ('.csv', ), 'filename_pattern': r'^(?=.*-)(?=.*_)'}
 FIELDNAMES = ['time', 'DataValue', 'UTCOffset', 'Qualifier', 'CensorCode', 'DateTimeUTC',
               'MethodCode', 'SourceCode', 'QualityControlLevelCode']
 PARAMETERS_FILEPATH = join(TEMPLATES_PATH, 'hiscentral_params.csv')
@@ -43,6 +50,17 @@ WSDL_URLS = {
     '20': "http://hydrolite.ddns.net/italia/hsl-sar/index.php/default/services/cuahsi_1_1.asmx?WSDL",
     '21': "http://hydrolite.ddns.net/italia/hsl-bol/index.php/default/services/cuahsi_1_1.asmx?WSDL",
 }
+# path of the on-disk cache of the WSDL documents (None for the zeep default location),
+# and seconds of validity of the cached documents
+WSDL_CACHE_PATH = None
+WSDL_CACHE_TIMEOUT = 86400
+# the zeep clients already built: {wsdl_url: client}
+WSDL_CLIENTS = dict()
+WSDL_CLIENTS_LOCK = threading.Lock()
+# number of series of a region downloaded at the same time
+DOWNLOAD_WORKERS = 4
+# number of characters of a XML response decoded at once
+XML_CHUNK_SIZE = 65536
 # # from dailypdbadmclima.geo_entihiscentral
 REGION_IDS_MAP = {
     '01': "PIEMONTE",
@@ -70,6 +88,25 @@ REGION_IDS_MAP = {
 }
 
 
+def get_wsdl_client(wsdl_url, cache_path=WSDL_CACHE_PATH, cache_timeout=WSDL_CACHE_TIMEOUT):
+    """
+    Return the zeep client of the WSDL service at `wsdl_url`. The client is built once for
+    each URL and then reused (also by different threads); the WSDL documents are cached on
+    disk at `cache_path` for `cache_timeout` seconds, so they are not downloaded at each run.
+
+    :param wsdl_url: WSDL URL
+    :param cache_path: path of the SQLite cache of the WSDL documents (None for the default)
+    :param cache_timeout: seconds of validity of the cached documents
+    :return: the zeep.Client instance
+    """
+    with WSDL_CLIENTS_LOCK:
+        if wsdl_url not in WSDL_CLIENTS:
+            cache = zeep.cache.SqliteCache(path=cache_path, timeout=cache_timeout)
+            transport = zeep.transports.Transport(cache=cache)
+            WSDL_CLIENTS[wsdl_url] = zeep.Client(wsdl=wsdl_url, transport=transport)
+        return WSDL_CLIENTS[wsdl_url]
+
+
 def get_wsdl_service_response(wsdl_url, method_name, **kwargs):  # pragma: no cover
     """
     Connect to a WSDL service and call `method_name`
@@ -77,13 +114,60 @@ def get_wsdl_service_response(wsdl_url, method_name, **kwargs):  # pragma: no co
     :param wsdl_url: WSDL URL
     :param method_name: the service name to call
     :param kwargs: the keyword arguments to pass to the method
-    :return: the xml string of the response
+    :return: the xml string of the response (the whole response, read in memory)
     """
-    service = zeep.Client(wsdl=wsdl_url).service
+    service = get_wsdl_client(wsdl_url).service
     xml_string = getattr(service, method_name)(**kwargs)
     return xml_string
 
 
+def iter_xml_elements(xml_string, tag_name, chunk_size=XML_CHUNK_SIZE):
+    """
+    Decode incrementally the XML `xml_string` and yield its elements with local name
+    `tag_name` (i.e. ignoring the namespace) as soon as they are complete.
+    Each element yielded is cleared and detached from its parent when the iteration goes on,
+    so the memory used does not depend on the number of elements.
+
+    :param xml_string: the XML string (or bytes)
+    :param tag_name: the name of the elements to yield
+    :param chunk_size: number of characters decoded at once
+    :return: iterable of xml.etree.ElementTree.Element
+    """
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    parents = []
+    chunks = (xml_string[i:i + chunk_size] for i in range(0, len(xml_string), chunk_size))
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            parser.close()
+        else:
+            parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag.rsplit('}', 1)[-1] == tag_name:
+                yield elem
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+
+
+def find_xml_text(elem, tag_name):
+    """
+    Return the text of the first sub element of `elem` with local name `tag_name`
+    (i.e. ignoring the namespace), or None if not found.
+
+    :param elem: the xml.etree.ElementTree.Element where to search
+    :param tag_name: the name of the sub element
+    :return: the text of the sub element
+    """
+    for sub_elem in elem.iter():
+        if sub_elem is not elem and sub_elem.tag.rsplit('}', 1)[-1] == tag_name:
+            return sub_elem.text
+    return None
+
+
 def get_region_variables(region_id):
     """
     Connect to the service to get the variables managed by a region.
@@ -97,18 +181,16 @@ def get_region_variables(region_id):
     """
     wsdl_url = WSDL_URLS[region_id]
     vars_xml = get_wsdl_service_response(wsdl_url, 'GetVariables')
-    doc = xml.dom.minidom.parseString(vars_xml)
     variables = dict()
-    var_elems = doc.getElementsByTagName("variable")
     key_tag_map = [
         ('code', 'variableCode'),
         ('name', 'variableName'),
         ('unit', 'unitAbbreviation'),
     ]
-    for var_elem in var_elems:
+    for var_elem in iter_xml_elements(vars_xml, 'variable'):
         var_properties = dict()
         for key, tag_name in key_tag_map:
-            var_properties[key] = var_elem.getElementsByTagName(tag_name)[0].firstChild.nodeValue
+            var_properties[key] = find_xml_text(var_elem, tag_name)
         var_code = var_properties['code']
         variables[var_code] = var_properties
     return variables
@@ -127,19 +209,16 @@ def get_region_locations(region_id):
     """
     wsdl_url = WSDL_URLS[region_id]
     sites_xml = get_wsdl_service_response(wsdl_url, 'GetSites')
-    doc = xml.dom.minidom.parseString(sites_xml)
     locations = dict()
-    site_elems = doc.getElementsByTagName("site")
     key_tag_map = [
         ('code', 'siteCode'),
         ('name', 'siteName'),
         ('lat', 'latitude'),
         ('lon', 'longitude')]
-    for site_elem in site_elems:
-        site_info = site_elem.firstChild
+    for site_elem in iter_xml_elements(sites_xml, 'site'):
         site_properties = dict()
         for key, tag_name in key_tag_map:
-            site_properties[key] = site_info.getElementsByTagName(tag_name)[0].firstChild.nodeValue
+            site_properties[key] = find_xml_text(site_elem, tag_name)
         site_code = site_properties['code']
         locations[site_code] = site_properties
     return locations
@@ -148,7 +227,11 @@ def get_region_locations(region_id):
 def download_series(region_id, variable, location, out_csv_path, logger=None):
     """
     Download the series of a region for a specified variable and station.
-    The series is saved into a CSV located at `out_csv_path`.
+    The series is saved into a CSV located at `out_csv_path`: the CSV is written with a
+    temporary name and renamed at the end, so an interrupted download does not leave
+    a CSV apparently complete. The rows are written while the XML response is decoded.
+    Note that only the decoding is streamed: the SOAP client returns the raw GetValues
+    response as a single string, so the whole response is still held in memory.
 
     :param region_id: the id of the region
     :param variable: the code of the variable
@@ -164,7 +247,6 @@ def download_series(region_id, variable, location, out_csv_path, logger=None):
     series_xml = get_wsdl_service_response(wsdl_url, 'GetValues',
                                            location=location, variable=variable)
     logger.debug('  ...and writing CSV on path %s' % out_csv_path)
-    doc = xml.dom.minidom.parseString(series_xml)
     key_tag_map = {
         'time': 'dateTime',
         'DataValue': 'DataValue',
@@ -176,23 +258,59 @@ def download_series(region_id, variable, location, out_csv_path, logger=None):
         'SourceCode': 'sourceCode',
         'QualityControlLevelCode': 'qualityControlLevelCode'}
     fieldnames = list(key_tag_map.keys())
-    value_elems = doc.getElementsByTagName("value")
-    with open(out_csv_path, 'w') as csv_file:
-        csv_writer = csv.DictWriter(csv_file, fieldnames=fieldnames, delimiter=';')
-        csv_writer.writeheader()
-        for value_elem in value_elems:
-            attrs = dict(value_elem.attributes.items())
-            row = dict()
-            for fieldname in fieldnames:
-                row[fieldname] = attrs.get(key_tag_map[fieldname], 'NA')
-            row['time'] = row['time'].split('T')[0]
-            row['DateTimeUTC'] = row['DateTimeUTC'].replace('T', ' ')
-            row['DataValue'] = value_elem.firstChild.nodeValue
+    attr_names = [key_tag_map[fieldname] for fieldname in fieldnames]
+    time_index = fieldnames.index('time')
+    value_index = fieldnames.index('DataValue')
+    utc_index = fieldnames.index('DateTimeUTC')
+    tmp_csv_path = out_csv_path + '.part'
+    with open(tmp_csv_path, 'w') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=';')
+        csv_writer.writerow(fieldnames)
+        for value_elem in iter_xml_elements(series_xml, 'value'):
+            attrs = value_elem.attrib
+            row = [attrs.get(attr_name, 'NA') for attr_name in attr_names]
+            row[time_index] = row[time_index].split('T')[0]
+            row[utc_index] = row[utc_index].replace('T', ' ')
+            row[value_index] = value_elem.text
             csv_writer.writerow(row)
+    os.replace(tmp_csv_path, out_csv_path)
+
+
+def is_series_complete(csv_path):
+    """
+    Return True if the CSV of a series located at `csv_path` exists and it is complete,
+    i.e. it has the expected header and its last line is terminated.
+
+    :param csv_path: the file path of the CSV of a series
+    :return: True if the CSV is complete, False otherwise
+    """
+    if not exists(csv_path):
+        return False
+    with open(csv_path, 'rb') as fp:
+        header = fp.readline().rstrip(b'\r\n').decode('utf-8', 'replace')
+        if header.split(';') != FIELDNAMES:
+            return False
+        fp.seek(-1, os.SEEK_END)
+        return fp.read(1) == b'\n'
 
 
 # download entry point
-def download_hiscentral(region_id, out_csv_folder, variables=None, locations=None, logger=None):
+def download_hiscentral(region_id, out_csv_folder, variables=None, locations=None, logger=None,
+                        workers=DOWNLOAD_WORKERS, overwrite=False):
+    """
+    Download the series of a region for the selected variables and locations into CSV files
+    of the folder `out_csv_folder`. At most `workers` series are downloaded at the same time.
+    The series whose CSV is already complete (see `is_series_complete`) are skipped,
+    unless `overwrite` is True.
+
+    :param region_id: the id of the region
+    :param out_csv_folder: the folder where to save the CSV files
+    :param variables: list of the variable codes (default is all the variables of the region)
+    :param locations: list of the station codes (default is all the stations of the region)
+    :param logger: logging object where to report actions
+    :param workers: number of series downloaded at the same time
+    :param overwrite: if True, download also the series already downloaded
+    """
     if logger is None:
         logger = logging.getLogger(LOG_NAME)
     if locations is None:
@@ -200,14 +318,29 @@ def download_hiscentral(region_id, out_csv_folder, variables=None, locations=Non
     if variables is None:
         variables = get_region_variables(region_id)
     file_number = len(locations) * len(variables)
-    i = 1
+    series = []
     for location in locations:
         for variable in variables:
             out_csv_name = "serie_%s-reg.%s%s.csv" \
                            % (location, REGION_IDS_MAP[region_id].lower(), variable.capitalize())
             out_csv_path = join(out_csv_folder, out_csv_name)
-            logger.info("processing %s/%s ..." % (i, file_number))
-            download_series(region_id, variable, location, out_csv_path, logger=logger)
+            if not overwrite and is_series_complete(out_csv_path):
+                logger.info("%s already downloaded: skipped" % out_csv_name)
+                continue
+            series.append((variable, location, out_csv_path))
+    i = file_number - len(series) + 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(download_series, region_id, variable, location, out_csv_path,
+                            logger=logger): out_csv_path
+            for variable, location, out_csv_path in series}
+        for future in as_completed(futures):
+            out_csv_path = futures[future]
+            try:
+                future.result()
+            except Exception as err:
+                logger.error("download of %s failed: %s" % (basename(out_csv_path), err))
+            logger.info("processed %s/%s" % (i, file_number))
             i += 1
 
 
@@ -327,7 +460,7 @@ def parse_row(row, parameters_map, metadata=None, missing_value_marker=MISSING_V
         metadata = dict()
     else:
         metadata = metadata.copy()
-    date_obj = datetime.strptime(row['time'], "%Y-%m-%d").date()
+    date_obj = utils.strptime(row['time'], "%Y-%m-%d").date()
     data = []
     param_name = metadata.get('par_name')
     props = parameters_map.get(param_name)
@@ -355,7 +488,7 @@ def validate_row_format(row):
     """
     err_msg = None
     try:
-        datetime.strptime(row['time'], "%Y-%m-%d")
+        utils.strptime(row['time'], "%Y-%m-%d")
     except ValueError:
         err_msg = 'the reference time for the row is not parsable'
         return err_msg
@@ -401,7 +534,7 @@ def extract_metadata(filepath, parameters_filepath):
     source = join(*PurePath(abspath(filepath)).parts[-2:])
     filename = basename(filepath)
     cod_utente, par_name = parse_filename(filename)
-    parameters_map = load_parameter_file(parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
     if par_name not in parameters_map:
         par_code = par_name
     else:
@@ -413,31 +546,28 @@ def extract_metadata(filepath, parameters_filepath):
     return ret_value
 
 
-# entry point candidate
-def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+def parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
     """
-    Open a HISCENTRAL file and validate it against the format.
-    Return the list of tuples (row index, error message) of the errors found.
-    row_index=0 is used only for global formatting errors.
+    A generator of the rows of a HISCENTRAL file, validated and parsed in a single pass.
+    Each value returned is a tuple (index of the row, list of measures of the row), where
+    the measures are as returned by the function `parse_row`.
+    A CSV header not compliant with the format is reported as a global error (row index 0).
+    Rows not compliant with the format are not returned: the errors found are appended
+    to `found_errors` as tuples (row index, error message).
 
-    :param filepath: path to the HISCENTRAL file
-    :param parameters_filepath: path to the CSV file containing info about stored parameters
-    :return: [..., (row index, error message), ...]
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (index of the row, list of measures of the row)
     """
-    parameters_map = load_parameter_file(parameters_filepath)
-    err_msgs = validate_filename(filepath)
-    if err_msgs:
-        return [(0, err_msgs)]
     csv_file = open(filepath, 'r', encoding='unicode_escape')
     csv_reader = csv.DictReader(csv_file, delimiter=';')
     if set(csv_reader.fieldnames) != set(FIELDNAMES):
-        return [(0, 'The CSV header is not compliant with the format')]
-    metadata = extract_metadata(filepath, parameters_filepath)
-
-    found_errors = []
+        found_errors.append((0, 'The CSV header is not compliant with the format'))
+        return
     last_time = None
     last_row = None
-
     for i, row in enumerate(csv_reader, 2):
         err_msg = validate_row_format(row)
         if err_msg:
@@ -458,10 +588,61 @@ def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
             continue
         last_time = cur_time
         last_row = row
+        yield i, row_measures
+
+
+# entry point candidate
+def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+    """
+    Open a HISCENTRAL file and validate it against the format.
+    Return the list of tuples (row index, error message) of the errors found.
+    row_index=0 is used only for global formatting errors.
 
+    :param filepath: path to the HISCENTRAL file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :return: [..., (row index, error message), ...]
+    """
+    err_msgs = validate_filename(filepath)
+    if err_msgs:
+        return [(0, err_msgs)]
+    found_errors = []
+    metadata = extract_metadata(filepath, parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for _ in parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
+        pass
     return found_errors
 
 
+# entry point candidate
+def iter_parse(filepath, parameters_filepath=PARAMETERS_FILEPATH, found_errors=None):
+    """
+    Read a HISCENTRAL file located at `filepath` and yield the data stored inside, measure by
+    measure, without loading the whole file in memory. Each measure is a tuple:
+    ::
+
+      (metadata, datetime object, par_code, par_value, flag)
+
+    The errors found are appended to the list `found_errors` (if provided), as the
+    function `validate_format` returns them.
+
+    :param filepath: path to the HISCENTRAL file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (metadata, datetime object, par_code, par_value, flag)
+    """
+    if found_errors is None:
+        found_errors = []
+    err_msgs = validate_filename(filepath)
+    if err_msgs:
+        found_errors.append((0, err_msgs))
+        return
+    metadata = extract_metadata(filepath, parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for i, row_measures in parsed_rows_generator(
+            filepath, parameters_map, metadata, found_errors):
+        yield from row_measures
+
+
 # entry point candidate
 def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     """
@@ -478,19 +659,9 @@ def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :return: (data, found_errors)
     """""
-    data = []
-    found_errors = validate_format(filepath, parameters_filepath)
-    found_errors_dict = dict(found_errors)
-    if 0 in found_errors_dict:
-        return data, found_errors
-    metadata = extract_metadata(filepath, parameters_filepath)
-    parameters_map = load_parameter_file(parameters_filepath)
-    for i, row in rows_generator(filepath, parameters_map, metadata):
-        if i in found_errors_dict:
-            continue
-        metadata['row'] = i
-        parsed_row = parse_row(row, parameters_map, metadata=metadata)
-        data.extend(parsed_row)
+    found_errors = []
+    data = list(iter_parse(filepath, parameters_filepath=parameters_filepath,
+                           found_errors=found_errors))
     return data, found_errors
 
 
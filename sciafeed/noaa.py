@@ -2,7 +2,7 @@
 This module contains the functions and utilities to parse a NOAA file
 """
 import csv
-from datetime import datetime
+import re
 from os.path import abspath, dirname, join, splitext
 from pathlib import PurePath
 
@@ -28,6 +28,10 @@ LIMITING_PARAMETERS = {
     'Tmedia': ('Tmin', 'Tmax'),
 }
 FORMAT_LABEL = 'NOAA'
+HEADER = "STN--- WBAN   YEARMODA    TEMP       DEWP      SLP        STP       VISIB" \
+         "      WDSP     MXSPD   GUST    MAX     MIN   PRCP   SNDP   FRSHTT"
+# cheap necessary conditions for a file to be of this format (see `parsing.guess_format`)
+FORMAT_SIGNATURE = {'extensions': ('.op', ), 'head_pattern': re.escape(HEADER.encode())}
 
 
 def load_parameter_file(parameters_filepath=PARAMETERS_FILEPATH, delimiter=';'):
@@ -156,7 +160,7 @@ def parse_row(row, parameters_map, missing_value_markers=MISSING_VALUE_MARKERS,
         'PRCP': row[118:123],
         'SNDP': row[125:130],
     }
-    date_obj = datetime.strptime(date_str, '%Y%m%d').date()
+    date_obj = utils.strptime(date_str, '%Y%m%d').date()
     data = []
     for noaa_code, par_props in parameters_map.items():
         par_code = par_props['par_code']
@@ -191,7 +195,7 @@ def validate_row_format(row):
         return err_msg
     try:
         date_str = row[14:22]
-        _ = datetime.strptime(date_str, '%Y%m%d')
+        _ = utils.strptime(date_str, '%Y%m%d')
     except ValueError:
         err_msg = 'the reference time for the row is not parsable'
         return err_msg
@@ -250,6 +254,69 @@ def extract_metadata(filepath, parameters_filepath):
     return metadata
 
 
+def parsed_rows_generator(filepath, parameters_map, metadata, found_errors,
+                          missing_value_markers=MISSING_VALUE_MARKERS):
+    """
+    A generator of the rows of a NOAA file, validated and parsed in a single pass.
+    Each value returned is a tuple (index of the row, list of measures of the row), where
+    the measures are as returned by the function `parse_row`.
+    Rows not compliant with the format are not returned: the errors found are appended
+    to `found_errors` as tuples (row index, error message).
+
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :param missing_value_markers: the map of the strings used as a marker for missing value
+    :return: iterable of (index of the row, list of measures of the row)
+    """
+    last_row_date = None
+    last_row = None
+    for i, row in rows_generator(filepath, parameters_map, metadata):
+        err_msg = validate_row_format(row)
+        if err_msg:
+            found_errors.append((i, err_msg))
+            continue
+        metadata['row'] = i
+        row_measures = parse_row(row, parameters_map,
+                                 missing_value_markers=missing_value_markers, metadata=metadata)
+        if not row_measures:
+            continue
+        current_row_date = row_measures[0][1]
+        if last_row_date and last_row_date > current_row_date:
+            err_msg = "it is not strictly after the previous"
+            found_errors.append((i, err_msg))
+            continue
+        if last_row and last_row_date and last_row_date == current_row_date and \
+                row != last_row:
+            err_msg = "duplication of rows with different data"
+            found_errors.append((i, err_msg))
+            continue
+        last_row_date = current_row_date
+        last_row = row
+        yield i, row_measures
+
+
+def validate_header(filepath):
+    """
+    Check the extension and the header (first row) of the NOAA file located at `filepath`
+    and returns the description string of the error (if found).
+
+    :param filepath: path to the NOAA file
+    :return: the string describing the error
+    """
+    err_msg = ''
+    _, ext = splitext(filepath)
+    if ext != '.op':
+        err_msg = 'file extension must be .op'
+        return err_msg
+    with open(filepath) as fp:
+        first_row = fp.readline()
+        if first_row and first_row.strip() != HEADER:
+            err_msg = "file doesn't include a correct header"
+    return err_msg
+
+
 # entry point candidate
 def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     """
@@ -261,43 +328,50 @@ def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :return: [..., (row index, error message), ...]
     """
-    HEADER = "STN--- WBAN   YEARMODA    TEMP       DEWP      SLP        STP       VISIB" \
-             "      WDSP     MXSPD   GUST    MAX     MIN   PRCP   SNDP   FRSHTT"
-    _, ext = splitext(filepath)
-    if ext != '.op':
-        return [(0, 'file extension must be .op')]
+    err_msg = validate_header(filepath)
+    if err_msg:
+        return [(0, err_msg)]
     found_errors = []
-    parameters_map = load_parameter_file(parameters_filepath)
-    with open(filepath) as fp:
-        last_row_date = None
-        last_row = None
-        for i, row in enumerate(fp, 1):
-            if i == 1 and row.strip() != HEADER:
-                return [(0, "file doesn't include a correct header")]
-            if not row.strip() or i == 1:
-                continue
-            err_msg = validate_row_format(row)
-            if err_msg:
-                found_errors.append((i, err_msg))
-                continue
-            row_measures = parse_row(row, parameters_map)
-            if not row_measures:
-                continue
-            current_row_date = row_measures[0][1]
-            if last_row_date and last_row_date > current_row_date:
-                err_msg = "it is not strictly after the previous"
-                found_errors.append((i, err_msg))
-                continue
-            if last_row and last_row_date and last_row_date == current_row_date and \
-                    row != last_row:
-                err_msg = "duplication of rows with different data"
-                found_errors.append((i, err_msg))
-                continue
-            last_row_date = current_row_date
-            last_row = row
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    metadata = extract_metadata(filepath, parameters_filepath)
+    for _ in parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
+        pass
     return found_errors
 
 
+# entry point candidate
+def iter_parse(filepath, parameters_filepath=PARAMETERS_FILEPATH,
+               missing_value_markers=MISSING_VALUE_MARKERS, found_errors=None):
+    """
+    Read a NOAA file located at `filepath` and yield the data stored inside, measure by
+    measure, without loading the whole file in memory. Each measure is a tuple:
+    ::
+
+      (metadata, datetime object, par_code, par_value, flag)
+
+    The errors found are appended to the list `found_errors` (if provided), as the
+    function `validate_format` returns them.
+
+    :param filepath: path to the NOAA file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param missing_value_markers: the map of the strings used as a marker for missing value
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (metadata, datetime object, par_code, par_value, flag)
+    """
+    if found_errors is None:
+        found_errors = []
+    err_msg = validate_header(filepath)
+    if err_msg:
+        found_errors.append((0, err_msg))
+        return
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    metadata = extract_metadata(filepath, parameters_filepath)
+    for i, row_measures in parsed_rows_generator(
+            filepath, parameters_map, metadata, found_errors,
+            missing_value_markers=missing_value_markers):
+        yield from row_measures
+
+
 # entry point candidate
 def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH,
           missing_value_markers=MISSING_VALUE_MARKERS):
@@ -316,20 +390,9 @@ def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH,
     :param missing_value_markers: the map of the strings used as a marker for missing value
     :return: (data, found_errors)
     """""
-    data = []
-    found_errors = validate_format(filepath, parameters_filepath)
-    found_errors_dict = dict(found_errors)
-    if 0 in found_errors_dict:
-        return data, found_errors
-    parameters_map = load_parameter_file(parameters_filepath)
-    metadata = extract_metadata(filepath, parameters_filepath)
-    for i, row in rows_generator(filepath, parameters_map, metadata):
-        if i in found_errors_dict:
-            continue
-        metadata['row'] = i
-        parsed_row = parse_row(row, parameters_map,
-                               missing_value_markers=missing_value_markers, metadata=metadata)
-        data.extend(parsed_row)
+    found_errors = []
+    data = list(iter_parse(filepath, parameters_filepath=parameters_filepath,
+                           missing_value_markers=missing_value_markers, found_errors=found_errors))
     return data, found_errors
 
 
@@ -341,13 +404,11 @@ def is_format_compliant(filepath):
     :param filepath: path to file to be checked
     :return: True if the file is compliant, False otherwise
     """
-    header = "STN--- WBAN   YEARMODA    TEMP       DEWP      SLP        STP       VISIB" \
-             "      WDSP     MXSPD   GUST    MAX     MIN   PRCP   SNDP   FRSHTT"
     _, ext = splitext(filepath)
     if ext != '.op':
         return False
     with open(filepath) as fp:
         first_row = fp.readline()
-        if first_row.strip() != header:
+        if first_row.strip() != HEADER:
             return False
     return True
@@ -1,31 +1,145 @@
 """
 This module contains the functions and utilities to parse all SCIA data formats
 """
+import os
+from os.path import abspath, basename, splitext
+import re
+
 from sciafeed import arpa19, arpa21, arpaer, arpafvg, bolzano, hiscentral, noaa, rmn, trentino
+from sciafeed import batch
+from sciafeed import utils
 
 
 FORMATS = [(getattr(mod, 'FORMAT_LABEL'), mod) for mod in (
     arpa19, arpa21, arpaer, arpafvg, bolzano, hiscentral, noaa, rmn, trentino)]
+# number of bytes read from the head of a file to check the signatures of the formats
+SIGNATURE_HEAD_SIZE = 4096
+# cache of the results of `guess_format`: {(path, mtime, size): format label}
+GUESS_FORMAT_CACHE = dict()
+GUESS_FORMAT_CACHE_SIZE = 10000
+
+
+def compile_signature(signature):
+    """
+    Compile the signature of a format, i.e. a dictionary with the (optional) keys:
+
+    - 'extensions': iterable of the allowed file extensions (case insensitive)
+    - 'filename_pattern': regular expression that the file name must match (case insensitive)
+    - 'head_pattern': bytes regular expression to be found on the first bytes of the file
+
+    Return the tuple (extensions, compiled filename pattern, compiled head pattern), with
+    None for each missing condition.
+
+    :param signature: the signature dictionary
+    :return: (extensions, filename pattern, head pattern)
+    """
+    extensions = signature.get('extensions')
+    if extensions is not None:
+        extensions = frozenset(ext.lower() for ext in extensions)
+    filename_pattern = signature.get('filename_pattern')
+    if filename_pattern is not None:
+        filename_pattern = re.compile(filename_pattern, re.IGNORECASE | re.DOTALL)
+    head_pattern = signature.get('head_pattern')
+    if head_pattern is not None:
+        head_pattern = re.compile(head_pattern, re.DOTALL)
+    return extensions, filename_pattern, head_pattern
+
+
+SIGNATURES = [(format_label, compile_signature(getattr(format_module, 'FORMAT_SIGNATURE', {})))
+              for format_label, format_module in FORMATS]
+
+
+def candidate_formats(filepath):
+    """
+    Return the list of labels of the formats whose signature matches the file located at
+    `filepath`, in the same order of `FORMATS`.
+    The signatures are necessary conditions: the file is compliant only to a subset of
+    the candidates. The head of the file is read at most once.
+
+    :param filepath: file path of the file to check
+    :return: the list of format labels
+    """
+    filename = basename(filepath)
+    ext = splitext(filename)[1].lower()
+    head = None
+    candidates = []
+    for format_label, (extensions, filename_pattern, head_pattern) in SIGNATURES:
+        if extensions is not None and ext not in extensions:
+            continue
+        if filename_pattern is not None and not filename_pattern.search(filename):
+            continue
+        if head_pattern is not None:
+            if head is None:
+                try:
+                    with open(filepath, 'rb') as fp:
+                        head = fp.read(SIGNATURE_HEAD_SIZE)
+                except OSError:
+                    head = b''
+            if not head_pattern.search(head):
+                continue
+        candidates.append(format_label)
+    return candidates
 
 
-def guess_format(filepath):
+def guess_format(filepath, use_cache=True):
     """
     Try to guess the format of a file located at `filepath`. It uses (if exists) the
-    function 'is_format_compliant' of the modules.
+    function 'is_format_compliant' of the modules, called only for the formats whose signature
+    (see `candidate_formats`) matches the file.
+    If `use_cache` is True, the result is cached by path, modification time and size of the file.
     Return the tuple (label of the format, python module of the format).
 
     :param filepath: file path of the file to guess the format of
+    :param use_cache: if True, use the cache of the results
     :return: (label of the format, python module of the format)
     """
-    for format_label, format_module in FORMATS:
+    formats_map = dict(FORMATS)
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        # not a regular file: each format module decides
+        candidates = list(formats_map)
+        cache_key = None
+    else:
+        cache_key = (abspath(filepath), stat.st_mtime_ns, stat.st_size)
+        candidates = None
+    if use_cache and cache_key in GUESS_FORMAT_CACHE:
+        format_label = GUESS_FORMAT_CACHE[cache_key]
+        return format_label, formats_map.get(format_label)
+    if candidates is None:
+        candidates = candidate_formats(filepath)
+    for format_label in candidates:
+        format_module = formats_map[format_label]
         is_format_compliant = getattr(format_module, 'is_format_compliant', lambda f: False)
         if is_format_compliant(filepath):
             break
     else:  # never gone on break
-        return 'Unknown', None
+        format_label, format_module = 'Unknown', None
+    if use_cache and cache_key is not None:
+        if len(GUESS_FORMAT_CACHE) >= GUESS_FORMAT_CACHE_SIZE:
+            GUESS_FORMAT_CACHE.clear()
+        GUESS_FORMAT_CACHE[cache_key] = format_label
     return format_label, format_module
 
 
+def warm_up_parameters(parameters_filepath=None):
+    """
+    Load in the cache of `utils.load_parameters` the parameters maps and the thresholds of
+    all the formats, so that the processes forked later (for example the workers of a pool)
+    inherit them. If `parameters_filepath` is not defined, the default parameters file
+    of each format is loaded.
+
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    """
+    for format_label, format_module in FORMATS:
+        format_filepath = parameters_filepath or getattr(format_module, 'PARAMETERS_FILEPATH')
+        for function_name in ('load_parameter_file', 'load_parameter_thresholds'):
+            try:
+                utils.load_parameters(getattr(format_module, function_name), format_filepath)
+            except Exception:  # not a parameters file for this format
+                continue
+
+
 def validate_format(filepath, parameters_filepath, format_label=None):
     """
     Open a file and validate it against its format.
@@ -73,3 +187,53 @@ def parse(filepath, parameters_filepath=None, format_label=None):
     else:
         data, found_errors = parse_f(filepath, parameters_filepath)
     return data, found_errors
+
+
+def iter_parse(filepath, parameters_filepath=None, format_label=None, found_errors=None):
+    """
+    Try to extract data from a file located at `filepath`, yielding the measures one by one,
+    without loading the whole file in memory. Each measure is of kind:
+    ::
+
+        (metadata, date obj, par_code, par_value, par_flag)
+
+    The formatting errors found are appended to the list `found_errors` (if provided), as
+    tuples (err_indx, err_msg).
+
+    :param filepath: the file path where to extract data
+    :param parameters_filepath: path to the template of the format to be used
+    :param format_label: the name of the format
+    :param found_errors: list where to append the tuples (err_indx, err_msg)
+    :return: iterable of (metadata, date obj, par_code, par_value, par_flag)
+    """
+    if found_errors is None:
+        found_errors = []
+    if not format_label:
+        _, format_module = guess_format(filepath)
+    else:
+        format_module = dict(FORMATS).get(format_label)
+    if not format_module:
+        found_errors.append((0, "file %r has unknown format" % filepath))
+        return
+    iter_parse_f = getattr(format_module, 'iter_parse')
+    if not parameters_filepath:
+        yield from iter_parse_f(filepath, found_errors=found_errors)
+    else:
+        yield from iter_parse_f(filepath, parameters_filepath, found_errors=found_errors)
+
+
+def parse_batch(filepath, parameters_filepath=None, format_label=None):
+    """
+    As the function `parse`, but the data returned is a `batch.MeasureBatch`, built
+    from the measures as they are parsed (without building the list of measures).
+    Return also the list of tuples (err_indx, err_msg) of the formatting errors found.
+
+    :param filepath: the file path where to extract data
+    :param parameters_filepath: path to the template of the format to be used
+    :param format_label: the name of the format
+    :return: measure_batch, found_errors
+    """
+    found_errors = []
+    measure_batch = batch.MeasureBatch.from_measures(iter_parse(
+        filepath, parameters_filepath, format_label, found_errors=found_errors))
+    return measure_batch, found_errors
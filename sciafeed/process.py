@@ -2,12 +2,22 @@
 This module contains functions and utilities that involve more components of sciafeed.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import functools
+import io
 import logging
+import logging.handlers
 import operator
 from os import listdir
-from os.path import isfile, join, splitext
+from os.path import basename, isfile, join, splitext
+import tempfile
+import time
+
+import numpy as np
 
 from sciafeed import LOG_NAME
+from sciafeed import batch
 from sciafeed import checks
 from sciafeed import compute
 from sciafeed import db_utils
@@ -20,11 +30,15 @@ from sciafeed import upsert
 
 
 def make_report(in_filepath, outdata_filepath=None, parameters_filepath=None, logger=None,
-                do_checks=True, limiting_params=None):
+                do_checks=True, limiting_params=None, stream=False):
     """
     Read a file located at `in_filepath` and generate a report on the parsing.
-    If the path `outdata_filepath` is defined, a file with the data parsed is created at the path.
+    If the path `outdata_filepath` is defined, a file with the data parsed is created at the path
+    (a binary file if the extension is '.npz', see `export.export_data`).
     Return the data parsed.
+    If `stream` is True, the measures are parsed, checked and exported one by one, without
+    loading the whole file in memory (if the format yields them sorted by date, see
+    ITER_PARSE_SORTED of the format modules): in this case the data parsed is not returned.
 
     :param in_filepath: input file
     :param outdata_filepath: path of the output file containing data
@@ -32,6 +46,7 @@ def make_report(in_filepath, outdata_filepath=None, parameters_filepath=None, lo
     :param logger: logging object where to report actions
     :param limiting_params: dictionary of limiting parameters for each parameter code
     :param do_checks: True if must do checks, False otherwise
+    :param stream: if True, process the measures one by one (None is returned)
     :return: data parsed
     """
     if logger is None:
@@ -47,17 +62,40 @@ def make_report(in_filepath, outdata_filepath=None, parameters_filepath=None, lo
         limiting_params = getattr(format_module, 'LIMITING_PARAMETERS')
 
     logger.info("START OF ANALYSIS OF %s FILE %r" % (format_label, in_filepath))
-    parse_f = getattr(format_module, 'parse')
     load_parameter_thresholds_f = getattr(format_module, 'load_parameter_thresholds')
-    par_thresholds = load_parameter_thresholds_f(parameters_filepath)
-    # 1. parsing
-    data, err_msgs = parse_f(in_filepath, parameters_filepath)
-    if do_checks:
-        # 2. weak climatologic check
-        wcc_err_msgs, data = checks.data_weak_climatologic_check(data, par_thresholds)
-        # 3. internal consistence check
-        icc_err_msgs, data = checks.data_internal_consistence_check(data, limiting_params)
+    par_thresholds = utils.load_parameters(load_parameter_thresholds_f, parameters_filepath)
+    if stream:
+        err_msgs, wcc_err_msgs, icc_err_msgs = [], [], []
+        # 1. parsing
+        iter_parse_f = getattr(format_module, 'iter_parse')
+        measures = iter_parse_f(in_filepath, parameters_filepath, found_errors=err_msgs)
+        if do_checks:
+            # 2. weak climatologic check
+            measures = checks.iter_data_weak_climatologic_check(
+                measures, par_thresholds, err_msgs=wcc_err_msgs)
+            # 3. internal consistence check
+            measures = checks.iter_data_internal_consistence_check(
+                measures, limiting_params, err_msgs=icc_err_msgs)
+        if outdata_filepath:
+            # measures not yielded sorted by date are sorted (in memory) by the export
+            presorted = getattr(format_module, 'ITER_PARSE_SORTED', False)
+            export.export_data(measures, outdata_filepath, presorted=presorted)
+        else:
+            for _ in measures:
+                pass
         err_msgs += wcc_err_msgs + icc_err_msgs
+    else:
+        parse_f = getattr(format_module, 'parse')
+        # 1. parsing
+        data, err_msgs = parse_f(in_filepath, parameters_filepath)
+        if do_checks:
+            # 2. weak climatologic check
+            wcc_err_msgs, data = checks.data_weak_climatologic_check(data, par_thresholds)
+            # 3. internal consistence check
+            icc_err_msgs, data = checks.data_internal_consistence_check(data, limiting_params)
+            err_msgs += wcc_err_msgs + icc_err_msgs
+        if outdata_filepath:
+            export.export_data(data, outdata_filepath)
 
     if not err_msgs:
         logger.info("No errors found")
@@ -66,47 +104,254 @@ def make_report(in_filepath, outdata_filepath=None, parameters_filepath=None, lo
             logger.info("Row %s: %s" % (row_index, err_msg))
 
     if outdata_filepath:
-        export.export2csv(data, outdata_filepath)
         logger.info("Data saved on file %r" % outdata_filepath)
 
     logger.info("END OF ANALYSIS OF %s FILE" % format_label)
     return data
 
 
-def compute_daily_indicators(conn, data_folder, indicators_folder=None, logger=None):
+def make_report_buffered(in_filepath, outdata_filepath=None, parameters_filepath=None,
+                         do_checks=True, stream=True):
+    """
+    Call the function `make_report` collecting the report messages in memory instead of
+    logging them, so that it can run in another process.
+    Return the list of the messages, as tuples (logging level, message), and the seconds spent.
+
+    :param in_filepath: input file
+    :param outdata_filepath: path of the output file containing data
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param do_checks: True if must do checks, False otherwise
+    :param stream: if True, process the measures one by one
+    :return: ([(level, message), ...], seconds)
+    """
+    # a logger outside the logging hierarchy: nothing is propagated to the root logger
+    logger = logging.Logger('%s.%s' % (LOG_NAME, in_filepath))
+    handler = logging.handlers.BufferingHandler(capacity=float('inf'))
+    logger.addHandler(handler)
+    start = time.time()
+    make_report(in_filepath, outdata_filepath, parameters_filepath, logger=logger,
+                do_checks=do_checks, stream=stream)
+    seconds = time.time() - start
+    messages = [(record.levelno, record.getMessage()) for record in handler.buffer]
+    handler.close()
+    return messages, seconds
+
+
+def make_reports(in_filepaths, outdata_filepaths=None, parameters_filepath=None, logger=None,
+                 do_checks=True, workers=1):
+    """
+    Call the function `make_report` (in stream mode) for each file of `in_filepaths`, writing
+    the parsed data on the corresponding path of `outdata_filepaths` (if defined).
+    If `workers` > 1, the files are processed in parallel by a pool of `workers` processes.
+    In any case the report of each file is logged all together and in the order of
+    `in_filepaths`, followed by the time spent on the file.
+
+    :param in_filepaths: list of input files
+    :param outdata_filepaths: list of paths of the output files containing data
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param logger: logging object where to report actions
+    :param do_checks: True if must do checks, False otherwise
+    :param workers: number of processes to use
+    """
+    if logger is None:
+        logger = logging.getLogger(LOG_NAME)
+    if outdata_filepaths is None:
+        outdata_filepaths = [None] * len(in_filepaths)
+    executor = None
+    if workers > 1:
+        # the workers inherit (or load once) the parameters of the formats
+        parsing.warm_up_parameters(parameters_filepath)
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=parsing.warm_up_parameters,
+            initargs=(parameters_filepath, ))
+        make_report_f = functools.partial(
+            make_report_buffered, parameters_filepath=parameters_filepath, do_checks=do_checks)
+        # results are returned in the same order of `in_filepaths`
+        results = executor.map(make_report_f, in_filepaths, outdata_filepaths)
+    try:
+        for in_filepath, outdata_filepath in zip(in_filepaths, outdata_filepaths):
+            logger.info('processing file %r' % basename(in_filepath))
+            if executor:
+                messages, seconds = next(results)
+                for level, message in messages:
+                    logger.log(level, message)
+            else:
+                start = time.time()
+                make_report(in_filepath, outdata_filepath, parameters_filepath, logger=logger,
+                            do_checks=do_checks, stream=True)
+                seconds = time.time() - start
+            logger.info('file %r processed in %.3f seconds' % (basename(in_filepath), seconds))
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+STATION_KEY_FIELDS = ('cod_utente', 'cod_rete', 'lat', 'lon')
+# connection and index of the stations of a worker process of `compute_daily_indicators`
+INDICATORS_WORKER = dict()
+
+
+def partition_by_station(data_paths, partitions_folder, logger=None):
+    """
+    Split the measures of the files of data `data_paths` (CSV or .npz files, see
+    `export.load_data`) by station: the measures of each file are written in
+    `partitions_folder` as .npz files (see `export.export2npz`), one for each station found.
+    Return the dictionary of the partitions, of kind:
+    ::
+
+        {(cod_utente, cod_rete, lat, lon): [path of partition 1, ...], ...}
+
+    where the partitions of each station are in the same order of `data_paths`.
+    Only the measures of one file at a time are loaded in memory.
+
+    :param data_paths: list of paths of the files of data
+    :param partitions_folder: folder path where to write the partitions
+    :param logger: logging object where to report actions
+    :return: the dictionary of partitions
+    """
+    if logger is None:
+        logger = logging.getLogger(LOG_NAME)
+    partitions = dict()
+    for file_index, data_path in enumerate(data_paths):
+        logger.info("reading data from %r" % data_path)
+        try:
+            if data_path.lower().endswith('.npz'):
+                file_batch = export.npz2batch(data_path)
+            else:
+                file_batch = batch.MeasureBatch.from_measures(export.csv2data(data_path))
+        except Exception:
+            logger.error('data file %r not parsable' % data_path)
+            continue
+        measures_group = file_batch.station_groups(STATION_KEY_FIELDS)
+        order = np.argsort(measures_group, kind='stable')
+        bounds = np.flatnonzero(np.diff(measures_group[order])) + 1
+        for group_index, positions in enumerate(np.split(order, bounds)):
+            if not len(positions):
+                continue
+            metadata = file_batch.stations[file_batch.station_idx[positions[0]]]
+            station_key = tuple(metadata.get(field) for field in STATION_KEY_FIELDS)
+            partition_path = join(partitions_folder, '%s_%s.npz' % (file_index, group_index))
+            export.export2npz(file_batch.take(positions), partition_path, omit_missing=False,
+                              presorted=True)
+            partitions.setdefault(station_key, []).append(partition_path)
+    return partitions
+
+
+def compute_partition_indicators(conn, partition_paths, writers, logger=None,
+                                 station_index=None):
+    """
+    Compute the daily indicators of the measures of a station, stored in the files
+    `partition_paths` (as returned by `partition_by_station`), and write them with `writers`
+    (see `compute.compute_and_store`). Return the dictionary of computed indicators.
+
+    :param conn: db connection object
+    :param partition_paths: list of paths of the partitions of the station
+    :param writers: dictionary of CSV writers
+    :param logger: logging object where to report actions
+    :param station_index: `querying.StationIndex` of the stations (if None, it's loaded)
+    :return: computed_indicators
+    """
+    if logger is None:
+        logger = logging.getLogger(LOG_NAME)
+    data = []
+    for partition_path in partition_paths:
+        data.extend(export.npz2data(partition_path))
+    return compute.compute_and_store(
+        conn, data, writers, compute.INDICATORS_TABLES, logger, station_index)
+
+
+def init_indicators_worker(db_uri):
     """
-    Read each file located inside `data_folder` and generate indicators
-    and a report of the processing.
+    Initialize a worker process of `compute_daily_indicators`: configure the db engine
+    for the process and prepare the connection and the index of the stations.
+
+    :param db_uri: db connection URI
+    """
+    db_utils.configure(db_uri)
+    conn = db_utils.ensure_connection()
+    INDICATORS_WORKER['conn'] = conn
+    INDICATORS_WORKER['station_index'] = querying.StationIndex(conn)
+
+
+def compute_partition_indicators_buffered(partition_paths):
+    """
+    Call the function `compute_partition_indicators` in a worker process initialized by
+    `init_indicators_worker`, collecting the rows of indicators and the report messages
+    in memory. Return the CSV text to append to each table, the computed indicators and the
+    list of the messages, as tuples (logging level, message).
+
+    :param partition_paths: list of paths of the partitions of a station
+    :return: ({table: CSV text}, computed_indicators, [(level, message), ...])
+    """
+    logger = logging.Logger('%s.%s' % (LOG_NAME, partition_paths[0]))
+    handler = logging.handlers.BufferingHandler(capacity=float('inf'))
+    logger.addHandler(handler)
+    writers = dict()
+    for table, columns in compute.INDICATORS_TABLES.items():
+        buffer = io.StringIO()
+        writers[table] = csv.DictWriter(buffer, fieldnames=columns, delimiter=';'), buffer
+    computed_indicators = compute_partition_indicators(
+        INDICATORS_WORKER['conn'], partition_paths, writers, logger,
+        INDICATORS_WORKER['station_index'])
+    tables_texts = {table: buffer.getvalue() for table, (_, buffer) in writers.items()}
+    messages = [(record.levelno, record.getMessage()) for record in handler.buffer]
+    handler.close()
+    return tables_texts, computed_indicators, messages
+
+
+def compute_daily_indicators(conn, data_folder, indicators_folder=None, logger=None, workers=1,
+                             temp_folder=None):
+    """
+    Read each file located inside `data_folder` (CSV or .npz files, see `export.load_data`)
+    and generate indicators and a report of the processing.
     If the path `indicators_folder` is defined, a file with the indicators
     is created at the path.
     Return the the report strings (list) and the computed indicators (dictionary).
+    The measures are first split by station in temporary files (see `partition_by_station`),
+    then the indicators are computed station by station: only the measures of a station
+    are loaded in memory. If `workers` > 1, the stations are processed in parallel by
+    a pool of `workers` processes.
 
     :param conn: db connection object
     :param data_folder: folder path containing input data
     :param indicators_folder: path of the output data
     :param logger: logging object where to report actions
+    :param workers: number of processes to use
+    :param temp_folder: folder where to create the temporary files (None for the default)
     :return: computed_indicators
     """
     if logger is None:
         logger = logging.getLogger(LOG_NAME)
     computed_indicators = dict()
     writers = utils.open_csv_writers(indicators_folder, compute.INDICATORS_TABLES)
-    block_data = []
-    for i, file_name in enumerate(listdir(data_folder), 1):
-        csv_path = join(data_folder, file_name)
-        if not isfile(csv_path) or splitext(file_name.lower())[1] != '.csv':
-            continue
-        logger.info("reading data from %r" % csv_path)
-        try:
-            data = export.csv2data(csv_path)
-        except:
-            logger.error('CSV file %r not parsable' % csv_path)
-            continue
-        block_data.extend(data)
-    logger.info("computing daily indicators...")
-    if block_data:
-        computed_indicators = compute.compute_and_store(
-            conn, block_data, writers, compute.INDICATORS_TABLES, logger)
+    data_paths = []
+    for file_name in listdir(data_folder):
+        data_path = join(data_folder, file_name)
+        if isfile(data_path) and splitext(file_name.lower())[1] in export.DATA_EXTENSIONS:
+            data_paths.append(data_path)
+    with tempfile.TemporaryDirectory(dir=temp_folder) as partitions_folder:
+        partitions = partition_by_station(data_paths, partitions_folder, logger)
+        logger.info("computing daily indicators...")
+        # same order of stations of `compute.compute_and_store` on all the data
+        stations_partitions = [partitions[key] for key in sorted(partitions)]
+        if workers > 1 and stations_partitions:
+            with ProcessPoolExecutor(
+                    max_workers=workers, initializer=init_indicators_worker,
+                    initargs=(str(conn.engine.url), )) as executor:
+                # results are returned in the same order of `stations_partitions`
+                results = executor.map(
+                    compute_partition_indicators_buffered, stations_partitions)
+                for tables_texts, station_indicators, messages in results:
+                    for level, message in messages:
+                        logger.log(level, message)
+                    for table, text in tables_texts.items():
+                        writers[table][1].write(text)
+                    computed_indicators.update(station_indicators)
+        elif stations_partitions:
+            station_index = querying.StationIndex(conn)
+            for partition_paths in stations_partitions:
+                computed_indicators.update(compute_partition_indicators(
+                    conn, partition_paths, writers, logger, station_index))
     utils.close_csv_writers(writers)
     return computed_indicators
 
@@ -245,14 +490,12 @@ def process_checks_t200(conn, stations_ids, schema, logger):
         temp_records, min_threshold=-36, max_threshold=46, val_index=6, logger=logger)
 
     logger.info('* final set of flags on database...')
-    flag_records = [r for r in temp_records if r[3] and r[3] <= -10]
-    upsert.update_flags(conn, flag_records, 'ds__t200', schema=schema, db_field='tmxgg')
-    flag_records = [r for r in temp_records if r[5] and r[5] <= -10]
-    upsert.update_flags(conn, flag_records, 'ds__t200', schema=schema, db_field='tmngg',
-                        flag_index=5)
-    flag_records = [r for r in temp_records if r[7] and r[7] <= -10]
-    upsert.update_flags(conn, flag_records, 'ds__t200', schema=schema, db_field='tmdgg',
-                        flag_index=7)
+    fields_records = [
+        ([db_field], [r for r in temp_records if r[flag_index] and r[flag_index] <= -10],
+         flag_index)
+        for db_field, flag_index in [('tmxgg', 3), ('tmngg', 5), ('tmdgg', 7)]
+    ]
+    upsert.write_flags(conn, 'ds__t200', fields_records, schema=schema, logger=logger)
     logger.info('== end process chain for T200 ==')
     return temp_records
 
@@ -524,12 +767,12 @@ def process_checks_wind(conn, stations_ids, schema, logger):
     table_records = checks.check12(table_records, min_diff=0, logger=logger, val_indexes=(6, 2))
     logger.info('* final set of flags on database...')
 
-    # vntmd.flag setta anche quello di vnt.flag, per questo uso update_vntmd_flags
-    flag_records = [r for r in table_records if r[3] and r[3] <= -10]
-    upsert.update_vntmd_flags(conn, flag_records, schema=schema, logger=logger)
-    flag_records = [r for r in table_records if r[5] and r[5] <= -10]
-    upsert.update_flags(
-        conn, flag_records, 'ds__vnt10', schema=schema, db_field='vntmxgg', flag_index=5)
+    # vntmd.flag setta anche quello di vnt.flag (come update_vntmd_flags)
+    fields_records = [
+        (['vntmxgg', 'vnt'], [r for r in table_records if r[3] and r[3] <= -10], 3),
+        (['vntmxgg'], [r for r in table_records if r[5] and r[5] <= -10], 5),
+    ]
+    upsert.write_flags(conn, 'ds__vnt10', fields_records, schema=schema, logger=logger)
     return table_records
 
 
@@ -578,7 +821,6 @@ def compute_daily_indicators2(conn, schema, stations_ids, logger):
     :param logger: logger object for reporting
     :return:
     """
-    conn_r = db_utils.get_safe_memory_read_connection(conn)
     if logger is None:
         logger = logging.getLogger(LOG_NAME)
     station_ids_tuple = '(%s)' % repr(stations_ids)[1:-1]
@@ -590,7 +832,7 @@ def compute_daily_indicators2(conn, schema, stations_ids, logger):
     (tmdgg).val_md, ((tmdgg).flag).wht
     FROM %s.ds__t200 LEFT JOIN dailypdbadmclima.anag__stazioni ON cod_staz=id_staz
     WHERE cod_staz in %s""" % (schema, station_ids_tuple)
-    temp_records = db_utils.results_list(conn_r.execute(sql))
+    temp_records = db_utils.results_list(db_utils.read_results(conn, sql))
 
     logger.info('* computing temperature indicators...')
     temp_items = []
@@ -643,10 +885,7 @@ def compute_daily_indicators2(conn, schema, stations_ids, logger):
         ('ds__grgg', grgg_fields, grgg_items),
     ]:
         logger.info('updating temperature indicators on table %s.%s' % (schema, table_name))
-        for sub_data in utils.chunked_iterable(data, 10000):
-            sql = upsert.create_upsert(table_name, schema, fields, sub_data, 'upsert')
-            if sql:
-                conn.execute(sql)
+        upsert.copy_upsert(conn, table_name, schema, fields, data, 'upsert')
 
     logger.info('* computing bilancio idrico...')
     sql = """
@@ -656,7 +895,7 @@ def compute_daily_indicators2(conn, schema, stations_ids, logger):
     AND (prec24).val_tot IS NOT NULL AND (etp).val_md IS NOT NULL
     AND cod_staz in %s
     """ % (schema, schema, station_ids_tuple)
-    idro_records = db_utils.results_list(conn_r.execute(sql))
+    idro_records = db_utils.results_list(db_utils.read_results(conn, sql))
 
     idro_items = []
     for idro_record in idro_records:
@@ -672,10 +911,7 @@ def compute_daily_indicators2(conn, schema, stations_ids, logger):
     idro_fields = []
     if idro_items:
         idro_fields = list(idro_items[0].keys())
-    for sub_data in utils.chunked_iterable(idro_items, 10000):
-        sql = upsert.create_upsert('ds__delta_idro', schema, idro_fields, sub_data, 'upsert')
-        if sql:
-            conn.execute(sql)
+    upsert.copy_upsert(conn, 'ds__delta_idro', schema, idro_fields, idro_items, 'upsert')
 
 
 def process_dma(conn, startschema, targetschema, policy, stations_ids, logger):
@@ -707,3 +943,4 @@ def process_dma(conn, startschema, targetschema, policy, stations_ids, logger):
     dma.process_dma_precipitazione(conn, startschema, targetschema, policy, stations_ids, logger)
     dma.process_dma_vento(conn, startschema, targetschema, policy, stations_ids, logger)
     dma.process_dma_temperatura(conn, startschema, targetschema, policy, stations_ids, logger)
+    logger.debug('db connection pool: %r' % db_utils.pool_status(conn.engine))
@@ -1,12 +1,14 @@
 """
 This module contains functions and utilities that extracts information from SCIA `database`.
 """
-import functools
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
 import itertools
 import operator
 from os import listdir
 from os.path import isfile, join, splitext
 
+import numpy as np
 from sqlalchemy.sql import select, and_, literal, func
 from sqlalchemy import MetaData, Table
 
@@ -14,7 +16,6 @@ from sciafeed import db_utils
 from sciafeed import export
 
 
-@functools.lru_cache(maxsize=None)
 def get_db_station(conn, anag_table, **kwargs):
     """
     Get a station object from the database, by its properties
@@ -44,7 +45,325 @@ def get_db_station(conn, anag_table, **kwargs):
     return None
 
 
-def get_er_station(conn, anag_table, **station_props):
+STATION_INDEX_COLUMNS = ('id_staz', 'nome', 'cod_utente', 'cod_rete', 'lat', 'lon')
+# radius of the sphere used for the distances (meters), the same of PostGIS ST_DistanceSphere
+EARTH_RADIUS = 6370986
+# size of the cells of the spatial grid of StationIndex (degrees)
+GRID_CELL_SIZE = 0.1
+
+
+def haversine_distances(lat, lon, lats, lons):
+    """
+    Return the array of the distances in meters on the sphere between the point (`lat`, `lon`)
+    and the points of the arrays (`lats`, `lons`). Coordinates are in degrees.
+
+    :param lat: latitude of the point
+    :param lon: longitude of the point
+    :param lats: array of latitudes
+    :param lons: array of longitudes
+    :return: the array of distances
+    """
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 \
+        + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class StationIndex:
+    """
+    In-memory index of the stations of the table anag__stazioni, loaded with a single query,
+    to find stations by their properties without querying the database for each station.
+    It finds the same stations of `get_db_station`, by hash lookups on id_staz,
+    (cod_rete, cod_utente) and (cod_rete, name) (case insensitive).
+    Only the `columns` of the stations (of the networks `cod_reti`, if specified)
+    are loaded. Use the method `refresh` to load the changes of the database.
+    The index also finds the stations near a point (see methods `within` and `nearest`),
+    looking only at the cells of a grid (with cells of `cell_size` degrees) around the point.
+    """
+    def __init__(self, conn, anag_table=None, columns=STATION_INDEX_COLUMNS, cod_reti=None,
+                 cell_size=GRID_CELL_SIZE):
+        if anag_table is None:
+            meta = MetaData()
+            anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
+                               schema='dailypdbadmclima')
+        self.conn = conn
+        self.anag_table = anag_table
+        self.columns = tuple(columns)
+        self.cod_reti = cod_reti
+        self.cell_size = cell_size
+        self.numeric_columns = set()
+        for column_name in self.columns:
+            try:
+                python_type = anag_table.c[column_name].type.python_type
+            except NotImplementedError:
+                continue
+            if python_type in (int, float, Decimal):
+                self.numeric_columns.add(column_name)
+        self.stations = []
+        self.by_id = dict()
+        self.by_code = dict()
+        self.by_name = dict()
+        self.grid = None
+        self.refresh()
+
+    def __len__(self):
+        return len(self.stations)
+
+    def normalize(self, column_name, value):
+        """
+        Return the value of the column `column_name` as it is compared in the database
+        (numbers for numeric columns, lowercase strings for the name).
+        Raise ValueError if `value` is not valid for the column.
+
+        :param column_name: name of the column
+        :param value: the value
+        :return: the normalized value
+        """
+        if column_name in self.numeric_columns:
+            return float(value)
+        if column_name == 'nome':
+            return str(value).lower()
+        return str(value)
+
+    def refresh(self):
+        """
+        Load (again) the stations from the database, with a single query.
+        """
+        columns = [self.anag_table.c[column_name] for column_name in self.columns]
+        query = select(columns)
+        if self.cod_reti is not None:
+            query = query.where(self.anag_table.c.cod_rete.in_(list(self.cod_reti)))
+        self.stations = self.conn.execute(query).fetchall()
+        self.grid = None
+        self.by_id = dict()
+        self.by_code = dict()
+        self.by_name = dict()
+        for station in self.stations:
+            if 'id_staz' in self.columns:
+                self.by_id.setdefault(self.normalize('id_staz', station.id_staz), []) \
+                    .append(station)
+            if 'cod_rete' not in self.columns or station.cod_rete is None:
+                continue
+            cod_rete = self.normalize('cod_rete', station.cod_rete)
+            if 'cod_utente' in self.columns and station.cod_utente is not None:
+                code_key = (cod_rete, self.normalize('cod_utente', station.cod_utente))
+                self.by_code.setdefault(code_key, []).append(station)
+            if 'nome' in self.columns and station.nome is not None:
+                name_key = (cod_rete, self.normalize('nome', station.nome))
+                self.by_name.setdefault(name_key, []).append(station)
+
+    def get(self, **kwargs):
+        """
+        Get a station by its properties, with the same criteria of `get_db_station`:
+        properties with None value are ignored, the name is case insensitive,
+        and a station is returned only if it is the only one matching.
+
+        :param kwargs: dictionary of column values
+        :return: the station object (if found), otherwise None
+        """
+        props = dict()
+        for column_name, value in kwargs.items():
+            if column_name not in self.columns:
+                raise ValueError('column %r is not loaded in the index' % column_name)
+            if value is None:
+                continue
+            try:
+                props[column_name] = self.normalize(column_name, value)
+            except ValueError:
+                return None
+        if 'id_staz' in props:
+            candidates = self.by_id.get(props['id_staz'], [])
+        elif 'cod_rete' in props and 'cod_utente' in props:
+            candidates = self.by_code.get((props['cod_rete'], props['cod_utente']), [])
+        elif 'cod_rete' in props and 'nome' in props:
+            candidates = self.by_name.get((props['cod_rete'], props['nome']), [])
+        else:
+            candidates = self.stations
+        results = []
+        for station in candidates:
+            if self.matches(station, props):
+                results.append(station)
+                if len(results) > 1:
+                    return None
+        if len(results) == 1:
+            return results[0]
+        return None
+
+    def matches(self, station, props):
+        """
+        Return True if the `station` has the normalized values `props` (see method `normalize`).
+
+        :param station: the station object
+        :param props: dictionary of normalized column values
+        :return: True if the station matches, False otherwise
+        """
+        for column_name, value in props.items():
+            station_value = station[column_name]
+            if station_value is None or self.normalize(column_name, station_value) != value:
+                return False
+        return True
+
+    def cell(self, lat, lon):
+        """
+        Return the indexes (row, column) of the cell of the grid containing the point.
+
+        :param lat: latitude (degrees)
+        :param lon: longitude (degrees)
+        :return: (row, column)
+        """
+        num_columns = int(np.ceil(360 / self.cell_size))
+        return int((lat + 90) // self.cell_size), int((lon + 180) // self.cell_size) % num_columns
+
+    def build_grid(self):
+        """
+        Build the grid of the stations with coordinates, for each network.
+        """
+        for column_name in ('cod_rete', 'lat', 'lon'):
+            if column_name not in self.columns:
+                raise ValueError('column %r is not loaded in the index' % column_name)
+        self.grid = dict()
+        self.network_positions = dict()
+        self.located = [s for s in self.stations if s.lat is not None and s.lon is not None]
+        self.lats = np.array([float(s.lat) for s in self.located], dtype=np.float64)
+        self.lons = np.array([float(s.lon) for s in self.located], dtype=np.float64)
+        for position, station in enumerate(self.located):
+            row, column = self.cell(self.lats[position], self.lons[position])
+            if station.cod_rete is not None:
+                cod_rete = self.normalize('cod_rete', station.cod_rete)
+                self.grid.setdefault((cod_rete, row, column), []).append(position)
+                self.network_positions.setdefault(cod_rete, []).append(position)
+            # for the queries on all the networks (including stations without network)
+            self.grid.setdefault((None, row, column), []).append(position)
+        self.network_positions[None] = list(range(len(self.located)))
+
+    def within(self, lat, lon, radius, cod_rete=None):
+        """
+        Return the stations (of the network `cod_rete`, if not None) at a distance from the
+        point (`lat`, `lon`) not greater than `radius` meters, as a list of tuples
+        (distance, station) ordered by distance.
+
+        :param lat: latitude (degrees)
+        :param lon: longitude (degrees)
+        :param radius: radius of the search (meters)
+        :param cod_rete: the network of the stations (None for all the networks)
+        :return: [(distance, station), ...]
+        """
+        if self.grid is None:
+            self.build_grid()
+        lat, lon = float(lat), float(lon)
+        if cod_rete is not None:
+            cod_rete = self.normalize('cod_rete', cod_rete)
+        num_rows = int(np.ceil(180 / self.cell_size))
+        num_columns = int(np.ceil(360 / self.cell_size))
+        delta_lat = np.degrees(radius / EARTH_RADIUS)
+        min_row, _ = self.cell(max(lat - delta_lat, -90), lon)
+        max_row, _ = self.cell(min(lat + delta_lat, 90), lon)
+        max_abs_lat = abs(lat) + delta_lat
+        if max_abs_lat >= 90 or delta_lat / np.cos(np.radians(max_abs_lat)) >= 180:
+            columns = range(num_columns)
+        else:
+            delta_lon = delta_lat / np.cos(np.radians(max_abs_lat))
+            _, min_column = self.cell(lat, lon - delta_lon)
+            _, max_column = self.cell(lat, lon + delta_lon)
+            num_cells = (max_column - min_column) % num_columns + 1
+            columns = [(min_column + i) % num_columns for i in range(num_cells)]
+        rows = range(max(min_row, 0), min(max_row, num_rows - 1) + 1)
+        network_positions = self.network_positions.get(cod_rete, [])
+        if len(rows) * len(columns) > len(network_positions):
+            # less stations than cells to look at
+            positions = network_positions
+        else:
+            positions = []
+            for row in rows:
+                for column in columns:
+                    positions.extend(self.grid.get((cod_rete, row, column), []))
+        if not positions:
+            return []
+        positions = np.array(positions, dtype=np.intp)
+        distances = haversine_distances(lat, lon, self.lats[positions], self.lons[positions])
+        order = np.argsort(distances, kind='stable')
+        return [(float(distances[i]), self.located[positions[i]])
+                for i in order if distances[i] <= radius]
+
+    def nearest(self, lat, lon, k=1, cod_rete=None):
+        """
+        Return the `k` stations (of the network `cod_rete`, if not None) nearest to the
+        point (`lat`, `lon`), as a list of tuples (distance, station) ordered by distance.
+
+        :param lat: latitude (degrees)
+        :param lon: longitude (degrees)
+        :param k: number of stations
+        :param cod_rete: the network of the stations (None for all the networks)
+        :return: [(distance, station), ...]
+        """
+        radius = np.radians(self.cell_size) * EARTH_RADIUS
+        while True:
+            results = self.within(lat, lon, radius, cod_rete)
+            if len(results) >= k or radius >= np.pi * EARTH_RADIUS:
+                return results[:k]
+            radius *= 2
+
+    def get_nearest(self, lat, lon, radius, **kwargs):
+        """
+        Get the station nearest to the point (`lat`, `lon`), inside the radius `radius` meters,
+        among the stations with the properties `kwargs` (see method `get`).
+
+        :param lat: latitude (degrees)
+        :param lon: longitude (degrees)
+        :param radius: radius of the search (meters)
+        :param kwargs: dictionary of column values
+        :return: the station object (if found), otherwise None
+        """
+        props = dict()
+        for column_name, value in kwargs.items():
+            if column_name not in self.columns:
+                raise ValueError('column %r is not loaded in the index' % column_name)
+            if value is None:
+                continue
+            try:
+                props[column_name] = self.normalize(column_name, value)
+            except ValueError:
+                return None
+        for _, station in self.within(lat, lon, radius, kwargs.get('cod_rete')):
+            if self.matches(station, props):
+                return station
+        return None
+
+
+def resolve_station(station_index, metadata, radius=None):
+    """
+    Find the station of the measures with metadata `metadata`, using the index of stations
+    `station_index`. The stations of ARPA-ER and RMN are found by name (and coordinates,
+    if available), the others by cod_utente. If `radius` is not None, the station of ARPA-ER
+    and RMN is the nearest with the same name inside the radius (in meters) from the
+    coordinates, instead of the one with the same coordinates.
+    Return the properties used to find the station and the station found (or None).
+
+    :param station_index: `StationIndex` instance
+    :param metadata: metadata of the measures
+    :param radius: if not None, radius in meters of the search by coordinates
+    :return: (station_props, station)
+    """
+    station_props = {
+        'cod_rete': metadata['cod_rete']
+    }
+    if metadata['format'] not in ('ARPA-ER', 'RMN'):
+        station_props['cod_utente'] = metadata['cod_utente']
+    else:  # workaround to manage Emilia Romagna/RMN: try to find by name
+        station_props['nome'] = metadata['cod_utente']
+        if metadata['lat']:
+            station_props['lat'] = metadata['lat']
+        if metadata['lon']:
+            station_props['lon'] = metadata['lon']
+        if radius is not None and metadata['lat'] and metadata['lon']:
+            station = station_index.get_nearest(
+                metadata['lat'], metadata['lon'], radius, cod_rete=metadata['cod_rete'],
+                nome=metadata['cod_utente'])
+            return station_props, station
+    return station_props, station_index.get(**station_props)
+
+
+def get_er_station(station_index, **station_props):
     """
     debugger log on ER stations
     """
@@ -55,46 +374,35 @@ def get_er_station(conn, anag_table, **station_props):
     if station_props['lat'] and station_props['lon']:
         # list the nearest stations inside a circle of radius meters
         radius = '1000'
-        sql = """
-        SELECT * FROM ( SELECT id_staz, nome, lon, lat, cod_rete,
-        ST_DistanceSphere(ST_MakePoint(lon, lat), ST_MakePoint(%s, %s))  as distance 
-        FROM dailypdbadmclima.anag__stazioni ORDER BY distance) as t WHERE t.distance < %s
-        and cod_rete = %s
-        """ % (station_props['lon'], station_props['lat'], radius, station_props['cod_rete'])
-        results1 = conn.execute(sql).fetchall()
+        results1 = station_index.within(
+            station_props['lat'], station_props['lon'], float(radius),
+            cod_rete=station_props['cod_rete'])
         if not results1:
             msg = "not found any station near this (radius %s)" % radius
         else:
-            thestations1 = [r[0] for r in results1]
+            thestations1 = [r[1].id_staz for r in results1]
             msg = "found %s stations near this (radius %s): %r" \
                   % (len(thestations1), radius, thestations1)
         new_messages.append(msg)
-    base_clause = getattr(anag_table.c, 'cod_rete') == station_props['cod_rete']
     # list stations with the same name (case insensitive)
-    clause1 = and_(
-        func.lower(getattr(anag_table.c, 'nome')) == station_props['cod_utente'].lower(),
-        base_clause)
-    query = select([anag_table]).where(clause1)
-    results2 = conn.execute(query).fetchall()
+    name_key = (station_index.normalize('cod_rete', station_props['cod_rete']),
+                station_index.normalize('nome', station_props['cod_utente']))
+    results2 = station_index.by_name.get(name_key, [])
     if not results2:
         msg = 'no found any station with the same name (case insensitive)'
         new_messages.append(msg)
     else:
-        thestations2 = [r[0] for r in results2]
+        thestations2 = [r.id_staz for r in results2]
         msg = "found %s stations with the same name (case insensitive): %r" \
               % (len(thestations2), thestations2)
         new_messages.append(msg)
     # list stations with the same name (case sensitive)
-    clause2 = and_(
-        getattr(anag_table.c, 'nome') == station_props['cod_utente'],
-        base_clause)
-    query = select([anag_table]).where(clause2)
-    results3 = conn.execute(query).fetchall()
+    results3 = [r for r in results2 if r.nome == station_props['cod_utente']]
     if not results3:
         msg = 'no found any station with the same exact name (case sensitive)'
         new_messages.append(msg)
     else:
-        thestations3 = [r[0] for r in results3]
+        thestations3 = [r.id_staz for r in results3]
         msg = "found %s stations with the same exact name (case sensitive): %r" \
               % (len(thestations3), thestations3)
         new_messages.append(msg)
@@ -105,30 +413,59 @@ def get_er_station(conn, anag_table, **station_props):
     return new_messages
 
 
-def find_new_er_stations(data_folder, dburi):
+def load_data_stations(data_path):
+    """
+    Return the number of measures and the distinct metadata of the stations of a file of data
+    located at `data_path` (see `export.load_stations`), or None if it is not a file of data.
+
+    :param data_path: path of the file
+    :return: (number of measures, [metadata of station, ...]) or None
+    """
+    if not isfile(data_path) or splitext(data_path.lower())[1] not in export.DATA_EXTENSIONS:
+        return None
+    return export.load_stations(data_path)
+
+
+def iter_data_stations(data_paths, workers=1):
+    """
+    Yield the tuples (data_path, load_data_stations(data_path)) for each path of `data_paths`,
+    in the same order. If `workers` > 1, the files are scanned in parallel by a pool
+    of `workers` processes.
+
+    :param data_paths: list of paths of files
+    :param workers: number of processes to use
+    :return: iterable of (data_path, (number of measures, [metadata of station, ...]) or None)
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # results are returned in the same order of `data_paths`
+            yield from zip(data_paths, executor.map(load_data_stations, data_paths))
+    else:
+        for data_path in data_paths:
+            yield data_path, load_data_stations(data_path)
+
+
+def find_new_er_stations(data_folder, dburi, workers=1):
     """debug mode for ER stations"""
     msgs = []
     conn = db_utils.ensure_connection(dburi)
-    meta = MetaData()
-    anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
-                       schema='dailypdbadmclima')
     all_stations = dict()
     new_stations = dict()
     num_records = 0
     with conn.begin():
+        station_index = StationIndex(conn)
         total_to_see = listdir(data_folder)
         total_to_see_number = len(total_to_see)
-        for i, file_name in enumerate(total_to_see):
-            csv_path = join(data_folder, file_name)
+        data_paths = [join(data_folder, file_name) for file_name in total_to_see]
+        for i, (_, scan) in enumerate(iter_data_stations(data_paths, workers)):
             msg = 'examine file %s/%s...' % (i+1, total_to_see_number)
             print(msg)
             msgs.append(msg)
-            if not isfile(csv_path) or splitext(file_name.lower())[1] != '.csv':
+            if scan is None:
                 continue
-            records = export.csv2data(csv_path)
-            for record in records:
-                num_records += 1
-                record_md = record[0]
+            file_num_records, stations = scan
+            num_records += file_num_records
+            for record_md in stations:
                 station_key = (record_md['cod_utente'], record_md['cod_rete'],
                                record_md['lat'], record_md['lon'])
                 if station_key in all_stations:
@@ -150,7 +487,7 @@ def find_new_er_stations(data_folder, dburi):
                     """ % (record_md['cod_utente'], record_md['lat'], record_md['lon'])
                 print(msg)
                 msgs.append(msg)
-                new_messages = get_er_station(conn, anag_table, **station_props)
+                new_messages = get_er_station(station_index, **station_props)
                 for new_message in new_messages:
                     print(new_message)
                     msgs.append(new_message)
@@ -167,54 +504,44 @@ def find_new_er_stations(data_folder, dburi):
     return msgs, new_stations
 
 
-def find_new_stations(data_folder, dburi):
+def find_new_stations(data_folder, dburi, workers=1, radius=None):
     """
-    Find stations from a set of CSV files inside a folder `data_folder`, that are not
+    Find stations from a set of CSV (or .npz) files inside a folder `data_folder`, that are not
     present in the database and creates a CSV with the list.
     Return the not found stations as a dictionary (key is ('cod_utente', 'cod_rete') )
 
     :param data_folder: folder path where CSV files are in
     :param dburi: db connection URI
+    :param workers: number of processes scanning the files (see `iter_data_stations`)
+    :param radius: if not None, radius in meters of the search by coordinates of
+                   ARPA-ER and RMN stations (see `resolve_station`)
     :return: ([list of report messages], {dict of not found stations})
     """
     msgs = []
     conn = db_utils.ensure_connection(dburi)
-    meta = MetaData()
-    anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
-                       schema='dailypdbadmclima')
     all_stations = dict()
     new_stations = dict()
     num_records = 0
     with conn.begin():
+        station_index = StationIndex(conn)
         total_to_see = listdir(data_folder)
         total_to_see_number = len(total_to_see)
-        for i, file_name in enumerate(total_to_see):
-            csv_path = join(data_folder, file_name)
+        data_paths = [join(data_folder, file_name) for file_name in total_to_see]
+        for i, (_, scan) in enumerate(iter_data_stations(data_paths, workers)):
             msg = 'examine file %s/%s...' % (i+1, total_to_see_number)
             print(msg)
             msgs.append(msg)
-            if not isfile(csv_path) or splitext(file_name.lower())[1] != '.csv':
+            if scan is None:
                 continue
-            records = export.csv2data(csv_path)
-            for record in records:
-                num_records += 1
-                record_md = record[0]
+            file_num_records, stations = scan
+            num_records += file_num_records
+            for record_md in stations:
                 station_key = (record_md['cod_utente'], record_md['cod_rete'],
                                record_md['lat'], record_md['lon'])
                 if station_key in all_stations:
                     continue
-                station_props = {
-                    'cod_rete': record_md['cod_rete']
-                }
-                if record_md['format'] not in ('ARPA-ER', 'RMN'):
-                    station_props['cod_utente'] = record_md['cod_utente']
-                else:  # workaround to manage Emilia Romagna/RMN: try to find by name
-                    station_props['nome'] = record_md['cod_utente']
-                    if record_md['lat']:
-                        station_props['lat'] = record_md['lat']
-                    if record_md['lon']:
-                        station_props['lon'] = record_md['lon']
-                db_station = get_db_station(conn, anag_table, **station_props)
+                station_props, db_station = resolve_station(
+                    station_index, record_md, radius)
                 all_stations[station_key] = db_station
                 if not db_station:  # NOT FOUND in the database
                     new_station = station_props
@@ -301,7 +628,6 @@ def select_prec_records(conn, sql_fields='*', stations_ids=None, schema='dailypd
     :param no_order: if False, sort results by station, date
     :return: the iterable of the results
     """
-    conn_r = db_utils.get_safe_memory_read_connection(conn)
     sql = "SELECT %s FROM %s.ds__preci" % (sql_fields, schema)
     where_clauses = []
     if stations_ids is not None:
@@ -325,8 +651,7 @@ def select_prec_records(conn, sql_fields='*', stations_ids=None, schema='dailypd
     if not no_order:
         sql += ' ORDER BY cod_staz, data_i'
     # each record must be a list to make flag changeable:
-    results = conn_r.execute(sql)
-    results = db_utils.results_list(results)
+    results = db_utils.results_list(db_utils.read_results(conn, sql))
     return results
 
 
@@ -353,7 +678,6 @@ def select_temp_records(conn, fields, sql_fields='*', stations_ids=None,
     :param no_order: if True, sort results by station, date
     :return: the iterable of the results
     """
-    conn_r = db_utils.get_safe_memory_read_connection(conn)
     sql = "SELECT %s FROM %s.ds__t200" % (sql_fields, schema)
     where_clauses = []
     if stations_ids is not None:
@@ -384,9 +708,8 @@ def select_temp_records(conn, fields, sql_fields='*', stations_ids=None,
         sql += ' WHERE %s' % (' AND '.join(where_clauses))
     if not no_order:
         sql += ' ORDER BY cod_staz, data_i'
-    results = conn_r.execute(sql)
     # each record must be a list to make flag changeable:
-    results = db_utils.results_list(results)
+    results = db_utils.results_list(db_utils.read_results(conn, sql))
     return results
 
 
@@ -412,7 +735,6 @@ def select_records(conn, table, fields, sql_fields='*', stations_ids=None,
     :param no_order: if True, sort results by station, date
     :return: the iterable of the results
     """
-    conn_r = db_utils.get_safe_memory_read_connection(conn)
     sql = "SELECT %s FROM %s.%s" % (sql_fields, schema, table)
     where_clauses = []
     if stations_ids is not None:
@@ -436,7 +758,6 @@ def select_records(conn, table, fields, sql_fields='*', stations_ids=None,
         sql += ' WHERE %s' % (' AND '.join(where_clauses))
     if not no_order:
         sql += ' ORDER BY cod_staz, data_i'
-    results = conn_r.execute(sql)
     # each record must be a list to make flag changeable:
-    results = db_utils.results_list(results)
+    results = db_utils.results_list(db_utils.read_results(conn, sql))
     return results
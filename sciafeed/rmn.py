@@ -3,7 +3,7 @@ This module contains the functions and utilities to parse a RMN file
 (Rete Mareografica Nazionale)
 """
 import csv
-from datetime import datetime
+import itertools
 from os.path import abspath, dirname, join
 from pathlib import PurePath
 
@@ -13,6 +13,10 @@ from sciafeed import utils
 PARAMETERS_FILEPATH = join(TEMPLATES_PATH, 'rmn_params.csv')
 LIMITING_PARAMETERS = {}
 FORMAT_LABEL = 'RMN'
+# cheap necessary conditions for a file to be of this format (see `parsing.guess_format`)
+FORMAT_SIGNATURE = {}
+# max number of lines read from the beginning of a file to find the header
+HEADER_MAX_LINES = 1000
 
 
 def load_parameter_file(parameters_filepath=PARAMETERS_FILEPATH, delimiter=';'):
@@ -67,10 +71,33 @@ def load_parameter_thresholds(parameters_filepath=PARAMETERS_FILEPATH, delimiter
     return ret_value
 
 
+def sniff_header(filepath):
+    """
+    Read the head of a RMN file (at most HEADER_MAX_LINES lines) and return a dictionary
+    with the header information found, independent from the parameters:
+    ::
+
+        {'header_line': the line of the CSV header (None if not found)}
+
+    Use `utils.sniff_file(filepath, sniff_header)` to read a file only once.
+
+    :param filepath: path to the input RMN file
+    :return: the dictionary of header information
+    """
+    header_line = None
+    with open(filepath, 'r', encoding='unicode_escape') as csv_file:
+        for line in itertools.islice(csv_file, HEADER_MAX_LINES):
+            if 'DATA' in line and 'ORA' in line:
+                header_line = line
+                break
+    return {'header_line': header_line}
+
+
 def guess_fieldnames(filepath, parameters_map):
     """
     Parse a rmn file to guess the right CSV header and the station name.
     The measured parameters are taken from the parameters_map dictionary.
+    The head of the file is read only once (see `sniff_header`).
 
     :param filepath: path to the input RMN file
     :param parameters_map: dictionary of information about stored parameters at each position
@@ -78,12 +105,9 @@ def guess_fieldnames(filepath, parameters_map):
     """
     fieldnames = []
     station = None
-    with open(filepath, 'r', encoding='unicode_escape') as csv_file:
-        for line in csv_file:
-            if 'DATA' in line and 'ORA' in line:
-                break
-        else:  # never gone on break: not found header
-            raise ValueError('RMN header not found')
+    line = utils.sniff_file(filepath, sniff_header)['header_line']
+    if line is None:
+        raise ValueError('RMN header not found')
     tokens = line.split(';')
     for token in tokens:
         token = token.replace('À', 'A').replace('Ã\x80', 'A').replace('ï¿½', 'A')
@@ -124,7 +148,7 @@ def parse_row(row, parameters_map, metadata=None):
     else:
         metadata = metadata.copy()
     time_str = "%s %s" % (row['DATA'], row['ORA'])
-    date_obj = datetime.strptime(time_str, "%Y%m%d %H:%M")
+    date_obj = utils.strptime(time_str, "%Y%m%d %H:%M")
     if date_obj.minute != 0:
         return []
     data = []
@@ -155,7 +179,7 @@ def validate_row_format(row):
     err_msg = None
     try:
         time_str = "%s %s" % (row['DATA'], row['ORA'])
-        datetime.strptime(time_str, "%Y%m%d %H:%M")
+        utils.strptime(time_str, "%Y%m%d %H:%M")
     except ValueError:
         err_msg = 'the reference time for the row is not parsable'
         return err_msg
@@ -172,6 +196,16 @@ def validate_row_format(row):
     return err_msg
 
 
+def is_header_row(row):
+    """
+    Return True if `row` is the CSV header of a RMN file.
+
+    :param row: a row dictionary of the RMN file as parsed by csv.DictReader
+    :return: True if the data rows start after `row`, False otherwise
+    """
+    return (row['DATA'], row['ORA']) == ('DATA', 'ORA')
+
+
 def rows_generator(filepath, parameters_map, metadata):
     """
     A generator of rows of a RMN file containing data. Each value returned
@@ -182,15 +216,9 @@ def rows_generator(filepath, parameters_map, metadata):
     :param metadata: default metadata if not provided in the row
     :return: iterable of (index of the row, row)
     """
-    csv_file = open(filepath, 'r', encoding='unicode_escape')
-    csv_reader = csv.DictReader(csv_file, delimiter=';', fieldnames=metadata['fieldnames'])
-    i = 0
-    for i, row in enumerate(csv_reader, 1):
-        if (row['DATA'], row['ORA']) != ('DATA', 'ORA'):
-            continue
-        break
-    for j, row in enumerate(csv_reader, i+1):
-        yield j, row
+    header = utils.sniff_file(filepath, sniff_header)
+    yield from utils.iter_data_rows(filepath, header, metadata['fieldnames'], is_header_row,
+                                    delimiter=';', encoding='unicode_escape')
 
 
 # entry point candidate
@@ -206,7 +234,7 @@ def extract_metadata(filepath, parameters_filepath):
     :return: dictionary of metadata extracted
     """
     source = join(*PurePath(abspath(filepath)).parts[-2:])
-    parameters_map = load_parameter_file(parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
     fieldnames, station = guess_fieldnames(filepath, parameters_map)
     metadata = {'cod_utente': station, 'fieldnames': fieldnames, 'format': FORMAT_LABEL,
                 'source': source}
@@ -215,34 +243,23 @@ def extract_metadata(filepath, parameters_filepath):
     return metadata
 
 
-# entry point candidate
-def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+def parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
     """
-    Open an rmn file and validate it against the format.
-    Return the list of tuples (row index, error message) of the errors found.
-    row_index=0 is used only for global formatting errors.
+    A generator of the rows of a RMN file, validated and parsed in a single pass.
+    Each value returned is a tuple (index of the row, list of measures of the row), where
+    the measures are as returned by the function `parse_row`.
+    Rows not compliant with the format are not returned: the errors found are appended
+    to `found_errors` as tuples (row index, error message).
 
-    :param filepath: path to the rmn file
-    :param parameters_filepath: path to the CSV file containing info about stored parameters
-    :return: [..., (row index, error message), ...]
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (index of the row, list of measures of the row)
     """
-    parameters_map = load_parameter_file(parameters_filepath)
-    try:
-        guess_fieldnames(filepath, parameters_map)
-    except ValueError as err:
-        return [(0, str(err))]
-    metadata = extract_metadata(filepath, parameters_filepath)
-    csv_file = open(filepath, 'r', encoding='unicode_escape')
-    csv_reader = csv.DictReader(csv_file, delimiter=';', fieldnames=metadata['fieldnames'])
-    j = 0
-    for j, row in enumerate(csv_reader, 1):
-        if (row['DATA'], row['ORA']) != ('DATA', 'ORA'):
-            continue
-        break
-    found_errors = []
     last_time = None
     last_row = None
-    for i, row in enumerate(csv_reader, j+1):
+    for i, row in rows_generator(filepath, parameters_map, metadata):
         err_msg = validate_row_format(row)
         if err_msg:
             found_errors.append((i, err_msg))
@@ -262,10 +279,61 @@ def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
             continue
         last_time = cur_time
         last_row = row
+        yield i, row_measures
+
+
+# entry point candidate
+def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+    """
+    Open an rmn file and validate it against the format.
+    Return the list of tuples (row index, error message) of the errors found.
+    row_index=0 is used only for global formatting errors.
 
+    :param filepath: path to the rmn file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :return: [..., (row index, error message), ...]
+    """
+    try:
+        metadata = extract_metadata(filepath, parameters_filepath)
+    except ValueError as err:
+        return [(0, str(err))]
+    found_errors = []
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for _ in parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
+        pass
     return found_errors
 
 
+# entry point candidate
+def iter_parse(filepath, parameters_filepath=PARAMETERS_FILEPATH, found_errors=None):
+    """
+    Read a RMN file located at `filepath` and yield the data stored inside, measure by
+    measure, without loading the whole file in memory. Each measure is a tuple:
+    ::
+
+      (metadata, datetime object, par_code, par_value, flag)
+
+    The errors found are appended to the list `found_errors` (if provided), as the
+    function `validate_format` returns them.
+
+    :param filepath: path to the rmn file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (metadata, datetime object, par_code, par_value, flag)
+    """
+    if found_errors is None:
+        found_errors = []
+    try:
+        metadata = extract_metadata(filepath, parameters_filepath)
+    except ValueError as err:
+        found_errors.append((0, str(err)))
+        return
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for i, row_measures in parsed_rows_generator(
+            filepath, parameters_map, metadata, found_errors):
+        yield from row_measures
+
+
 # entry point candidate
 def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     """
@@ -282,19 +350,9 @@ def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :return: (data, found_errors)
     """""
-    data = []
-    found_errors = validate_format(filepath, parameters_filepath)
-    found_errors_dict = dict(found_errors)
-    if 0 in found_errors_dict:
-        return data, found_errors
-    metadata = extract_metadata(filepath, parameters_filepath)
-    parameters_map = load_parameter_file(parameters_filepath)
-    for i, row in rows_generator(filepath, parameters_map, metadata):
-        if i in found_errors_dict:
-            continue
-        metadata['row'] = i
-        parsed_row = parse_row(row, parameters_map, metadata)
-        data.extend(parsed_row)
+    found_errors = []
+    data = list(iter_parse(filepath, parameters_filepath=parameters_filepath,
+                           found_errors=found_errors))
     return data, found_errors
 
 
@@ -307,7 +365,7 @@ def is_format_compliant(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :return: True if the file is compliant, False otherwise
     """
-    parameters_map = load_parameter_file(parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
     try:
         fieldnames, station = guess_fieldnames(filepath, parameters_map)
     except:
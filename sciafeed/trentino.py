@@ -2,7 +2,7 @@
 This module contains functions and utilities to parse a file with format used by region Trentino
 """
 import csv
-from datetime import datetime
+import itertools
 from os.path import abspath, basename, dirname, join, splitext
 from pathlib import PurePath
 
@@ -12,6 +12,10 @@ from sciafeed import utils
 PARAMETERS_FILEPATH = join(TEMPLATES_PATH, 'trentino_params.csv')
 LIMITING_PARAMETERS = {}
 FORMAT_LABEL = 'TRENTINO'
+# cheap necessary conditions for a file to be of this format (see `parsing.guess_format`)
+FORMAT_SIGNATURE = {'extensions': ('.csv', )}
+# max number of lines read from the beginning of a file to find the header
+HEADER_MAX_LINES = 1000
 
 
 def load_parameter_file(parameters_filepath=PARAMETERS_FILEPATH, delimiter=';'):
@@ -92,25 +96,26 @@ def validate_filename(filename: str):
     return err_msg
 
 
-def guess_fieldnames(filepath, parameters_map):
+def sniff_header(filepath):
     """
-    Parse a TRENTINO file to guess the right CSV header, the station code and some
-    extra station properties.
-    Station properties is a dictionary witk keys ['cod_utente', 'desc', 'lat', 'lon', height'].
-    The measured parameters are taken from the parameters_map dictionary.
+    Read the head of a TRENTINO file (at most HEADER_MAX_LINES lines) and return a dictionary
+    with the header information found, independent from the parameters:
+    ::
+
+        {'station_code': station code (with the leading char),
+         'parameters': [..., CSV_CODE of parameter found, ...],
+         'station_props_str': description of the station}
+
+    Use `utils.sniff_file(filepath, sniff_header)` to read a file only once.
 
     :param filepath: path to the input TRENTINO file
-    :param parameters_map: dictionary of information about stored parameters at each position
-    :return: the tuple (list of fieldnames, station_code, extra_station_props)
+    :return: the dictionary of header information
     """
     station_code = None
     station_props_str = ''
-    parameter = None
-    err_msg = validate_filename(basename(filepath))
-    if err_msg:
-        raise ValueError(err_msg)
+    parameters = []
     with open(filepath, 'r', encoding='unicode_escape') as csv_file:
-        for line in csv_file:
+        for line in itertools.islice(csv_file, HEADER_MAX_LINES):
             line_tokens = [t.replace('"', '').replace("'", '').strip() for t in line.split(',')]
             line_tokens = [t for t in line_tokens if t]
             if len(line_tokens) < 2:
@@ -122,7 +127,32 @@ def guess_fieldnames(filepath, parameters_map):
             if first_col == 'Time':
                 station_code = second_col
             elif first_col == 'and':
-                parameter = parameters_map.get(second_col)['par_code']
+                parameters.append(second_col)
+    return {'station_code': station_code, 'parameters': parameters,
+            'station_props_str': station_props_str}
+
+
+def guess_fieldnames(filepath, parameters_map):
+    """
+    Parse a TRENTINO file to guess the right CSV header, the station code and some
+    extra station properties.
+    Station properties is a dictionary witk keys ['cod_utente', 'desc', 'lat', 'lon', height'].
+    The measured parameters are taken from the parameters_map dictionary.
+    The head of the file is read only once (see `sniff_header`).
+
+    :param filepath: path to the input TRENTINO file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :return: the tuple (list of fieldnames, station_code, extra_station_props)
+    """
+    parameter = None
+    err_msg = validate_filename(basename(filepath))
+    if err_msg:
+        raise ValueError(err_msg)
+    header = utils.sniff_file(filepath, sniff_header)
+    station_code = header['station_code']
+    station_props_str = header['station_props_str']
+    for csv_code in header['parameters']:
+        parameter = parameters_map.get(csv_code)['par_code']
     if not station_code or not parameter or len(station_code) < 2:
         raise ValueError('trentino header not compliant')
     station_code = station_code[1:]
@@ -163,7 +193,7 @@ def parse_row(row, parameters_map, metadata=None):
         metadata = dict()
     else:
         metadata = metadata.copy()
-    date_obj = datetime.strptime(row['date'].strip(), "%H:%M:%S %d/%m/%Y").date()
+    date_obj = utils.strptime(row['date'].strip(), "%H:%M:%S %d/%m/%Y").date()
     all_parameters = [p['par_code'] for p in parameters_map.values()]
     param_code = list(set(row.keys()).intersection(all_parameters))[0]
     props = [p for p in parameters_map.values() if p['par_code'] == param_code][0]
@@ -188,7 +218,7 @@ def validate_row_format(row):
     """
     err_msg = ''
     try:
-        datetime.strptime(row['date'], "%H:%M:%S %d/%m/%Y")
+        utils.strptime(row['date'], "%H:%M:%S %d/%m/%Y")
     except ValueError:
         err_msg = 'the date format is wrong'
         return err_msg
@@ -206,6 +236,16 @@ def validate_row_format(row):
     return err_msg
 
 
+def is_header_row(row):
+    """
+    Return True if `row` is the last row of the header of a TRENTINO file.
+
+    :param row: a row dictionary of the TRENTINO file as parsed by csv.DictReader
+    :return: True if the data rows start after `row`, False otherwise
+    """
+    return ((row['date'] or '').strip(), (row['quality'] or '').strip()) == ('', 'Qual')
+
+
 def rows_generator(filepath, parameters_map, metadata):
     """
     A generator of rows of a TRENTINO file containing data. Each value returned
@@ -216,14 +256,9 @@ def rows_generator(filepath, parameters_map, metadata):
     :param metadata: default metadata if not provided in the row
     :return: iterable of (index of the row, row)
     """
-    csv_file = open(filepath, 'r', encoding='unicode_escape')
-    csv_reader = csv.DictReader(csv_file, delimiter=',', fieldnames=metadata['fieldnames'])
-    j = 0
-    for j, row in enumerate(csv_reader, 1):
-        if (row['date'].strip(), row['quality'].strip()) != ('', 'Qual'):
-            continue
-        break
-    for i, row in enumerate(csv_reader, j+1):
+    header = utils.sniff_file(filepath, sniff_header)
+    for i, row in utils.iter_data_rows(filepath, header, metadata['fieldnames'], is_header_row,
+                                       encoding='unicode_escape'):
         row = {k.strip(): v.strip() for k, v in row.items() if k}
         yield i, row
 
@@ -241,7 +276,7 @@ def extract_metadata(filepath, parameters_filepath):
     :return: dictionary of metadata extracted
     """
     source = join(*PurePath(abspath(filepath)).parts[-2:])
-    parameters_map = load_parameter_file(parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
     fieldnames, _, metadata = guess_fieldnames(filepath, parameters_map)
     metadata['fieldnames'] = fieldnames
     metadata['source'] = source
@@ -251,34 +286,25 @@ def extract_metadata(filepath, parameters_filepath):
     return metadata
 
 
-# entry point candidate
-def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+def parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
     """
-    Open a TRENTINO file and validate it against the format.
-    Return the list of tuples (row index, error message) of the errors found.
-    row_index=0 is used only for global formatting errors.
+    A generator of the rows of a TRENTINO file, validated and parsed in a single pass.
+    Each value returned is a tuple (index of the row, list of measures of the row), where
+    the measures are as returned by the function `parse_row`.
+    Rows not compliant with the format are not returned: the errors found are appended
+    to `found_errors` as tuples (row index, error message).
 
-    :param filepath: path to the TRENTINO file
-    :param parameters_filepath: path to the CSV file containing info about stored parameters
-    :return: [..., (row index, error message), ...]
+    :param filepath: the file path of the input file
+    :param parameters_map: dictionary of information about stored parameters at each position
+    :param metadata: metadata of the file, as returned by the function `extract_metadata`
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (index of the row, list of measures of the row)
     """
-    parameters_map = load_parameter_file(parameters_filepath)
-    try:
-        guess_fieldnames(filepath, parameters_map)
-    except ValueError as err:
-        return [(0, str(err))]
-    metadata = extract_metadata(filepath, parameters_filepath)
-    csv_file = open(filepath, 'r', encoding='unicode_escape')
-    csv_reader = csv.DictReader(csv_file, delimiter=',', fieldnames=metadata['fieldnames'])
-    j = 0
-    for j, row in enumerate(csv_reader, 1):
-        if (row['date'], row['quality']) != ('', 'Qual'):
-            continue
-        break
-    found_errors = []
+    header = utils.sniff_file(filepath, sniff_header)
     last_time = None
     last_row = None
-    for i, row in enumerate(csv_reader, j+1):
+    for i, row in utils.iter_data_rows(filepath, header, metadata['fieldnames'], is_header_row,
+                                       encoding='unicode_escape'):
         err_msg = validate_row_format(row)
         if err_msg:
             found_errors.append((i, err_msg))
@@ -298,10 +324,61 @@ def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
             continue
         last_time = cur_time
         last_row = row
+        yield i, row_measures
 
+
+# entry point candidate
+def validate_format(filepath, parameters_filepath=PARAMETERS_FILEPATH):
+    """
+    Open a TRENTINO file and validate it against the format.
+    Return the list of tuples (row index, error message) of the errors found.
+    row_index=0 is used only for global formatting errors.
+
+    :param filepath: path to the TRENTINO file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :return: [..., (row index, error message), ...]
+    """
+    try:
+        metadata = extract_metadata(filepath, parameters_filepath)
+    except ValueError as err:
+        return [(0, str(err))]
+    found_errors = []
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for _ in parsed_rows_generator(filepath, parameters_map, metadata, found_errors):
+        pass
     return found_errors
 
 
+# entry point candidate
+def iter_parse(filepath, parameters_filepath=PARAMETERS_FILEPATH, found_errors=None):
+    """
+    Read a TRENTINO file located at `filepath` and yield the data stored inside, measure by
+    measure, without loading the whole file in memory. Each measure is a tuple:
+    ::
+
+      (metadata, datetime object, par_code, par_value, flag)
+
+    The errors found are appended to the list `found_errors` (if provided), as the
+    function `validate_format` returns them.
+
+    :param filepath: path to the TRENTINO file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param found_errors: list where to append the tuples (row index, error message)
+    :return: iterable of (metadata, datetime object, par_code, par_value, flag)
+    """
+    if found_errors is None:
+        found_errors = []
+    try:
+        metadata = extract_metadata(filepath, parameters_filepath)
+    except ValueError as err:
+        found_errors.append((0, str(err)))
+        return
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
+    for i, row_measures in parsed_rows_generator(
+            filepath, parameters_map, metadata, found_errors):
+        yield from row_measures
+
+
 # entry point candidate
 def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     """
@@ -318,20 +395,9 @@ def parse(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :return: (data, found_errors)
     """""
-    data = []
-    found_errors = validate_format(filepath, parameters_filepath)
-    found_errors_dict = dict(found_errors)
-    if 0 in found_errors_dict:
-        return data, found_errors
-    metadata = extract_metadata(filepath, parameters_filepath)
-    parameters_map = load_parameter_file(parameters_filepath)
-    data = []
-    for i, row in rows_generator(filepath, parameters_map, metadata):
-        if i in found_errors_dict:
-            continue
-        metadata['row'] = i
-        parsed_row = parse_row(row, parameters_map, metadata)
-        data.extend(parsed_row)
+    found_errors = []
+    data = list(iter_parse(filepath, parameters_filepath=parameters_filepath,
+                           found_errors=found_errors))
     return data, found_errors
 
 
@@ -344,7 +410,7 @@ def is_format_compliant(filepath, parameters_filepath=PARAMETERS_FILEPATH):
     :param parameters_filepath: path to the CSV file containing info about stored parameters
     :return: True if the file is compliant, False otherwise
     """
-    parameters_map = load_parameter_file(parameters_filepath)
+    parameters_map = utils.load_parameters(load_parameter_file, parameters_filepath)
     try:
         guess_fieldnames(filepath, parameters_map)
     except:
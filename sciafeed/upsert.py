@@ -2,10 +2,11 @@
 This module contains functions and utilities that update the SCIA database
 """
 import functools
+import io
 import itertools
 import logging
-import time
 import traceback
+import uuid
 
 from sqlalchemy import MetaData, Table
 
@@ -184,6 +185,10 @@ class2subfields_map = {
         'n13', 'ff13', 'n14', 'ff14', 'n15', 'ff15', 'n16', 'ff16'],
     'vntmd_obj': ['flag.ndati', 'flag.wht', 'ff']
 }
+# number of rows sent to the database for each COPY command of `copy_upsert`
+COPY_CHUNK_SIZE = 10000
+# fields identifying a record of the data tables: `copy_upsert` keeps one record for each key
+RECORD_KEY_FIELDS = ('cod_staz', 'data_i', 'cod_aggr')
 
 
 def upsert_stations(dburi, stations_path):
@@ -216,9 +221,10 @@ def upsert_stations(dburi, stations_path):
     new_stations = []
     num_updated_stations = 0
     try:
+        station_index = querying.StationIndex(conn, anag_table)
         for station in stations:
-            db_station = querying.get_db_station(
-                conn, anag_table, cod_rete=station['cod_rete'], cod_utente=station['cod_utente'])
+            db_station = station_index.get(
+                cod_rete=station['cod_rete'], cod_utente=station['cod_utente'])
             if db_station:
                 where_clause = anag_table.c.id_staz == db_station['id_staz']
                 station['id_staz'] = db_station['id_staz']
@@ -239,10 +245,88 @@ def upsert_stations(dburi, stations_path):
     return msgs, num_inserted_stations, num_updated_stations
 
 
+def write_flags(conn, table, fields_records, schema='dailypdbanpacarica', logger=None):
+    """
+    Set the flags of the table with name `table` of the schema `schema`.
+    `fields_records` is a list of tuples (db_fields, records, flag_index): for each record
+    [cod_staz, data_i, ...] the flag at index `flag_index` is set to all the fields `db_fields`
+    if it differs from the flag of the first field. For example:
+    ::
+
+        [(['tmxgg'], tmxgg_records, 3), (['tmngg'], tmngg_records, 5)]
+
+    The flags of all the elements are streamed with COPY into a single session TEMP table,
+    then each element is applied with an UPDATE joined to it by (cod_staz, data_i),
+    in the order of `fields_records`.
+    Return a dictionary {first db_field: number of records updated}.
+
+    :param conn: db connection object
+    :param table: db table name to use
+    :param fields_records: list of tuples (db_fields, records, flag_index)
+    :param schema: database schema to use
+    :param logger: logging object where to report actions
+    :return: dictionary of the number of updates for each first db_field
+    """
+    if logger is None:
+        logger = logging.getLogger(LOG_NAME)
+    num_of_updates = dict((db_fields[0], 0) for db_fields, records, flag_index in fields_records)
+    flags_map = dict()
+    for i, (db_fields, records, flag_index) in enumerate(fields_records):
+        for record in records:
+            flags_map.setdefault((record[0], record[1]), {})['flag%s' % i] = record[flag_index]
+    if not flags_map:
+        return num_of_updates
+    logger.debug('start db update of flags (%s)' % ', '.join(num_of_updates))
+    flag_columns = ['flag%s' % i for i in range(len(fields_records))]
+    tmp_table_name = 'updates_flags%s' % uuid.uuid4().hex[:16]
+    conn.execute("""
+        CREATE TEMP TABLE %s (
+            cod_staz integer NOT NULL,
+            data_i timestamp without time zone NOT NULL,
+            %s,
+            PRIMARY KEY (cod_staz, data_i)
+        )""" % (tmp_table_name, ', '.join('%s integer' % c for c in flag_columns)))
+    logger.debug('created temp table')
+    try:
+        fields = ['cod_staz', 'data_i'] + flag_columns
+        data = (dict(flags, cod_staz=cod_staz, data_i=data_i)
+                for (cod_staz, data_i), flags in flags_map.items())
+        cursor = conn.connection.cursor()
+        copy_sql = 'COPY %s FROM STDIN WITH (FORMAT csv)' % tmp_table_name
+        for chunk in utils.chunked_iterable(data, COPY_CHUNK_SIZE):
+            cursor.copy_expert(copy_sql, io.StringIO(create_copy_rows(fields, chunk)))
+        cursor.close()
+        conn.execute('ANALYZE %s' % tmp_table_name)
+        logger.debug('filled temp table')
+        for column, (db_fields, records, flag_index) in zip(flag_columns, fields_records):
+            # only the rows with a flag to change are written
+            update_sql = """
+                UPDATE %s.%s t SET %s
+                FROM %s u
+                WHERE t.cod_staz = u.cod_staz AND t.data_i = u.data_i
+                AND u.%s IS NOT NULL AND ((t.%s).flag).wht <> u.%s
+            """ % (schema, table, ', '.join('%s.flag.wht = u.%s' % (f, column) for f in db_fields),
+                   tmp_table_name, column, db_fields[0], column)
+            result = conn.execute(update_sql)
+            num_of_updates[db_fields[0]] = result.rowcount
+            logger.info('update completed: %s flags updated (%s)'
+                        % (result.rowcount, db_fields[0]))
+    except:
+        logger.exception('update not completed: something went wrong')
+        num_of_updates = dict.fromkeys(num_of_updates, 0)
+        if conn.in_transaction():
+            # the temp table is removed by the rollback of the transaction
+            return num_of_updates
+        conn.connection.rollback()
+    conn.execute('DROP TABLE IF EXISTS %s' % tmp_table_name)
+    logger.debug('temp table removed')
+    return num_of_updates
+
+
 def update_prec_flags(conn, records, schema='dailypdbanpacarica', logger=None):
     """
     Set the flag for each record of the `records` iterable for the field prec24
-    of the table dailypdbanpacarica.ds__preci.
+    (and prec01, prec06, prec12) of the table dailypdbanpacarica.ds__preci.
     It assumes each record has attributes data_i and cod_staz
 
     :param conn: db connection object
@@ -252,53 +336,8 @@ def update_prec_flags(conn, records, schema='dailypdbanpacarica', logger=None):
 
     :return number of updates
     """
-    if logger is None:
-        logger = logging.getLogger(LOG_NAME)
-    if not list(records):
-        return 0
-    logger.debug('start db update of PREC flags')
-    tmp_table_name = "updates_preci%s" % round(time.time())
-    pre_sql_cmds = [
-        'DROP TABLE IF EXISTS %s' % tmp_table_name,
-        '''
-    CREATE TABLE IF NOT EXISTS %s (
-        cod_staz integer NOT NULL,
-        data_i timestamp without time zone NOT NULL,
-        flag integer,
-        PRIMARY KEY (cod_staz, data_i)
-        )''' % tmp_table_name,
-    ]
-    for cmd in pre_sql_cmds:
-        conn.execute(cmd)
-    logger.debug('created temp folder')
-    meta = MetaData()
-    table_obj = Table(tmp_table_name, meta, autoload=True, autoload_with=conn.engine)
-    num_of_updates = 0
-    try:
-        data = [{'cod_staz': r[0], 'data_i': r[1], 'flag': r[3]} for r in records]
-        conn.execute(table_obj.insert(), data)
-        logger.debug('filled temp folder')
-        update_sql = """
-            UPDATE %s.ds__preci t SET (
-                prec24.flag.wht,
-                prec01.flag.wht,
-                prec06.flag.wht,
-                prec12.flag.wht
-                ) = (u.flag, u.flag, u.flag, u.flag)
-            FROM %s u
-            WHERE t.cod_staz = u.cod_staz AND t.data_i = u.data_i 
-            AND ((t.prec24).flag).wht <> u.flag
-        """ % (schema, tmp_table_name)
-        result = conn.execute(update_sql)
-        num_of_updates = result.rowcount
-        logger.info('update completed: %s flags updated' % num_of_updates)
-    except:
-        logger.error('update not completed: something went wrong')
-    finally:
-        post_cmd = 'DROP TABLE %s' % tmp_table_name
-        conn.execute(post_cmd)
-        logger.debug('temp folder removed')
-    return num_of_updates
+    fields_records = [(['prec24', 'prec01', 'prec06', 'prec12'], records, 3)]
+    return write_flags(conn, 'ds__preci', fields_records, schema=schema, logger=logger)['prec24']
 
 
 def update_vntmd_flags(conn, records, schema='dailypdbanpacarica', flag_index=3, logger=None):
@@ -315,51 +354,8 @@ def update_vntmd_flags(conn, records, schema='dailypdbanpacarica', flag_index=3,
 
     :return number of updates
     """
-    if logger is None:
-        logger = logging.getLogger(LOG_NAME)
-    if not list(records):
-        return 0
-    logger.debug('start db update of PREC flags')
-    tmp_table_name = "updates_vnt%s" % round(time.time())
-    pre_sql_cmds = [
-        'DROP TABLE IF EXISTS %s' % tmp_table_name,
-        '''
-    CREATE TABLE IF NOT EXISTS %s (
-        cod_staz integer NOT NULL,
-        data_i timestamp without time zone NOT NULL,
-        flag integer,
-        PRIMARY KEY (cod_staz, data_i)
-        )''' % tmp_table_name,
-    ]
-    for cmd in pre_sql_cmds:
-        conn.execute(cmd)
-    logger.debug('created temp folder')
-    meta = MetaData()
-    table_obj = Table(tmp_table_name, meta, autoload=True, autoload_with=conn.engine)
-    num_of_updates = 0
-    try:
-        data = [{'cod_staz': r[0], 'data_i': r[1], 'flag': r[flag_index]} for r in records]
-        conn.execute(table_obj.insert(), data)
-        logger.debug('filled temp folder')
-        update_sql = """
-            UPDATE %s.ds__vnt10 t SET (
-                vntmxgg.flag.wht,
-                vnt.flag.wht
-                ) = (u.flag, u.flag)
-            FROM %s u
-            WHERE t.cod_staz = u.cod_staz AND t.data_i = u.data_i 
-            AND ((t.vntmxgg).flag).wht <> u.flag
-        """ % (schema, tmp_table_name)
-        result = conn.execute(update_sql)
-        num_of_updates = result.rowcount
-        logger.info('update completed: %s flags updated' % num_of_updates)
-    except:
-        logger.exception('update not completed: something went wrong')
-    finally:
-        post_cmd = 'DROP TABLE %s' % tmp_table_name
-        conn.execute(post_cmd)
-        logger.debug('temp folder removed')
-    return num_of_updates
+    fields_records = [(['vntmxgg', 'vnt'], records, flag_index)]
+    return write_flags(conn, 'ds__vnt10', fields_records, schema=schema, logger=logger)['vntmxgg']
 
 
 def update_flags(conn, records, table, schema='dailypdbanpacarica', db_field='tmxgg', flag_index=3,
@@ -378,48 +374,8 @@ def update_flags(conn, records, table, schema='dailypdbanpacarica', db_field='tm
     :param logger: logging object where to report actions
     :return number of updates
     """
-    if logger is None:
-        logger = logging.getLogger(LOG_NAME)
-    if not list(records):
-        return 0
-    logger.debug('start db update of flags (%s)' % db_field)
-    tmp_table_name = "updates_temp%s" % round(time.time())
-    pre_sql_cmds = [
-        'DROP TABLE IF EXISTS %s' % tmp_table_name,
-        '''
-    CREATE TABLE IF NOT EXISTS %s (
-        cod_staz integer NOT NULL,
-        data_i timestamp without time zone NOT NULL,
-        flag integer,
-        PRIMARY KEY (cod_staz, data_i)
-        )''' % tmp_table_name,
-    ]
-    for cmd in pre_sql_cmds:
-        conn.execute(cmd)
-    logger.debug('created temp folder')
-    meta = MetaData()
-    table_obj = Table(tmp_table_name, meta, autoload=True, autoload_with=conn.engine)
-    num_of_updates = 0
-    try:
-        data = [{'id_record': i, 'cod_staz': r[0], 'data_i': r[1], 'flag': r[flag_index]}
-                for i, r in enumerate(records, 1)]
-        conn.execute(table_obj.insert(), data)
-        logger.debug('filled temp folder')
-        update_sql = """
-            UPDATE %s.%s t SET %s.flag.wht = u.flag
-            FROM %s u
-            WHERE t.cod_staz = u.cod_staz AND t.data_i = u.data_i AND ((t.%s).flag).wht <> u.flag
-        """ % (schema, table, db_field, tmp_table_name, db_field)
-        result = conn.execute(update_sql)
-        num_of_updates = result.rowcount
-        logger.info('update completed: %s flags updated' % num_of_updates)
-    except:
-        logger.exception('update not completed: something went wrong')
-    finally:
-        post_cmd = 'DROP TABLE %s' % tmp_table_name
-        conn.execute(post_cmd)
-        logger.debug('temp folder removed')
-    return num_of_updates
+    fields_records = [([db_field], records, flag_index)]
+    return write_flags(conn, table, fields_records, schema=schema, logger=logger)[db_field]
 
 
 def expand_record(record):
@@ -487,33 +443,142 @@ def create_insert(table_name, schema, fields, data):
     return sql
 
 
+def field_expression(field, table_alias):
+    """
+    Return the SQL expression to select a field of a table with alias `table_alias`.
+    The field can be a subfield of a composite column.
+    For example: ('prec24.flag.wht', 't') -> '((t.prec24).flag).wht'
+
+    :param field: the complete name of the field
+    :param table_alias: the alias of the table
+    :return: the SQL expression
+    """
+    tokens = (table_alias, ) + tuple(field.split('.'))
+    tokens_num = len(tokens)
+    if tokens_num == 2:
+        return "%s.%s" % tokens
+    elif tokens_num == 3:
+        return "(%s.%s).%s" % tokens
+    return "((%s.%s).%s).%s" % tokens
+
+
+def create_conflict_clause(table_name, fields, policy):
+    """
+    Return the ON CONFLICT clause of an insert of `fields` into the table `table_name`,
+    according to the `policy` ('onlyinsert' or 'upsert'). The 'upsert' policy
+    updates all the `fields` of the existing records.
+
+    :param table_name: name of the table
+    :param fields: list of the fields inserted
+    :param policy: 'onlyinsert' or 'upsert'
+    :return: the SQL clause
+    """
+    conflict_sql = " ON CONFLICT ON CONSTRAINT %s_pkey DO " % table_name
+    if policy == 'onlyinsert':
+        return conflict_sql + 'NOTHING'
+    conflict_sql += 'UPDATE SET (%s) = ' % (','.join(fields))
+    fields2 = [field_expression(field, 'EXCLUDED') for field in fields]
+    conflict_sql += '(%s) ' % (','.join(fields2))
+    conflict_sql += "WHERE %s.cod_staz = EXCLUDED.cod_staz AND %s.data_i = EXCLUDED.data_i" \
+                    % (table_name, table_name)
+    return conflict_sql
+
+
 def create_upsert(table_name, schema, fields, data, policy):
     # NOTE: fields not included in data[i] keys will be set to null for upsert policy
     if not data or not fields:
         return
     insert_sql = create_insert(table_name, schema, fields, data)
-    insert_sql += " ON CONFLICT ON CONSTRAINT %s_pkey DO " % table_name
-    if policy == 'onlyinsert':
-        insert_sql += 'NOTHING'
-        return insert_sql
-    insert_sql += 'UPDATE SET (%s) = ' % (','.join(fields))
-
-    fields2 = []
-    for field in fields:
-        tokens = tuple(field.split('.'))
-        tokens_num = len(tokens)
-        if tokens_num == 1:
-            fields2.append("EXCLUDED.%s" % field)
-        elif tokens_num == 2:
-            fields2.append("(EXCLUDED.%s).%s" % tokens)
-        else:
-            fields2.append("((EXCLUDED.%s).%s).%s" % tokens)
-    insert_sql += '(%s) ' % (','.join(fields2))
-    insert_sql += "WHERE %s.cod_staz = EXCLUDED.cod_staz AND %s.data_i = EXCLUDED.data_i" \
-                  % (table_name, table_name)
+    insert_sql += create_conflict_clause(table_name, fields, policy)
     return insert_sql
 
 
+def create_copy_rows(fields, data):
+    """
+    Return the CSV text of the items `data` for the COPY of the `fields`.
+    Fields not included in the item keys (or None) are NULL.
+
+    :param fields: list of the fields
+    :param data: list of dictionaries
+    :return: the CSV text
+    """
+    lines = []
+    for item in data:
+        values = []
+        for field in fields:
+            value = item.get(field)
+            if value is None:
+                values.append('')
+            else:
+                values.append('"%s"' % str(value).replace('"', '""'))
+        lines.append(','.join(values))
+    return '\n'.join(lines) + '\n'
+
+
+def copy_upsert(conn, table_name, schema, fields, data, policy=None):
+    """
+    Insert the items `data` into the table `table_name` of the schema `schema`.
+    The rows are streamed with COPY into an unlogged staging table, and then inserted with
+    a single INSERT ... SELECT according to the `policy`:
+    'onlyinsert' (existing records are kept), 'upsert' (existing records are updated, see
+    `create_upsert`) or None (a plain insert, see `create_insert`).
+    The fields can be subfields of composite columns (for example 'prec24.flag.wht'):
+    the columns of the staging table have the types of the fields in the table.
+    Fields not included in the item keys (or None) are inserted as NULL.
+    With a `policy`, items with the same values of the RECORD_KEY_FIELDS inserted are
+    merged into the last one of them.
+    Return the number of records inserted or updated.
+
+    :param conn: db connection object
+    :param table_name: name of the table
+    :param schema: database schema to use
+    :param fields: list of the fields to insert
+    :param data: iterable of dictionaries
+    :param policy: 'onlyinsert', 'upsert' or None
+    :return: number of records inserted or updated
+    """
+    if not fields:
+        return 0
+    data_chunks = utils.chunked_iterable(data, COPY_CHUNK_SIZE)
+    first_chunk = next(data_chunks, None)
+    if not first_chunk:
+        return 0
+    staging_table = '%s.%s_stage%s' % (schema, table_name, uuid.uuid4().hex[:16])
+    columns_sql = ','.join('%s AS "%s"' % (field_expression(field, 't'), field)
+                           for field in fields)
+    conn.execute('CREATE UNLOGGED TABLE %s AS SELECT %s FROM %s.%s t WITH NO DATA'
+                 % (staging_table, columns_sql, schema, table_name))
+    drop_sql = 'DROP TABLE IF EXISTS %s' % staging_table
+    columns = ','.join('"%s"' % f for f in fields)
+    try:
+        # the order of the rows copied, to keep the last one of each key
+        conn.execute('ALTER TABLE %s ADD COLUMN stage_row bigserial' % staging_table)
+        cursor = conn.connection.cursor()
+        copy_sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (staging_table, columns)
+        for chunk in itertools.chain([first_chunk], data_chunks):
+            cursor.copy_expert(copy_sql, io.StringIO(create_copy_rows(fields, chunk)))
+        cursor.close()
+        select_sql = 'SELECT %s FROM %s' % (columns, staging_table)
+        key_columns = ','.join('"%s"' % f for f in RECORD_KEY_FIELDS if f in fields)
+        if policy is not None and key_columns:
+            # a record can be updated only once by the same INSERT ... ON CONFLICT
+            select_sql = 'SELECT DISTINCT ON (%s) %s FROM %s ORDER BY %s, stage_row DESC' % (
+                key_columns, columns, staging_table, key_columns)
+        insert_sql = 'INSERT INTO %s.%s (%s) %s' % (
+            schema, table_name, ','.join(fields), select_sql)
+        if policy is not None:
+            insert_sql += create_conflict_clause(table_name, fields, policy)
+        result = conn.execute(insert_sql)
+    except:
+        if not conn.in_transaction():
+            # otherwise the staging table is removed by the rollback of the transaction
+            conn.connection.rollback()
+            conn.execute(drop_sql)
+        raise
+    conn.execute(drop_sql)
+    return result.rowcount
+
+
 def upsert_items(conn, items, policy, schema, table_name, logger=None, find_cod_staz=False):
     """
     Insert (or update if not exists) items into the database.
@@ -539,9 +604,9 @@ def upsert_items(conn, items, policy, schema, table_name, logger=None, find_cod_
     if not items:
         logger.warning('no items to upsert')
         return 0
-    meta = MetaData()
-    anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
-                       schema='dailypdbadmclima')
+    station_index = None
+    if find_cod_staz:
+        station_index = querying.StationIndex(conn)
     items.sort(key=lambda x: (x['cod_staz'], x['data_i']))
     group_by_station = lambda x: x['cod_staz']
     group_by_date = lambda x: x['data_i']
@@ -550,33 +615,34 @@ def upsert_items(conn, items, policy, schema, table_name, logger=None, find_cod_
     cols = list(items[0].keys())
     fields = expand_fields(cols)
 
-    for station, station_records in itertools.groupby(items, group_by_station):
-        data = []
-        cod_staz = station
-        if find_cod_staz:
-            cod_utente, cod_rete = station.split('--', 2)
-            stat_obj = querying.get_db_station(
-                conn, anag_table, cod_rete=cod_rete, cod_utente=cod_utente)
-            if not stat_obj:
-                logger.error("station cod_rete=%s, cod_utente=%s not found. Records ignored."
-                             % (cod_rete, cod_utente))
-                continue
-            cod_staz = stat_obj.id_staz
-        for day, day_records in itertools.groupby(station_records, group_by_date):
-            # day_obj = datetime.strptime(day, '%Y-%m-%d')
-            record = functools.reduce(lambda a, b: a.update(b) or a, day_records, {})
-            record['cod_staz'] = cod_staz
-            record = expand_record(record)
-            # this one so that empty values are empty strings in the sql
-            record = {
-                k: v for k, v in record.items()
-                if v not in (None, 'NULL') and list(filter(lambda r: utils.is_float(r), str(v)))
-            }
-            data.append(record)
-            upserted += 1
-        sql = create_upsert(table_name, schema, fields, data, policy)
-        if sql:
-            conn.execute(sql)
+    def iter_records():
+        # the records are built while they are copied, station by station
+        nonlocal upserted
+        for station, station_records in itertools.groupby(items, group_by_station):
+            cod_staz = station
+            if find_cod_staz:
+                cod_utente, cod_rete = station.split('--', 2)
+                stat_obj = station_index.get(cod_rete=cod_rete, cod_utente=cod_utente)
+                if not stat_obj:
+                    logger.error("station cod_rete=%s, cod_utente=%s not found. Records ignored."
+                                 % (cod_rete, cod_utente))
+                    continue
+                cod_staz = stat_obj.id_staz
+            for day, day_records in itertools.groupby(station_records, group_by_date):
+                # day_obj = datetime.strptime(day, '%Y-%m-%d')
+                record = functools.reduce(lambda a, b: a.update(b) or a, day_records, {})
+                record['cod_staz'] = cod_staz
+                record = expand_record(record)
+                # this one so that empty values are empty strings in the sql
+                record = {
+                    k: v for k, v in record.items()
+                    if v not in (None, 'NULL')
+                    and list(filter(lambda r: utils.is_float(r), str(v)))
+                }
+                upserted += 1
+                yield record
+
+    copy_upsert(conn, table_name, schema, fields, iter_records(), policy)
     return upserted
 
 
@@ -612,7 +678,6 @@ def load_unique_data_table(dburi, table_name, master_field, startschema, targets
 
     # engine_multiprocessing = create_engine(db_utils.DEFAULT_DB_URI, pool=db_utils.mypool)
     conn = db_utils.ensure_connection(dburi)
-    conn_r = db_utils.get_safe_memory_read_connection(conn)
     logger = logging.getLogger(logger_name)
     group_funct = lambda r: (r[0], r[1])  # idgruppo, data_i
 
@@ -622,30 +687,24 @@ def load_unique_data_table(dburi, table_name, master_field, startschema, targets
              FROM %s.%s JOIN %s.%s ON (id_staz=cod_staz)
              ORDER BY (idgruppo, data_i, progstazione)""" \
           % (startschema, table_name, gruppi_tschema, gruppi_tname, startschema, table_name)
-    results = conn_r.execute(sql)
-    inserted = 0
+    results = db_utils.read_results(conn, sql)
     logger.info(' start merge&insert on table %s' % table_name)
     cols = db_utils.get_table_columns(table_name, targetschema)
     fields = expand_fields(cols)
-    data = []
-    for group_attrs, group_records in itertools.groupby(results, group_funct):
-        groupid, data_i = group_attrs
-        main_station = group2mainstation[groupid]
-        expanded_group_records = [expand_record(dict(r)) for r in group_records]
-        main_record = choose_main_record(expanded_group_records, master_field)
-        if main_record:
-            del main_record['idgruppo']
-            main_record['cod_staz'] = main_station
-            main_record = {k: v for k, v in main_record.items() if v not in (None, 'NULL')}
-            data.append(main_record)
-            inserted += 1
-            if divmod(inserted, 10000)[1] == 0:  # flush in blocks of 100000
-                sql = create_insert(table_name, targetschema, fields, data)
-                conn.execute(sql)
-                data = []
-    if data:
-        sql = create_insert(table_name, targetschema, fields, data)
-        conn.execute(sql)
+
+    def iter_main_records():
+        for group_attrs, group_records in itertools.groupby(results, group_funct):
+            groupid, data_i = group_attrs
+            main_station = group2mainstation[groupid]
+            expanded_group_records = [expand_record(dict(r)) for r in group_records]
+            main_record = choose_main_record(expanded_group_records, master_field)
+            if main_record:
+                del main_record['idgruppo']
+                main_record['cod_staz'] = main_station
+                yield {k: v for k, v in main_record.items() if v not in (None, 'NULL')}
+
+    # the records are streamed to the database in blocks (see `copy_upsert`)
+    inserted = copy_upsert(conn, table_name, targetschema, fields, iter_main_records())
     logger.info('inserted %s records on table %s' % (inserted, table_name))
     conn.close()
 
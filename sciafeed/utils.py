@@ -1,8 +1,10 @@
 """
 This modules provides generic utility functions of the SCIA FEED package
 """
+import ast
+from collections import OrderedDict
 import csv
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import gzip
 import itertools
 import logging
@@ -10,11 +12,25 @@ import os
 import os.path
 import random
 import shutil
+import types
 
+import numpy as np
 import xlrd
 
 from sciafeed import LOG_NAME
 
+DATE_FIELDS_WIDTHS = {'Y': 4, 'y': 2, 'm': 2, 'd': 2, 'H': 2, 'M': 2, 'S': 2}
+DATES_MEMO_SIZE = 100000
+DATE_PARSERS = dict()
+# rows of the last Excel files loaded (see `load_excel`)
+EXCEL_CACHE = OrderedDict()
+EXCEL_CACHE_SIZE = 4
+# information read from the heads of the text files (see `sniff_file`)
+HEADERS_CACHE = dict()
+HEADERS_CACHE_SIZE = 1000
+# parameters maps and thresholds already loaded (see `load_parameters`)
+PARAMETERS_CACHE = dict()
+
 
 def is_float(value):
     try:
@@ -52,32 +68,147 @@ def cell_str(cell, datemode, datepattern='%d.%m.%Y'):
     return cell.value
 
 
-def load_excel(filepath, sheet_index=0, sheet_name=None):
+def decode_sheet(sheet, datemode, datepattern='%d.%m.%Y'):
+    """
+    Return the list of rows of an Excel sheet, each row a list of the values of the cells
+    as returned by `cell_str`. The cells are read by rows and the numbers, booleans and dates
+    are decoded in bulk: each distinct value is converted to string only once.
+
+    :param sheet: the xlrd Sheet object
+    :param datemode: attribute of the worksheet to help parsing date cells
+    :param datepattern: pattern used by cells containing dates (as used by datetime.strftime)
+    :return: the list of rows, each one a list of strings
+    """
+    if not sheet.nrows or not sheet.ncols:
+        return [[] for _ in range(sheet.nrows)]
+    values = [sheet.row_values(row_index) for row_index in range(sheet.nrows)]
+    types = np.array([sheet.row_types(row_index) for row_index in range(sheet.nrows)],
+                     dtype=np.uint8)
+    cells = np.empty(types.shape, dtype=object)
+    cells[:] = values
+    for cell_type in (xlrd.XL_CELL_NUMBER, xlrd.XL_CELL_BOOLEAN, xlrd.XL_CELL_DATE):
+        mask = types == cell_type
+        if not mask.any():
+            continue
+        numbers = cells[mask].astype(np.float64)
+        uniques, inverse = np.unique(numbers, return_inverse=True)
+        if cell_type == xlrd.XL_CELL_DATE:
+            decoded = [xlrd.xldate.xldate_as_datetime(value, datemode).strftime(datepattern)
+                       for value in uniques.tolist()]
+        elif cell_type == xlrd.XL_CELL_BOOLEAN:
+            decoded = [str(int(value)) for value in uniques.tolist()]
+        else:
+            decoded = [str(int(value)) if value == int(value) else str(value)
+                       for value in uniques.tolist()]
+        cells[mask] = np.array(decoded, dtype=object)[inverse.ravel()]
+    return cells.tolist()
+
+
+def load_excel(filepath, sheet_index=0, sheet_name=None, use_cache=False):
     """
     Try to parse the EXCEL file content, returning a list of rows, each row a list of cells.
+    If `use_cache` is True, the rows are cached (for the last EXCEL_CACHE_SIZE files loaded)
+    by path, modification time and size of the file: the rows returned are shared and they
+    must not be modified.
 
     :param filepath: path to the Excel file
     :param sheet_index: the sheet index to read (starts from 0). Ignored if `sheet_name` != None
     :param sheet_name: the name of the sheet to read.
+    :param use_cache: if True, use the cache of the files loaded
     :return: (header, rows, errors)
     """
+    if use_cache:
+        stat = os.stat(filepath)
+        cache_key = (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size, sheet_index,
+                     sheet_name)
+        if cache_key in EXCEL_CACHE:
+            EXCEL_CACHE.move_to_end(cache_key)
+            return EXCEL_CACHE[cache_key]
     workbook = xlrd.open_workbook(filepath)
     if sheet_name:
         sheet = workbook.sheet_by_name(sheet_name)
     else:
         sheet = workbook.sheet_by_index(sheet_index)
-    rows = []
-    for row_index in range(sheet.nrows):
-        row = [cell_str(sheet.cell(row_index, i), workbook.datemode) for i in range(sheet.ncols)]
-        rows.append(row)
+    rows = decode_sheet(sheet, workbook.datemode)
+    if use_cache:
+        EXCEL_CACHE[cache_key] = rows
+        while len(EXCEL_CACHE) > EXCEL_CACHE_SIZE:
+            EXCEL_CACHE.popitem(last=False)
     return rows
 
 
+class Conversion:
+    """
+    A conversion expression of a variable, for example 'X/10' or '(X-32)/1.8', compiled once.
+    The expression can contain only numbers, the variable, the operators + - * / ** and
+    parentheses. An instance is callable on a number, as the lambda function
+    `lambda X: round(<expression>, round_precision)`, or on a NumPy array of floats, returning
+    the array of the values converted and rounded in the same way.
+    """
+    ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+                     ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.UAdd, ast.USub)
+
+    def __init__(self, expression, variable_label='X', round_precision=4):
+        tree = ast.parse(expression.strip(), mode='eval')
+        for node in ast.walk(tree):
+            if not isinstance(node, self.ALLOWED_NODES):
+                raise ValueError('not allowed %r in expression %r'
+                                 % (type(node).__name__, expression))
+            if isinstance(node, ast.Name) and node.id != variable_label:
+                raise ValueError('unknown variable %r in expression %r' % (node.id, expression))
+            if isinstance(node, ast.Constant) and type(node.value) not in (int, float):
+                raise ValueError('not allowed %r in expression %r' % (node.value, expression))
+        self.expression = expression
+        self.variable_label = variable_label
+        self.round_precision = round_precision
+        function_tree = ast.fix_missing_locations(ast.Expression(ast.Lambda(
+            args=ast.arguments(posonlyargs=[], args=[ast.arg(arg=variable_label)],
+                               kwonlyargs=[], kw_defaults=[], defaults=[]),
+            body=tree.body)))
+        self.function = eval(compile(function_tree, '<conversion>', 'eval'),
+                             {'__builtins__': {}})
+
+    def __call__(self, value):
+        if isinstance(value, np.ndarray):
+            return self.convert_array(value)
+        return round(self.function(value), self.round_precision)
+
+    def __reduce__(self):
+        return Conversion, (self.expression, self.variable_label, self.round_precision)
+
+    def __repr__(self):
+        return 'Conversion(%r)' % self.expression
+
+    def convert_array(self, values):
+        """
+        Convert and round an array of values. The result is the same of calling the instance
+        on each value: the values whose rounding by np.round could differ from the builtin
+        round (i.e. the ones near a tie) are rounded one by one by the builtin round.
+
+        :param values: NumPy array of floats
+        :return: NumPy array of the converted values
+        """
+        converted = np.asarray(self.function(values.astype(np.float64)), dtype=np.float64)
+        if converted.shape != values.shape:  # constant expression
+            converted = np.broadcast_to(converted, values.shape)
+        with np.errstate(invalid='ignore', over='ignore'):
+            ret_value = np.round(converted, self.round_precision)
+            scaled = converted * 10. ** self.round_precision
+            near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) <= \
+                1e-6 * np.maximum(1, np.abs(scaled))
+        to_check = np.flatnonzero(near_tie | (np.isfinite(converted) & ~np.isfinite(scaled)))
+        for position in to_check.tolist():
+            ret_value.flat[position] = round(float(converted.flat[position]),
+                                             self.round_precision)
+        return ret_value
+
+
 def string2lambda(thestring, variable_label='X', round_precision=4):
     """
-    Convert a string to a lambda function.
-    For example, 'X+1' -> lambda X: X+1.
+    Convert a string to a function (an instance of `Conversion`).
+    For example, 'X+1' -> lambda X: round(X+1, round_precision).
     The string is checked: no chars [A-Z,a-z] allowed.
+    The function returned works also on NumPy arrays (see `Conversion`).
 
     :param thestring: the string defining the lambda function
     :param variable_label: the string used for the function variable
@@ -89,10 +220,43 @@ def string2lambda(thestring, variable_label='X', round_precision=4):
     value = thestring.lower().replace('x', '')
     for c_ord in range(ord('a'), ord('z')+1):
         assert chr(c_ord) not in value
+    return Conversion(thestring, variable_label, round_precision)
+
+
+def freeze(obj):
+    """
+    Return a read-only version of `obj`: dictionaries are converted to
+    types.MappingProxyType and lists to tuples, recursively.
 
-    function_txt = 'lambda %s: round(%s, %s)' % (variable_label, thestring, round_precision)
-    retvalue = eval(function_txt)
-    return retvalue
+    :param obj: the object to freeze
+    :return: the read-only object
+    """
+    if isinstance(obj, dict):
+        return types.MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(elem) for elem in obj)
+    return obj
+
+
+def load_parameters(load_function, parameters_filepath, delimiter=';'):
+    """
+    Return the read-only version (see `freeze`) of `load_function(parameters_filepath,
+    delimiter)`, i.e. of the parameters map or of the thresholds returned by the functions
+    `load_parameter_file` and `load_parameter_thresholds` of a format module.
+    The file is loaded once for each version of it: the result is cached by path,
+    modification time and size of the file, and it is shared by all the callers.
+
+    :param load_function: the function loading the file
+    :param parameters_filepath: path to the CSV file containing info about stored parameters
+    :param delimiter: CSV delimiter
+    :return: the read-only result of `load_function`
+    """
+    stat = os.stat(parameters_filepath)
+    cache_key = (load_function, os.path.abspath(parameters_filepath), stat.st_mtime_ns,
+                 stat.st_size, delimiter)
+    if cache_key not in PARAMETERS_CACHE:
+        PARAMETERS_CACHE[cache_key] = freeze(load_function(parameters_filepath, delimiter))
+    return PARAMETERS_CACHE[cache_key]
 
 
 def is_same_list(list1, list2, any_marker):
@@ -131,9 +295,205 @@ def folder2props(folder_name):
     return ret_value
 
 
+def compile_date_pattern(pattern):
+    """
+    Compile a date pattern (as used by `datetime.strptime`) into the fixed layout of the
+    strings it matches when all the numeric fields are zero padded.
+    Return the tuple (width, fields, literals), where `fields` is a dictionary
+    {directive: (start, end)} and `literals` is a list of tuples (position, char).
+    Return None if the pattern has directives not managed (only %Y, %y, %m, %d, %H, %M, %S are)
+    or if it doesn't contain year, month and day.
+
+    :param pattern: the date pattern
+    :return: (width, fields, literals) or None
+    """
+    fields = dict()
+    literals = []
+    position = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '%':
+            directive = pattern[i + 1:i + 2]
+            if directive not in DATE_FIELDS_WIDTHS or directive in fields:
+                return None
+            width = DATE_FIELDS_WIDTHS[directive]
+            fields[directive] = (position, position + width)
+            position += width
+            i += 2
+        else:
+            literals.append((position, char))
+            position += 1
+            i += 1
+    if ('Y' in fields) == ('y' in fields) or 'm' not in fields or 'd' not in fields:
+        return None
+    return position, fields, literals
+
+
+def date_parser(pattern, memo_size=DATES_MEMO_SIZE):
+    """
+    Return a function that converts a string into a datetime object according to `pattern`,
+    with the same results (and the same ValueError exceptions) of `datetime.strptime`.
+    If the string has the fixed layout of the pattern (see function `compile_date_pattern`)
+    the fields are decoded directly, and the days already decoded are remembered (up to
+    `memo_size` different days): the rows of the same day share the decoding of the date part.
+    Otherwise, it falls back to `datetime.strptime`.
+    Create a parser for each file to have a memo for each file.
+
+    :param pattern: the date pattern
+    :param memo_size: max number of days to remember
+    :return: the function that parses a date string
+    """
+    layout = compile_date_pattern(pattern)
+    if layout is None:
+        return lambda date_str: datetime.strptime(date_str, pattern)
+    width, fields, literals = layout
+    two_digits_year = 'y' in fields
+    year_start, year_end = fields.get('Y') or fields['y']
+    month_start, month_end = fields['m']
+    day_start, day_end = fields['d']
+    time_fields = [fields.get(directive) for directive in 'HMS']
+    days_memo = dict()
+
+    def parse(date_str):
+        if len(date_str) != width or not date_str.isascii():
+            return datetime.strptime(date_str, pattern)
+        for position, char in literals:
+            if date_str[position] != char:
+                return datetime.strptime(date_str, pattern)
+        day_key = date_str[year_start:year_end] + date_str[month_start:month_end] \
+            + date_str[day_start:day_end]
+        ymd = days_memo.get(day_key)
+        if ymd is None:
+            if not day_key.isdigit():
+                return datetime.strptime(date_str, pattern)
+            year = int(date_str[year_start:year_end])
+            if two_digits_year:
+                year += year <= 68 and 2000 or 1900
+            ymd = (year, int(date_str[month_start:month_end]), int(date_str[day_start:day_end]))
+            try:
+                date(*ymd)
+            except ValueError:
+                return datetime.strptime(date_str, pattern)
+            if len(days_memo) >= memo_size:
+                days_memo.clear()
+            days_memo[day_key] = ymd
+        hms = []
+        for time_field in time_fields:
+            if time_field is None:
+                hms.append(0)
+                continue
+            value_str = date_str[time_field[0]:time_field[1]]
+            if not value_str.isdigit():
+                return datetime.strptime(date_str, pattern)
+            hms.append(int(value_str))
+        hour, minute, second = hms
+        if hour > 23 or minute > 59 or second > 59:
+            return datetime.strptime(date_str, pattern)
+        return datetime(ymd[0], ymd[1], ymd[2], hour, minute, second)
+
+    return parse
+
+
+def strptime(date_str, pattern):
+    """
+    Same as `datetime.strptime`, but using the fast paths of the function `date_parser`.
+    The parsers (and their memo of days) are shared for each pattern.
+
+    :param date_str: the date string
+    :param pattern: the date pattern
+    :return: the datetime object
+    """
+    try:
+        parser = DATE_PARSERS[pattern]
+    except KeyError:
+        parser = DATE_PARSERS[pattern] = date_parser(pattern)
+    return parser(date_str)
+
+
+def decode_dates(chars, pattern):
+    """
+    Decode with NumPy a column of date strings with the fixed layout of `pattern` (see function
+    `compile_date_pattern`). `chars` is a uint8 array of shape (number of dates, width of the
+    layout) of the characters of the strings.
+    Return the tuple (times, ok), where `times` is the datetime64[s] array of the dates and
+    `ok` is a bool array, False where the string is not compliant with the fixed layout
+    (for these ones `datetime.strptime` should be used).
+
+    :param chars: uint8 array of the characters of the strings
+    :param pattern: the date pattern
+    :return: (times, ok)
+    """
+    width, fields, literals = compile_date_pattern(pattern)
+    num_dates = chars.shape[0]
+    ok = np.full(num_dates, chars.shape[1] == width, dtype=bool)
+    times = np.zeros(num_dates, dtype='datetime64[s]')
+    if not ok.any():
+        return times, ok
+    for position, char in literals:
+        ok &= chars[:, position] == ord(char)
+    values = dict()
+    for directive, (start, end) in fields.items():
+        field_chars = chars[:, start:end]
+        ok &= ((field_chars >= ord('0')) & (field_chars <= ord('9'))).all(axis=1)
+        digits = field_chars.astype(np.int64) - ord('0')
+        values[directive] = (digits * 10 ** np.arange(end - start - 1, -1, -1)).sum(axis=1)
+    if 'y' in values:
+        year = values['y'] + np.where(values['y'] <= 68, 2000, 1900)
+    else:
+        year = values['Y']
+    month, day = values['m'], values['d']
+    hour, minute, second = [values.get(directive, np.zeros(num_dates, dtype=np.int64))
+                            for directive in 'HMS']
+    ok &= (year >= 1) & (month >= 1) & (month <= 12)
+    ok &= (hour <= 23) & (minute <= 59) & (second <= 59)
+    month_start = np.zeros(num_dates, dtype='datetime64[M]')
+    month_start[ok] = (year[ok] - 1970) * 12 + (month[ok] - 1)
+    month_days = ((month_start + 1).astype('datetime64[D]')
+                  - month_start.astype('datetime64[D]')).astype(np.int64)
+    ok &= (day >= 1) & (day <= month_days)
+    times[ok] = month_start[ok].astype('datetime64[s]') + (day[ok] - 1) * 86400 \
+        + hour[ok] * 3600 + minute[ok] * 60 + second[ok]
+    return times, ok
+
+
+def parse_dates(date_strs, pattern):
+    """
+    Convert a list of strings into datetime objects according to `pattern`, decoding with NumPy
+    (see function `decode_dates`) the strings with the fixed layout of the pattern.
+    Return the list of datetime objects, with None where `datetime.strptime` would fail.
+
+    :param date_strs: list of date strings
+    :param pattern: the date pattern
+    :return: list of datetime objects (or None)
+    """
+    ret_value = [None] * len(date_strs)
+    layout = compile_date_pattern(pattern)
+    positions = []
+    if layout is not None:
+        width = layout[0]
+        positions = [i for i, date_str in enumerate(date_strs)
+                     if len(date_str) == width and date_str.isascii()]
+    if positions:
+        chars = np.frombuffer(''.join(date_strs[i] for i in positions).encode('ascii'),
+                              dtype=np.uint8).reshape(len(positions), width)
+        times, ok = decode_dates(chars, pattern)
+        for i, time_obj, is_ok in zip(positions, times.tolist(), ok.tolist()):
+            if is_ok:
+                ret_value[i] = time_obj
+    for i, date_str in enumerate(date_strs):
+        if ret_value[i] is None:
+            try:
+                ret_value[i] = strptime(date_str, pattern)
+            except ValueError:
+                continue
+    return ret_value
+
+
 def parse_date(thedate, patterns):
     """
     Try to extract the date object using the input patterns.
+    The first pattern matching is used.
 
     :param thedate: the date string
     :param patterns: list of date patterns
@@ -142,7 +502,8 @@ def parse_date(thedate, patterns):
     ret_value = None
     for pattern in patterns:
         try:
-            ret_value = datetime.strptime(thedate, pattern)
+            ret_value = strptime(thedate, pattern)
+            break
         except ValueError:
             continue
     return ret_value
@@ -204,6 +565,76 @@ def extract_gz(input_path, output_path, rm_source=False):
         os.remove(input_path)
 
 
+def open_text(filepath, encoding=None):
+    """
+    Open the text file located at `filepath` for reading. If the name of the file ends
+    with '.gz', the file is decompressed on the fly, without extracting it on disk.
+
+    :param filepath: path of the file (or of the gzip archive of the file)
+    :param encoding: the encoding of the text (None for the platform default)
+    :return: the file object
+    """
+    if filepath.lower().endswith('.gz'):
+        return gzip.open(filepath, 'rt', encoding=encoding)
+    return open(filepath, encoding=encoding)
+
+
+def sniff_file(filepath, sniff_function):
+    """
+    Return the dictionary `sniff_function(filepath)` of information read from the head of
+    the file located at `filepath`. The result is computed once for each version of the file:
+    it is cached by path, modification time and size of the file. The dictionary returned is
+    shared by all the callers, that can store on it further information about the file
+    (see `iter_data_rows`).
+
+    :param filepath: path of the file
+    :param sniff_function: function returning a dictionary of information about a file
+    :return: the dictionary of information about the file
+    """
+    stat = os.stat(filepath)
+    cache_key = (sniff_function, os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+    if cache_key not in HEADERS_CACHE:
+        if len(HEADERS_CACHE) >= HEADERS_CACHE_SIZE:
+            HEADERS_CACHE.clear()
+        HEADERS_CACHE[cache_key] = sniff_function(filepath)
+    return HEADERS_CACHE[cache_key]
+
+
+def iter_data_rows(filepath, header, fieldnames, is_header_row, delimiter=',',
+                   encoding=None):
+    """
+    A generator of the data rows of a CSV file, i.e. the rows following the first row for
+    which `is_header_row(row)` is True. Each value returned is a tuple (index of the row, row),
+    where row is a dictionary as returned by csv.DictReader with fieldnames `fieldnames`.
+    The position of the first data row is searched once for each fieldnames and stored
+    in the dictionary `header` (see `sniff_file`): the next readings of the file skip
+    the head directly. If the header row is not found, nothing is returned.
+
+    :param filepath: path of the CSV file
+    :param header: dictionary of information about the file
+    :param fieldnames: list of fieldnames of the CSV file
+    :param is_header_row: function returning True for the last row before the data
+    :param delimiter: CSV delimiter
+    :param encoding: the encoding of the text (None for the platform default)
+    :return: iterable of (index of the row, row)
+    """
+    data_starts = header.setdefault('data_starts', dict())
+    with open(filepath, 'r', encoding=encoding) as csv_file:
+        if tuple(fieldnames) not in data_starts:
+            # readline instead of iteration, to be able to call tell()
+            csv_reader = csv.DictReader(
+                iter(csv_file.readline, ''), delimiter=delimiter, fieldnames=fieldnames)
+            j = 0
+            for j, row in enumerate(csv_reader, 1):
+                if is_header_row(row):
+                    break
+            data_starts[tuple(fieldnames)] = (csv_file.tell(), j)
+        offset, j = data_starts[tuple(fieldnames)]
+        csv_file.seek(offset)
+        csv_reader = csv.DictReader(csv_file, delimiter=delimiter, fieldnames=fieldnames)
+        yield from enumerate(csv_reader, j + 1)
+
+
 def gettime(thefunction):
     """decorator to print start and ending time"""
     name = thefunction.__name__
@@ -273,3 +704,100 @@ def chunked_iterable(iterable, size):
         if not chunk:
             break
         yield chunk
+
+
+def numeric_fields_mask(chars, leading_space=True):
+    """
+    Check with NumPy a set of fixed width fields, each one expected to be a decimal number
+    right-aligned (i.e. only spaces before it), as '   -2.5'.
+    `chars` is a uint8 array of shape (number of rows, number of fields, width of the field).
+    Return a bool array of shape (number of rows, number of fields), True where the field
+    is a decimal number that the built-in `float` would parse.
+
+    :param chars: uint8 array of the characters of the fields
+    :param leading_space: if True, the first character of each field must be a space
+    :return: bool array of shape (number of rows, number of fields)
+    """
+    is_space = chars == ord(' ')
+    is_digit = (chars >= ord('0')) & (chars <= ord('9'))
+    is_minus = chars == ord('-')
+    is_dot = chars == ord('.')
+    started = np.maximum.accumulate(~is_space, axis=-1)
+    first_char = np.zeros(chars.shape, dtype=bool)
+    first_char[..., 1:] = started[..., 1:] & ~started[..., :-1]
+    first_char[..., 0] = started[..., 0]
+    ret_value = (is_space | is_digit | is_minus | is_dot).all(axis=-1)
+    ret_value &= ~(started & is_space).any(axis=-1)
+    ret_value &= ~(is_minus & ~first_char).any(axis=-1)
+    ret_value &= is_dot.sum(axis=-1) <= 1
+    ret_value &= is_digit.any(axis=-1)
+    if leading_space:
+        ret_value &= is_space[..., 0]
+    return ret_value
+
+
+def decode_fixed_width_rows(rows, num_columns, missing_value_marker, date_width=12,
+                            lat_width=9, column_width=7):
+    """
+    Decode with NumPy a list of rows of a fixed width file (formats arpa19 and arpa21) of kind:
+    ::
+
+        YYYYmmddHHMM LATITUDE COLUMN1 COLUMN2 ...
+
+    Return the tuple (regular, dates, lats, values, missing), where:
+
+    - regular: bool array, True for the rows strictly compliant with the fixed width layout
+      (only for these rows the other values are meaningful)
+    - dates: list of the datetime objects of the rows (None for not regular rows)
+    - lats: float array of the latitudes
+    - values: float array of shape (number of rows, `num_columns`) of the values of the columns
+    - missing: bool array of shape (number of rows, `num_columns`), True where the value is
+      `missing_value_marker`
+
+    :param rows: list of rows of the file (with or without the newline char)
+    :param num_columns: number of the columns after the latitude
+    :param missing_value_marker: the string used as a marker for missing value
+    :param date_width: width of the date field
+    :param lat_width: width of the latitude field
+    :param column_width: width of each column
+    :return: (regular, dates, lats, values, missing)
+    """
+    lat_start = date_width + 1
+    columns_start = lat_start + lat_width
+    row_width = columns_start + num_columns * column_width
+    rows = [row.rstrip('\n') for row in rows]
+    regular = np.array([len(row) == row_width for row in rows], dtype=bool)
+    regular &= np.array([row.isascii() for row in rows], dtype=bool)
+    num_rows = len(rows)
+    dates = [None] * num_rows
+    lats = np.zeros(num_rows)
+    values = np.zeros((num_rows, num_columns))
+    missing = np.zeros((num_rows, num_columns), dtype=bool)
+    if not regular.any():
+        return regular, dates, lats, values, missing
+    positions = np.flatnonzero(regular)
+    chars = np.frombuffer(''.join(rows[p] for p in positions).encode('ascii'), dtype=np.uint8)
+    chars = chars.reshape(len(positions), row_width)
+    # date
+    times, ok = decode_dates(chars[:, :date_width], '%Y%m%d%H%M')
+    ok &= chars[:, date_width] == ord(' ')
+    # latitude and columns
+    lat_chars = chars[:, lat_start:columns_start].reshape(len(positions), 1, lat_width)
+    ok &= numeric_fields_mask(lat_chars, leading_space=False)[:, 0]
+    # the latitude fills its field, as `validate_row_format` of the formats requires
+    ok &= lat_chars[:, 0, 0] != ord(' ')
+    columns_chars = chars[:, columns_start:].reshape(len(positions), num_columns, column_width)
+    ok &= numeric_fields_mask(columns_chars).all(axis=1)
+    regular[positions[~ok]] = False
+    chars = chars[ok]
+    positions = positions[ok]
+    if not len(positions):
+        return regular, dates, lats, values, missing
+    for position, row_date in zip(positions.tolist(), times[ok].tolist()):
+        dates[position] = row_date
+    lats[positions] = np.ascontiguousarray(chars[:, lat_start:columns_start]).view(
+        'S%s' % lat_width).ravel().astype(np.float64)
+    columns = np.ascontiguousarray(chars[:, columns_start:]).view('S%s' % column_width)
+    values[positions] = columns.astype(np.float64)
+    missing[positions] = columns == missing_value_marker.rjust(column_width).encode('ascii')
+    return regular, dates, lats, values, missing
@@ -1,4 +1,8 @@
 
+import http.server
+import threading
+import urllib.parse
+
 import pytest
 
 from sciafeed import db_utils
@@ -29,3 +33,69 @@ def conn():
     connection.execute("drop schema test cascade")
     connection.execute("drop schema test2 cascade")
     connection.close()
+
+
+@pytest.fixture
+def http_server():
+    """
+    A local HTTP server standing in for a file download service. The files served are in
+    the dictionary `server.files` {id: bytes}, requested as /?id=<id>, with support of
+    range requests. `server.failures` {id: [behaviour, ...]} lists the behaviours of the next
+    requests of a file: an HTTP status code to return, 'truncate' to close the
+    connection after half of the data, or 'misaligned' to answer a range request with
+    the whole file. `server.requests` logs the tuples (id, range header).
+    """
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            file_id = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)['id'][0]
+            range_header = self.headers.get('Range')
+            server.requests.append((file_id, range_header))
+            if file_id not in server.files:
+                self.send_error(404)
+                return
+            failures = server.failures.get(file_id, [])
+            behaviour = failures.pop(0) if failures else None
+            if isinstance(behaviour, int):
+                self.send_error(behaviour)
+                return
+            content = server.files[file_id]
+            start = 0
+            if range_header and behaviour == 'misaligned':
+                self.send_response(206)
+                self.send_header(
+                    'Content-Range', 'bytes 0-%s/%s' % (len(content) - 1, len(content)))
+            elif range_header:
+                start = int(range_header.split('=')[1].split('-')[0])
+                if start >= len(content):
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */%s' % len(content))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header(
+                    'Content-Range', 'bytes %s-%s/%s' % (start, len(content) - 1, len(content)))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(content) - start))
+            self.end_headers()
+            if behaviour == 'truncate':
+                self.wfile.write(content[start:start + (len(content) - start) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(content[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.files = dict()
+    server.failures = dict()
+    server.requests = []
+    server.url = 'http://127.0.0.1:%s/' % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
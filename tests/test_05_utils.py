@@ -1,9 +1,14 @@
 
 import csv
+from datetime import datetime
+import gzip
 from io import TextIOWrapper
 from os import mkdir
 from os.path import exists, join
+import pickle
 
+import numpy as np
+import pytest
 import xlrd
 
 from sciafeed import utils
@@ -86,6 +91,60 @@ def test_load_excel():
     rows = utils.load_excel(filepath, sheet_index=0)
     assert rows == expected_rows
 
+    # with cache
+    utils.EXCEL_CACHE.clear()
+    rows = utils.load_excel(filepath, sheet_index=0, use_cache=True)
+    assert rows == expected_rows
+    assert len(utils.EXCEL_CACHE) == 1
+    assert utils.load_excel(filepath, sheet_index=0, use_cache=True) is rows
+    assert utils.load_excel(filepath, sheet_index=0) is not rows
+    # only the last files loaded are kept
+    utils.EXCEL_CACHE.clear()
+    for i in range(utils.EXCEL_CACHE_SIZE):
+        utils.EXCEL_CACHE[('other file', i)] = []
+    utils.load_excel(filepath, sheet_index=0, use_cache=True)
+    assert len(utils.EXCEL_CACHE) == utils.EXCEL_CACHE_SIZE
+    assert ('other file', 0) not in utils.EXCEL_CACHE
+    utils.EXCEL_CACHE.clear()
+
+
+def test_decode_sheet():
+    class StubSheet:
+        def __init__(self, rows):
+            self.rows = rows
+            self.nrows = len(rows)
+            self.ncols = len(rows[0]) if rows else 0
+
+        def row_values(self, row_index):
+            return [value for cell_type, value in self.rows[row_index]]
+
+        def row_types(self, row_index):
+            return [cell_type for cell_type, value in self.rows[row_index]]
+
+        def cell(self, row_index, col_index):
+            return xlrd.sheet.Cell(*self.rows[row_index][col_index])
+
+    cells = [
+        [(xlrd.XL_CELL_TEXT, 'ciao'), (xlrd.XL_CELL_NUMBER, 8.0), (xlrd.XL_CELL_NUMBER, 8.5),
+         (xlrd.XL_CELL_DATE, 43892.0)],
+        [(xlrd.XL_CELL_BLANK, ''), (xlrd.XL_CELL_NUMBER, -3.0), (xlrd.XL_CELL_BOOLEAN, 1),
+         (xlrd.XL_CELL_DATE, 43893.5)],
+        [(xlrd.XL_CELL_EMPTY, ''), (xlrd.XL_CELL_NUMBER, 8.0), (xlrd.XL_CELL_BOOLEAN, 0),
+         (xlrd.XL_CELL_ERROR, 7)],
+    ]
+    sheet = StubSheet(cells)
+    expected = [[utils.cell_str(sheet.cell(i, j), 0) for j in range(sheet.ncols)]
+                for i in range(sheet.nrows)]
+    assert expected == [
+        ['ciao', '8', '8.5', '02.03.2020'],
+        ['', '-3', '1', '03.03.2020'],
+        ['', '8', '0', 7]]
+    assert utils.decode_sheet(sheet, 0) == expected
+    assert utils.decode_sheet(sheet, 0, datepattern='%Y-%m-%d')[0][3] == '2020-03-02'
+    # corner cases
+    assert utils.decode_sheet(StubSheet([]), 0) == []
+    assert utils.decode_sheet(StubSheet([[(xlrd.XL_CELL_TEXT, 'a')]]), 0) == [['a']]
+
 
 def test_folder2props():
     for folder_name, exp_result in [
@@ -148,3 +207,232 @@ def test_csv_writers(tmpdir):
         writer, fp = writers[key]
         assert fp.mode == 'a'
     utils.close_csv_writers(writers)
+
+
+def test_open_text(tmpdir):
+    text = 'first line\nsecond line àè\n'
+    plain_path = str(tmpdir.join('file.json'))
+    with open(plain_path, 'w', encoding='utf-8') as fp:
+        fp.write(text)
+    gz_path = str(tmpdir.join('file.json.GZ'))
+    with gzip.open(gz_path, 'wt', encoding='utf-8') as fp:
+        fp.write(text)
+    for filepath in [plain_path, gz_path]:
+        with utils.open_text(filepath, encoding='utf-8') as fp:
+            assert list(fp) == ['first line\n', 'second line àè\n']
+    # extraction gives the same content
+    extracted_path = str(tmpdir.join('extracted.json'))
+    utils.extract_gz(gz_path, extracted_path, rm_source=True)
+    assert not exists(gz_path)
+    with open(extracted_path, encoding='utf-8') as fp:
+        assert fp.read() == text
+
+
+def test_conversion():
+    conversion = utils.Conversion('(X-32)/1.8')
+    assert conversion(50.) == 10.
+    assert conversion(0.) == round((0. - 32) / 1.8, 4) == -17.7778
+    assert repr(conversion) == "Conversion('(X-32)/1.8')"
+    # arrays
+    values = np.array([[50., 0.], [np.nan, 1e300]])
+    converted = conversion(values)
+    assert converted.shape == (2, 2)
+    assert converted[0].tolist() == [10., -17.7778]
+    assert np.isnan(converted[1, 0]) and converted[1, 1] == round((1e300 - 32) / 1.8, 4)
+    # same rounding of the scalar version, also near the ties
+    conversion = utils.Conversion('X*0.023884')
+    values = np.round(np.linspace(-1000, 1000, 20001), 1)
+    assert conversion(values).tolist() == [conversion(value) for value in values.tolist()]
+    assert conversion(np.array([12.5])).tolist() == [round(12.5 * 0.023884, 4)]
+    # constant expression
+    assert utils.Conversion('2')(np.zeros(3)).tolist() == [2., 2., 2.]
+    # pickable
+    assert pickle.loads(pickle.dumps(conversion))(12.5) == conversion(12.5)
+    # not allowed expressions
+    for expression in ['Y+1', 'X.real', '__import__("os")', 'X if X else 1', '"X"', 'X[0]']:
+        with pytest.raises(ValueError):
+            utils.Conversion(expression)
+
+
+def test_string2lambda():
+    function = utils.string2lambda('X/10')
+    assert function(123.) == 12.3
+    assert function(np.array([123., 7.])).tolist() == [12.3, 0.7]
+    assert utils.string2lambda('X*3', round_precision=1)(0.123) == 0.4
+    with pytest.raises(AssertionError):
+        utils.string2lambda('max(X, 1)')
+
+
+def test_freeze():
+    obj = {'a': [1, {'b': [2, 3]}], 'c': (4, [5]), 'd': 'text'}
+    frozen = utils.freeze(obj)
+    assert frozen == {'a': (1, {'b': (2, 3)}), 'c': (4, (5, )), 'd': 'text'}
+    with pytest.raises(TypeError):
+        frozen['d'] = 'other'
+    with pytest.raises(TypeError):
+        frozen['a'][1]['b'] = 'other'
+
+
+def test_load_parameters(tmpdir, mocker):
+    filepath = str(tmpdir.join('params.csv'))
+    with open(filepath, 'w') as fp:
+        fp.write('par_code;min;max\nTmin;-40;40\n')
+    load_function = mocker.Mock(side_effect=lambda path, delimiter: {'Tmin': [-40, 40]})
+    thresholds = utils.load_parameters(load_function, filepath)
+    assert thresholds == {'Tmin': (-40, 40)}
+    with pytest.raises(TypeError):
+        thresholds['Tmin'] = (0, 0)
+    assert utils.load_parameters(load_function, filepath) is thresholds
+    load_function.assert_called_once_with(filepath, ';')
+    # a modified file is loaded again
+    with open(filepath, 'w') as fp:
+        fp.write('par_code;min;max\nTmin;-30;30\n')
+    utils.load_parameters(load_function, filepath)
+    assert load_function.call_count == 2
+
+
+def test_sniff_file(tmpdir, mocker):
+    filepath = str(tmpdir.join('file.csv'))
+    with open(filepath, 'w') as fp:
+        fp.write('a,b\n')
+    sniff_function = mocker.Mock(side_effect=lambda path: {'path': path})
+    header = utils.sniff_file(filepath, sniff_function)
+    assert header == {'path': filepath}
+    assert utils.sniff_file(filepath, sniff_function) is header
+    assert sniff_function.call_count == 1
+    # a modified file is read again
+    with open(filepath, 'w') as fp:
+        fp.write('a,b,c\n')
+    assert utils.sniff_file(filepath, sniff_function) == {'path': filepath}
+    assert sniff_function.call_count == 2
+
+
+def test_iter_data_rows(tmpdir, mocker):
+    filepath = str(tmpdir.join('file.csv'))
+    with open(filepath, 'w') as fp:
+        fp.write('title\n"multi\nline";x\nA;B\n1;2\n3;4;5\n')
+    is_header_row = mocker.Mock(side_effect=lambda row: row['a'] == 'A')
+    header = dict()
+    expected = [
+        (4, {'a': '1', 'b': '2'}),
+        (5, {'a': '3', 'b': '4', None: ['5']}),
+    ]
+    rows = list(utils.iter_data_rows(filepath, header, ['a', 'b'], is_header_row, ';'))
+    assert rows == expected
+    assert is_header_row.call_count == 3
+    assert list(header['data_starts']) == [('a', 'b')]
+    # the head is not read again
+    rows = list(utils.iter_data_rows(filepath, header, ['a', 'b'], is_header_row, ';'))
+    assert rows == expected
+    assert is_header_row.call_count == 3
+
+    # header not found
+    rows = list(utils.iter_data_rows(filepath, dict(), ['a', 'b'], lambda row: False, ';'))
+    assert rows == []
+
+
+def test_numeric_fields_mask():
+    fields = [b'    355', b'   -2.5', b'  32767', b'    -.5', b'     5.', b'   3 5',
+              b'  3-5', b'    1e5', b'   2.5.', b'      -', b'      .', b'       ', b'3555555']
+    chars = np.frombuffer(b''.join(f.rjust(7) for f in fields), dtype=np.uint8)
+    chars = chars.reshape(1, len(fields), 7)
+    assert utils.numeric_fields_mask(chars)[0].tolist() == [
+        True, True, True, True, True, False, False, False, False, False, False, False, False]
+    assert utils.numeric_fields_mask(chars, leading_space=False)[0].tolist()[-1] is True
+
+
+def test_decode_fixed_width_rows():
+    rows = [
+        '201301010000 43.876999      9    355  32767      1      2\n',
+        '201301010100 43.876999     -6    3.5     65      2      1',
+        '201302300100 43.876999      6    310     65      2      1\n',  # wrong date
+        '201301010200 43.876999      6    310     65      2\n',  # wrong length
+        '201301010300 43.876999      6    310     6a      2      1\n',  # not numeric
+        '201301010400 43.876999      6    31 0     65      2     1\n',  # wrong spacing
+        '201301010500  43.87699      6    310     65      2      1\n',  # wrong latitude length
+    ]
+    regular, dates, lats, values, missing = utils.decode_fixed_width_rows(rows, 5, '32767')
+    assert regular.tolist() == [True, True, False, False, False, False, False]
+    assert dates[:2] == [datetime(2013, 1, 1, 0, 0), datetime(2013, 1, 1, 1, 0)]
+    assert dates[2:] == [None] * 5
+    assert lats[:2].tolist() == [43.876999, 43.876999]
+    assert values[:2].tolist() == [[9.0, 355.0, 32767.0, 1.0, 2.0], [-6.0, 3.5, 65.0, 2.0, 1.0]]
+    assert missing[:2].tolist() == [[False, False, True, False, False], [False] * 5]
+    # no regular rows
+    regular, dates, lats, values, missing = utils.decode_fixed_width_rows(rows[2:], 5, '32767')
+    assert not regular.any()
+    assert dates == [None] * 5
+
+
+def test_compile_date_pattern():
+    assert utils.compile_date_pattern('%Y%m%d%H%M') == (
+        12, {'Y': (0, 4), 'm': (4, 6), 'd': (6, 8), 'H': (8, 10), 'M': (10, 12)}, [])
+    assert utils.compile_date_pattern('%d.%m.%y') == (
+        8, {'d': (0, 2), 'm': (3, 5), 'y': (6, 8)}, [(2, '.'), (5, '.')])
+    # not managed directives
+    assert utils.compile_date_pattern('%Y-%j') is None
+    assert utils.compile_date_pattern('%Y-%m-%d %%') is None
+    # not a date
+    assert utils.compile_date_pattern('%H:%M') is None
+
+
+def test_date_parser():
+    patterns_and_strings = [
+        ('%Y%m%d%H%M', ['201301010000', '201302291000', '201312312359', '201301012400',
+                        '2013010100', '20130101000a', '2013 1010000']),
+        ('%d.%m.%Y', ['01.02.2013', '1.2.2013', '31.04.2013', '01/02/2013', '01.02.0000']),
+        ('%Y-%m-%dT%H:%M:%SZ', ['2020-02-01T00:00:00Z', '2020-02-01T00:00:60Z',
+                                '2020-02-01T00:00:00z', '2020-02-01T00:00:00']),
+        ('%H:%M:%S %d/%m/%Y', ['00:00:00 01/01/2019', '00:00:00  01/01/2019', '01/01/2019']),
+        ('%y%m%d%H.%M', ['1801010.00', '18010100.00', '69010100.00', '68123123.59']),
+    ]
+    for pattern, date_strs in patterns_and_strings:
+        parser = utils.date_parser(pattern)
+        for date_str in date_strs:
+            try:
+                expected = datetime.strptime(date_str, pattern)
+            except ValueError:
+                with pytest.raises(ValueError):
+                    parser(date_str)
+                with pytest.raises(ValueError):
+                    utils.strptime(date_str, pattern)
+                continue
+            assert parser(date_str) == expected
+            assert parser(date_str) == expected  # from the memo
+            assert utils.strptime(date_str, pattern) == expected
+    # memo size
+    parser = utils.date_parser('%Y%m%d', memo_size=2)
+    for date_str in ['20130101', '20130102', '20130103', '20130101']:
+        assert parser(date_str) == datetime.strptime(date_str, '%Y%m%d')
+    # not managed patterns
+    parser = utils.date_parser('%Y-%j')
+    assert parser('2013-032') == datetime(2013, 2, 1)
+
+
+def test_decode_dates():
+    date_strs = [b'201301010000', b'201302291000', b'201312312359', b'20130101000a',
+                 b'201313010000', b'201301010060']
+    chars = np.frombuffer(b''.join(date_strs), dtype=np.uint8).reshape(len(date_strs), 12)
+    times, ok = utils.decode_dates(chars, '%Y%m%d%H%M')
+    assert ok.tolist() == [True, False, True, False, False, False]
+    assert times[ok].tolist() == [datetime(2013, 1, 1), datetime(2013, 12, 31, 23, 59)]
+    # width not compliant
+    times, ok = utils.decode_dates(chars[:, :10], '%Y%m%d%H%M')
+    assert not ok.any()
+
+
+def test_parse_dates():
+    date_strs = ['01.02.2013', '1.2.2013', '31.04.2013', '29.02.2016', '01/02/2013']
+    assert utils.parse_dates(date_strs, '%d.%m.%Y') == [
+        datetime(2013, 2, 1), datetime(2013, 2, 1), None, datetime(2016, 2, 29), None]
+    assert utils.parse_dates([], '%d.%m.%Y') == []
+    assert utils.parse_dates(['2013-032'], '%Y-%j') == [datetime(2013, 2, 1)]
+
+
+def test_parse_date():
+    patterns = ['%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S']
+    assert utils.parse_date('2020-02-01T00:00:00Z', patterns) == datetime(2020, 2, 1)
+    assert utils.parse_date('2020-02-01T00:00:00', patterns) == datetime(2020, 2, 1)
+    assert utils.parse_date('2020-02-01', patterns) is None
+    # the first pattern matching is used
+    assert utils.parse_date('01/02/2020', ['%d/%m/%Y', '%m/%d/%Y']) == datetime(2020, 2, 1)
@@ -0,0 +1,103 @@
+
+from datetime import date, datetime
+from os.path import join
+
+import numpy as np
+
+from sciafeed import batch, parsing
+
+from . import TEST_DATA_PATH
+
+
+def test_from_measures():
+    metadata1 = {'cod_utente': '70001', 'lat': 43.876999, 'cod_rete': '15'}
+    metadata2 = {'cod_utente': '70002', 'lat': 43.8, 'cod_rete': '15'}
+    data = [
+        (dict(metadata1, row=1), datetime(2013, 1, 1, 0, 0), '1', 9.0, True),
+        (dict(metadata1, row=1), datetime(2013, 1, 1, 0, 0), '2', None, False),
+        (dict(metadata2, row=2), datetime(2013, 1, 1, 1, 0), '1', 6.5, False),
+        (metadata2, datetime(2013, 1, 1, 1, 30), '3', 22, True),
+    ]
+    measure_batch = batch.MeasureBatch.from_measures(iter(data))
+    assert len(measure_batch) == 4
+    assert measure_batch.stations == [metadata1, metadata2]
+    assert measure_batch.station_idx.tolist() == [0, 0, 1, 1]
+    assert measure_batch.rows.tolist() == [1, 1, 2, -1]
+    assert measure_batch.par_codes == ['1', '2', '3']
+    assert measure_batch.par_idx.tolist() == [0, 1, 0, 2]
+    assert np.isnan(measure_batch.values[1])
+    assert measure_batch.flags.tolist() == [True, False, False, True]
+    assert not measure_batch.dates_only
+    assert list(measure_batch) == data
+    for measure in measure_batch.iter_measures(copy_metadata=False):
+        assert measure[0] in (metadata1, metadata2)
+        assert 'row' not in measure[0]
+
+    # dates
+    data = [
+        (metadata1, date(2013, 1, 1), '1', 9.0, True),
+        (metadata1, date(2013, 1, 2), '1', 8.0, True),
+    ]
+    measure_batch = batch.MeasureBatch.from_measures(data)
+    assert measure_batch.dates_only
+    assert list(measure_batch) == data
+
+    # empty
+    measure_batch = batch.MeasureBatch.from_measures([])
+    assert len(measure_batch) == 0
+    assert list(measure_batch) == []
+
+    # from a parsed file
+    filepath = join(TEST_DATA_PATH, 'arpa19', 'loc01_70001_201301010000_201401010100.dat')
+    data, _ = parsing.parse(filepath)
+    measure_batch = batch.MeasureBatch.from_measures(data)
+    assert list(measure_batch) == data
+    assert len(measure_batch.stations) == 1
+    arrays_size = sum(getattr(measure_batch, attr).nbytes for attr in (
+        'station_idx', 'rows', 'times', 'par_idx', 'values', 'flags'))
+    assert arrays_size / len(measure_batch) < 30
+
+
+def test_take():
+    metadata = {'cod_utente': '70001', 'lat': 43.876999, 'cod_rete': '15'}
+    data = [
+        (metadata, datetime(2013, 1, 1, 0, 0), '1', 9.0, True),
+        (metadata, datetime(2013, 1, 1, 0, 0), '2', None, False),
+        (metadata, datetime(2013, 1, 1, 1, 0), '1', 6.5, False),
+    ]
+    measure_batch = batch.MeasureBatch.from_measures(data)
+    new_batch = measure_batch.take(np.array([2, 0]))
+    assert list(new_batch) == [data[2], data[0]]
+    assert new_batch.stations is measure_batch.stations
+    new_batch = measure_batch.take(measure_batch.flags)
+    assert list(new_batch) == [data[0]]
+
+    new_batch = measure_batch.with_flags(np.array([False, False, True]))
+    assert [m[-1] for m in new_batch] == [False, False, True]
+    assert measure_batch.flags.tolist() == [True, False, False]
+
+
+def test_positions_of():
+    metadata = {'cod_utente': '70001', 'lat': 43.876999, 'cod_rete': '15'}
+    data = [
+        (metadata, datetime(2013, 1, 1, 0, 0), '1', 9.0, True),
+        (metadata, datetime(2013, 1, 1, 0, 0), '2', None, False),
+        (metadata, datetime(2013, 1, 1, 1, 0), '1', 6.5, False),
+    ]
+    measure_batch = batch.MeasureBatch.from_measures(data)
+    assert measure_batch.positions_of('1').tolist() == [0, 2]
+    assert measure_batch.positions_of('2').tolist() == [1]
+    assert measure_batch.positions_of('3').tolist() == []
+
+
+def test_station_groups():
+    data = [
+        ({'cod_utente': '1', 'cod_rete': '15', 'source': 'a'}, date(2013, 1, 1), '1', 9., True),
+        ({'cod_utente': '1', 'cod_rete': '15', 'source': 'b'}, date(2013, 1, 1), '1', 9., True),
+        ({'cod_utente': '2', 'cod_rete': '15', 'source': 'a'}, date(2013, 1, 1), '1', 9., True),
+    ]
+    measure_batch = batch.MeasureBatch.from_measures(data)
+    assert len(measure_batch.stations) == 3
+    assert measure_batch.station_groups().tolist() == [0, 0, 1]
+    assert measure_batch.station_groups(('source', )).tolist() == [0, 1, 0]
+    assert measure_batch.row_ids().tolist() == [1, 1, 1]
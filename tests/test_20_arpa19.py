@@ -192,6 +192,60 @@ def test_validate_row_format():
     assert arpa19.validate_row_format(row) == 'The latitude length in the row is wrong'
 
 
+def test_parsed_rows_generator():
+    filepath = join(TEST_DATA_PATH, 'arpa19', 'wrong_70001_201301010000_201401010100.dat')
+    parameters_filepath = join(TEST_DATA_PATH, 'arpa19', 'arpa19_params.csv')
+    parameters_map = arpa19.load_parameter_file(parameters_filepath)
+    metadata = arpa19.extract_metadata(filepath, parameters_filepath)
+    found_errors = []
+    rows = list(arpa19.parsed_rows_generator(filepath, parameters_map, metadata, found_errors))
+    assert found_errors == arpa19.validate_format(filepath, parameters_filepath)
+    rows_with_errors = [i for i, _ in found_errors]
+    for i, row_measures in rows:
+        assert i not in rows_with_errors
+        assert len(row_measures) == 19
+        assert {m[0]['row'] for m in row_measures} == {i}
+    data, _ = arpa19.parse(filepath, parameters_filepath)
+    assert [m for _, row_measures in rows for m in row_measures] == data
+
+
+def test_fast_rows_generator(tmpdir):
+    filepath = join(TEST_DATA_PATH, 'arpa19', 'wrong_70001_201301010000_201401010100.dat')
+    parameters_filepath = join(TEST_DATA_PATH, 'arpa19', 'arpa19_params.csv')
+    parameters_map = arpa19.load_parameter_file(parameters_filepath)
+    metadata = arpa19.extract_metadata(filepath, parameters_filepath)
+    found_errors = []
+    rows = list(arpa19.slow_rows_generator(filepath, parameters_map, metadata, found_errors))
+    for chunk_size in (1, 7, 10000):
+        fast_found_errors = []
+        fast_rows = list(arpa19.fast_rows_generator(
+            filepath, parameters_map, metadata, fast_found_errors, chunk_size=chunk_size))
+        assert fast_found_errors == found_errors
+        assert fast_rows == rows
+
+    # fast reader in validation and parsing
+    for filename in ('wrong_70001_201301010000_201401010100.dat',
+                     'loc01_70001_201301010000_201401010100.dat'):
+        filepath = join(TEST_DATA_PATH, 'arpa19', filename)
+        assert arpa19.validate_format(filepath, parameters_filepath, fast=True) \
+            == arpa19.validate_format(filepath, parameters_filepath, fast=False)
+        assert arpa19.parse(filepath, parameters_filepath, fast=True) \
+            == arpa19.parse(filepath, parameters_filepath, fast=False)
+
+    # a latitude not filling its field (with a leading space)
+    with open(join(TEST_DATA_PATH, 'arpa19', 'loc01_70001_201301010000_201401010100.dat')) as fp:
+        lines = fp.readlines()
+    lines[0] = lines[0][:13] + ' ' + lines[0][13:21] + lines[0][22:]
+    filepath = str(tmpdir.join('loc01_70001_201301010000_201401010100.dat'))
+    with open(filepath, 'w') as fp:
+        fp.writelines(lines)
+    slow_result = arpa19.parse(filepath, parameters_filepath, fast=False)
+    assert slow_result[1][0] == (1, 'The latitude length in the row is wrong')
+    assert arpa19.validate_format(filepath, parameters_filepath, fast=True) \
+        == arpa19.validate_format(filepath, parameters_filepath, fast=False)
+    assert arpa19.parse(filepath, parameters_filepath, fast=True) == slow_result
+
+
 def test_validate_format(tmpdir):
     # right file
     filepath = join(TEST_DATA_PATH, 'arpa19', 'loc01_70001_201301010000_201401010100.dat')
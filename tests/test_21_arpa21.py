@@ -211,6 +211,43 @@ def test_validate_row_format():
     assert arpa21.validate_row_format(row) == 'The latitude length in the row is wrong'
 
 
+def test_fast_rows_generator(tmpdir):
+    filepath = join(TEST_DATA_PATH, 'arpa21', 'wrong_00201_201201010000_201301010100.dat')
+    parameters_filepath = join(TEST_DATA_PATH, 'arpa21', 'arpa21_params.csv')
+    parameters_map = arpa21.load_parameter_file(parameters_filepath)
+    metadata = arpa21.extract_metadata(filepath, parameters_filepath)
+    found_errors = []
+    rows = list(arpa21.slow_rows_generator(filepath, parameters_map, metadata, found_errors))
+    for chunk_size in (1, 7, 10000):
+        fast_found_errors = []
+        fast_rows = list(arpa21.fast_rows_generator(
+            filepath, parameters_map, metadata, fast_found_errors, chunk_size=chunk_size))
+        assert fast_found_errors == found_errors
+        assert fast_rows == rows
+
+    # fast reader in validation and parsing
+    for filename in ('wrong_00201_201201010000_201301010100.dat',
+                     'loc01_00201_201201010000_201301010100.dat'):
+        filepath = join(TEST_DATA_PATH, 'arpa21', filename)
+        assert arpa21.validate_format(filepath, parameters_filepath, fast=True) \
+            == arpa21.validate_format(filepath, parameters_filepath, fast=False)
+        assert arpa21.parse(filepath, parameters_filepath, fast=True) \
+            == arpa21.parse(filepath, parameters_filepath, fast=False)
+
+    # a latitude not filling its field (with a leading space)
+    with open(join(TEST_DATA_PATH, 'arpa21', 'loc01_00201_201201010000_201301010100.dat')) as fp:
+        lines = fp.readlines()
+    lines[0] = lines[0][:13] + ' ' + lines[0][13:21] + lines[0][22:]
+    filepath = str(tmpdir.join('loc01_00201_201201010000_201301010100.dat'))
+    with open(filepath, 'w') as fp:
+        fp.writelines(lines)
+    slow_result = arpa21.parse(filepath, parameters_filepath, fast=False)
+    assert slow_result[1][0] == (1, 'The latitude length in the row is wrong')
+    assert arpa21.validate_format(filepath, parameters_filepath, fast=True) \
+        == arpa21.validate_format(filepath, parameters_filepath, fast=False)
+    assert arpa21.parse(filepath, parameters_filepath, fast=True) == slow_result
+
+
 def test_validate_format(tmpdir):
     # right file
     filepath = join(TEST_DATA_PATH, 'arpa21', 'loc01_00201_201201010000_201301010100.dat')
@@ -44,6 +44,32 @@ def test_validate_filename():
     assert err_msg == 'Extension expected must be .csv, found .xls'
 
 
+def test_sniff_header(mocker):
+    test_filepath = join(TEST_DATA_PATH, 'trentino', 'T0001.csv')
+    header = trentino.sniff_header(test_filepath)
+    assert header == {
+        'station_code': 'T0001',
+        'parameters': ['400.55'],
+        'station_props_str': 'T0001 - Pergine Valsugana (Convento) Lat:46.06227631 '
+                             'Long:11.23670156 Elev:475',
+    }
+    # the header is searched only on the first lines
+    mocker.patch.object(trentino, 'HEADER_MAX_LINES', 3)
+    header = trentino.sniff_header(test_filepath)
+    assert header == {'station_code': 'T0001', 'parameters': ['400.55'],
+                      'station_props_str': ''}
+    mocker.patch.object(trentino, 'HEADER_MAX_LINES', 1000)
+
+    # detection, validation and parsing read the head of the file only once
+    parameters_filepath = join(TEST_DATA_PATH, 'trentino', 'trentino_params.csv')
+    sniff_spy = mocker.spy(trentino, 'sniff_header')
+    assert trentino.is_format_compliant(test_filepath, parameters_filepath)
+    assert not trentino.validate_format(test_filepath, parameters_filepath)
+    data, errors = trentino.parse(test_filepath, parameters_filepath)
+    assert len(data) == 14 and not errors
+    assert sniff_spy.call_count == 1
+
+
 def test_guess_fieldnames():
     parmap_filepath = join(TEST_DATA_PATH, 'trentino', 'trentino_params.csv')
     parameters_map = trentino.load_parameter_file(parmap_filepath)
@@ -151,6 +177,24 @@ def test_validate_row_format():
     assert err_msg == 'the value for Tmin is not numeric'
 
 
+def test_parsed_rows_generator():
+    filepath = join(TEST_DATA_PATH, 'trentino', 'wrong3.csv')
+    parameters_filepath = join(TEST_DATA_PATH, 'trentino', 'trentino_params.csv')
+    parameters_map = trentino.load_parameter_file(parameters_filepath)
+    metadata = trentino.extract_metadata(filepath, parameters_filepath)
+    found_errors = []
+    rows = list(trentino.parsed_rows_generator(filepath, parameters_map, metadata,
+                                               found_errors))
+    assert found_errors == trentino.validate_format(filepath, parameters_filepath)
+    rows_with_errors = [i for i, _ in found_errors]
+    assert rows
+    for i, row_measures in rows:
+        assert i not in rows_with_errors
+        assert len(row_measures) == 1
+    data, _ = trentino.parse(filepath, parameters_filepath)
+    assert [m for _, row_measures in rows for m in row_measures] == data
+
+
 def test_validate_format():
     parameters_filepath = join(TEST_DATA_PATH, 'trentino', 'trentino_params.csv')
 
@@ -2,6 +2,8 @@
 from datetime import date
 from os.path import join
 
+import xlrd
+
 from sciafeed import bolzano
 from . import TEST_DATA_PATH
 
@@ -165,6 +167,21 @@ def test_parse():
     assert err_msgs == bolzano.validate_format(filepath, parameters_filepath)
 
 
+def test_workbook_loaded_once(mocker, tmpdir):
+    # detection, metadata extraction, validation and parsing share the loaded workbook
+    filepath = str(tmpdir.join('MonteMaria.xls'))
+    with open(join(TEST_DATA_PATH, 'bolzano', 'MonteMaria.xls'), 'rb') as f_in:
+        with open(filepath, 'wb') as f_out:
+            f_out.write(f_in.read())
+    parameters_filepath = join(TEST_DATA_PATH, 'bolzano', 'bolzano_params.csv')
+    open_workbook_spy = mocker.spy(xlrd, 'open_workbook')
+    assert bolzano.is_format_compliant(filepath)
+    assert bolzano.validate_format(filepath, parameters_filepath) == []
+    data, err_msgs = bolzano.parse(filepath, parameters_filepath)
+    assert len(data) == 24
+    assert open_workbook_spy.call_count == 1
+
+
 def test_is_format_compliant():
     filepath = join(TEST_DATA_PATH, 'bolzano', 'MonteMaria.xls')
     assert bolzano.is_format_compliant(filepath)
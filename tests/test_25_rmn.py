@@ -40,6 +40,25 @@ def test_load_parameter_thresholds():
     assert parameter_thresholds == expected_thresholds
 
 
+def test_sniff_header(mocker):
+    test_filepath = join(TEST_DATA_PATH, 'rmn', 'ancona_right.csv')
+    header = rmn.sniff_header(test_filepath)
+    assert header['header_line'].startswith('DATA;ORA;')
+    # the header is searched only on the first lines
+    mocker.patch.object(rmn, 'HEADER_MAX_LINES', 2)
+    assert rmn.sniff_header(test_filepath) == {'header_line': None}
+    mocker.patch.object(rmn, 'HEADER_MAX_LINES', 1000)
+
+    # detection, validation and parsing read the head of the file only once
+    parameters_filepath = join(TEST_DATA_PATH, 'rmn', 'rmn_params.csv')
+    sniff_spy = mocker.spy(rmn, 'sniff_header')
+    assert rmn.is_format_compliant(test_filepath, parameters_filepath)
+    assert not rmn.validate_format(test_filepath, parameters_filepath)
+    data, errors = rmn.parse(test_filepath, parameters_filepath)
+    assert data and not errors
+    assert sniff_spy.call_count == 1
+
+
 def test_guess_fieldnames():
     parmap_filepath = join(TEST_DATA_PATH, 'rmn', 'rmn_params.csv')
     parameters_map = rmn.load_parameter_file(parmap_filepath)
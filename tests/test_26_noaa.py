@@ -104,6 +104,28 @@ def test_validate_row_format():
     assert noaa.validate_row_format(row) == 'The row contains not numeric values'
 
 
+def test_parsed_rows_generator():
+    filepath = join(TEST_DATA_PATH, 'noaa', 'wrong2_160080-99999-2019.op')
+    parameters_filepath = join(TEST_DATA_PATH, 'noaa', 'noaa_params.csv')
+    parameters_map = noaa.load_parameter_file(parameters_filepath)
+    metadata = noaa.extract_metadata(filepath, parameters_filepath)
+    found_errors = []
+    rows = list(noaa.parsed_rows_generator(filepath, parameters_map, metadata, found_errors))
+    assert found_errors == noaa.validate_format(filepath, parameters_filepath)
+    assert [i for i, _ in rows] == [7, 8, 9, 11]
+    data, _ = noaa.parse(filepath, parameters_filepath)
+    assert [m for _, row_measures in rows for m in row_measures] == data
+
+
+def test_validate_header():
+    filepath = join(TEST_DATA_PATH, 'noaa', '160080-99999-2019.op')
+    assert noaa.validate_header(filepath) == ''
+    filepath = join(TEST_DATA_PATH, 'noaa', '160080-99999-2019.csv')
+    assert noaa.validate_header(filepath) == 'file extension must be .op'
+    filepath = join(TEST_DATA_PATH, 'noaa', 'wrong1_160080-99999-2019.op')
+    assert noaa.validate_header(filepath) == "file doesn't include a correct header"
+
+
 def test_validate_format():
     # right file
     filepath = join(TEST_DATA_PATH, 'noaa', '160080-99999-2019.op')
@@ -1,6 +1,10 @@
 
 from datetime import date
+import logging
 from os.path import exists, join
+import threading
+
+import zeep.cache
 
 from sciafeed import hiscentral
 from . import TEST_DATA_PATH
@@ -22,6 +26,69 @@ def dummy_get_wsdl_service_response(wsdl_url, method_name, **kwargs):
     raise AttributeError(method_name)
 
 
+def test_get_wsdl_client(mocker, tmpdir):
+    mocker.patch.dict('sciafeed.hiscentral.WSDL_CLIENTS', clear=True)
+    built = []
+
+    class StubClient:
+        def __init__(self, wsdl, transport):
+            built.append(wsdl)
+            self.transport = transport
+
+    mocker.patch('sciafeed.hiscentral.zeep.Client', new=StubClient)
+    cache_path = str(tmpdir.join('cache.db'))
+    clients = []
+
+    def get_client(region_id):
+        wsdl_url = hiscentral.WSDL_URLS[region_id]
+        clients.append(hiscentral.get_wsdl_client(wsdl_url, cache_path=cache_path))
+
+    threads = [threading.Thread(target=get_client, args=(region_id, ))
+               for region_id in ['01', '02'] * 5]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # one client for each WSDL
+    assert sorted(built) == [hiscentral.WSDL_URLS['01'], hiscentral.WSDL_URLS['02']]
+    assert len(set(map(id, clients))) == 2
+    client = hiscentral.get_wsdl_client(hiscentral.WSDL_URLS['01'])
+    assert client is hiscentral.WSDL_CLIENTS[hiscentral.WSDL_URLS['01']]
+    assert isinstance(client.transport.cache, zeep.cache.SqliteCache)
+    assert exists(cache_path)
+
+
+def test_iter_xml_elements():
+    xml_string = '<root xmlns="http://a.b/ns"><values><value n="1">10</value>' \
+                 '<other>x</other><value n="2">20</value><value n="3" /></values></root>'
+    for chunk_size in [1, 7, 1000]:
+        effective = []
+        for elem in hiscentral.iter_xml_elements(xml_string, 'value', chunk_size=chunk_size):
+            effective.append((elem.attrib, elem.text))
+        assert effective == [({'n': '1'}, '10'), ({'n': '2'}, '20'), ({'n': '3'}, None)]
+    # bytes input
+    effective = [e.text for e in hiscentral.iter_xml_elements(xml_string.encode(), 'other')]
+    assert effective == ['x']
+    # the elements yielded are cleared when the iteration goes on
+    elems = hiscentral.iter_xml_elements(xml_string, 'values')
+    values_elem = next(elems)
+    assert len(values_elem) == 4
+    assert list(elems) == []
+    assert len(values_elem) == 0
+
+
+def test_find_xml_text():
+    xml_string = '<site xmlns="http://a.b/ns"><siteInfo><siteName>name</siteName>' \
+                 '<geo><lat>45.1</lat></geo><empty/></siteInfo></site>'
+    site_elem = next(hiscentral.iter_xml_elements(xml_string, 'site'))
+    # it searches all the sub elements, excluding the element itself
+    assert hiscentral.find_xml_text(site_elem, 'siteName') == 'name'
+    assert hiscentral.find_xml_text(site_elem, 'lat') == '45.1'
+    assert hiscentral.find_xml_text(site_elem, 'empty') is None
+    assert hiscentral.find_xml_text(site_elem, 'site') is None
+    assert hiscentral.find_xml_text(site_elem, 'not_existing') is None
+
+
 def test_get_region_variables(mocker):
     mocker.patch('sciafeed.hiscentral.get_wsdl_service_response',
                  new=dummy_get_wsdl_service_response)
@@ -66,6 +133,89 @@ def test_download_series(mocker, tmpdir):
             assert expected_line in effective_lines
 
 
+def test_is_series_complete(tmpdir):
+    filepath = join(TEST_DATA_PATH, 'hiscentral', 'serie_990-reg.abruzzoTmax.csv')
+    assert hiscentral.is_series_complete(filepath)
+    csv_path = str(tmpdir.join('serie.csv'))
+    assert not hiscentral.is_series_complete(csv_path)
+    with open(filepath) as fp:
+        content = fp.read()
+    # truncated
+    with open(csv_path, 'w') as fp:
+        fp.write(content[:-5])
+    assert not hiscentral.is_series_complete(csv_path)
+    # wrong header
+    with open(csv_path, 'w') as fp:
+        fp.write(content.replace('DataValue', 'Data'))
+    assert not hiscentral.is_series_complete(csv_path)
+    # empty file
+    with open(csv_path, 'w') as fp:
+        pass
+    assert not hiscentral.is_series_complete(csv_path)
+    # only the header
+    with open(csv_path, 'w') as fp:
+        fp.write(content.splitlines(True)[0])
+    assert hiscentral.is_series_complete(csv_path)
+
+
+def test_download_hiscentral(mocker, tmpdir):
+    calls = []
+    lock = threading.Lock()
+
+    def stub_service_response(wsdl_url, method_name, **kwargs):
+        with lock:
+            calls.append((method_name, kwargs.get('location'), kwargs.get('variable')))
+        if kwargs.get('location') == 'broken':
+            raise ValueError('service not available')
+        return dummy_get_wsdl_service_response(wsdl_url, method_name, **kwargs)
+
+    mocker.patch('sciafeed.hiscentral.get_wsdl_service_response', new=stub_service_response)
+    out_folder = str(tmpdir)
+    locations = ['990', '991']
+    variables = ['Tmax', 'Tmin']
+    hiscentral.download_hiscentral('13', out_folder, variables, locations, workers=3)
+    assert sorted(calls) == [('GetValues', loc, var) for loc in locations for var in variables]
+    expected_path = join(TEST_DATA_PATH, 'hiscentral', 'serie_990-reg.abruzzoTmax.csv')
+    with open(expected_path) as fp:
+        expected_lines = fp.readlines()
+    for location in locations:
+        for variable in variables:
+            csv_path = join(out_folder, 'serie_%s-reg.abruzzo%s.csv' % (location, variable))
+            assert hiscentral.is_series_complete(csv_path)
+            assert not exists(csv_path + '.part')
+            with open(csv_path) as fp:
+                effective_lines = fp.readlines()
+            for expected_line in expected_lines:
+                assert expected_line in effective_lines
+
+    # the complete series are skipped
+    calls.clear()
+    truncated_path = join(out_folder, 'serie_991-reg.abruzzoTmin.csv')
+    with open(truncated_path) as fp:
+        content = fp.read()
+    with open(truncated_path, 'w') as fp:
+        fp.write(content[:-10])
+    hiscentral.download_hiscentral('13', out_folder, variables, locations, workers=3)
+    assert calls == [('GetValues', '991', 'Tmin')]
+    assert hiscentral.is_series_complete(truncated_path)
+    calls.clear()
+    hiscentral.download_hiscentral('13', out_folder, variables, locations, overwrite=True)
+    assert len(calls) == 4
+
+    # a failed series does not stop the others
+    calls.clear()
+    logger = logging.getLogger('test_download_hiscentral')
+    error_spy = mocker.spy(logger, 'error')
+    hiscentral.download_hiscentral('13', out_folder, ['Precipitation'], ['broken', '990'],
+                                   logger=logger)
+    assert sorted(calls) == [('GetValues', '990', 'Precipitation'),
+                             ('GetValues', 'broken', 'Precipitation')]
+    assert exists(join(out_folder, 'serie_990-reg.abruzzoPrecipitation.csv'))
+    assert not exists(join(out_folder, 'serie_broken-reg.abruzzoPrecipitation.csv'))
+    error_spy.assert_called_once_with(
+        'download of serie_broken-reg.abruzzoPrecipitation.csv failed: service not available')
+
+
 def test_load_parameter_file():
     test_filepath = join(TEST_DATA_PATH, 'hiscentral', 'hiscentral_params.csv')
     parameter_map = hiscentral.load_parameter_file(test_filepath)
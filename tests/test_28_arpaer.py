@@ -1,8 +1,12 @@
 
 import copy
 from datetime import datetime
+import gzip
+import hashlib
 import json
+from os import listdir
 from os.path import join, exists
+import shutil
 
 from sciafeed import arpaer
 from . import TEST_DATA_PATH
@@ -424,6 +428,59 @@ def test_query_recent_and_save(tmpdir, mocker):
 #         'unit': 'NUMERIC'}
 
 
+def test_download_er(tmpdir, mocker, monkeypatch, http_server):
+    download_folder = str(tmpdir)
+    filelist = dict()
+    for month in range(1, 4):
+        filename = 'meteo-2019-%02i.json.gz' % month
+        filelist[filename] = 'id%s' % month
+        http_server.files['id%s' % month] = gzip.compress(b'{"month": %d}\n' % month)
+    filelist['not_parsable.txt'] = 'id_not_parsable'
+    mocker.patch('sciafeed.gdrive_utils.get_gdrive_filelist', return_value=filelist)
+    monkeypatch.setattr('sciafeed.gdrive_utils.DOWNLOAD_URL', http_server.url)
+    manifest_path = join(download_folder, arpaer.DOWNLOAD_STATE_FOLDER,
+                         arpaer.DOWNLOAD_MANIFEST_FILENAME)
+    start = datetime(2019, 1, 10)
+    end = datetime(2019, 2, 15)
+
+    arpaer.download_er(download_folder, start, end, workers=2)
+    assert sorted(r[0] for r in http_server.requests) == ['id1', 'id2']
+    manifest = json.load(open(manifest_path))
+    assert sorted(manifest) == ['meteo-2019-01.json.gz', 'meteo-2019-02.json.gz']
+    for month in [1, 2]:
+        filename = 'meteo-2019-%02i.json.gz' % month
+        content = http_server.files['id%s' % month]
+        assert manifest[filename] == {
+            'file_id': 'id%s' % month, 'size': len(content), 'saved_as': filename,
+            'sha256': hashlib.sha256(content).hexdigest()}
+        assert arpaer.load_db_results(join(download_folder, filename)) == [{'month': month}]
+    # only the data files are in the download folder
+    assert sorted(listdir(download_folder)) == [
+        arpaer.DOWNLOAD_STATE_FOLDER, 'meteo-2019-01.json.gz', 'meteo-2019-02.json.gz']
+
+    # a rerun skips the files already downloaded
+    http_server.requests.clear()
+    end = datetime(2019, 3, 15)
+    arpaer.download_er(download_folder, start, end, extract=True)
+    assert http_server.requests == [('id3', None)]
+    manifest = json.load(open(manifest_path))
+    assert manifest['meteo-2019-03.json.gz']['saved_as'] == 'meteo-2019-03.json'
+    assert not exists(join(download_folder, 'meteo-2019-03.json.gz'))
+    assert arpaer.load_db_results(join(download_folder, 'meteo-2019-03.json')) == [{'month': 3}]
+    http_server.requests.clear()
+    arpaer.download_er(download_folder, start, end)
+    assert http_server.requests == []
+
+
+def test_validate_filename():
+    for filename in ['results.json', 'meteo-2020-01.json.gz', 'meteo-2020-01.JSON.GZ']:
+        assert not arpaer.validate_filename(filename)
+    assert arpaer.validate_filename('meteo-2020-01.gz') == \
+        'Extension expected must be .json or .json.gz, found '
+    assert arpaer.validate_filename('results.csv') == \
+        'Extension expected must be .json or .json.gz, found .csv'
+
+
 def test_load_parameter_file():
     test_filepath = join(TEST_DATA_PATH, 'arpaer', 'arpaer_params.csv')
     parameter_map = arpaer.load_parameter_file(test_filepath)
@@ -436,6 +493,54 @@ def test_load_parameter_file():
             assert 'description' in subprop
 
 
+def test_compile_parameters_matcher():
+    test_filepath = join(TEST_DATA_PATH, 'arpaer', 'arpaer_params.csv')
+    parameter_map = arpaer.load_parameter_file(test_filepath)
+    matcher = arpaer.compile_parameters_matcher(parameter_map)
+    assert set(matcher) == set(parameter_map)
+    exact_map, wildcards, memo = matcher['B12101']
+    assert [(k, [p['par_code'] for i, p in v]) for k, v in exact_map.items()] == [
+        (((103, 2000, None, None), (2, 0, 3600)), ['Tmax']),
+        (((103, 2000, None, None), (3, 0, 3600)), ['Tmin']),
+        (((103, 2000, None, None), (0, 0, 3600)), ['Tmedia'])]
+    assert wildcards == []
+    assert memo == {}
+    exact_map, wildcards, memo = matcher['B10004']
+    assert exact_map == {}
+    assert [(i, p['par_code']) for i, p in wildcards] == [(0, 'P')]
+
+
+def test_match_parameters():
+    any_value = int(arpaer.JSON_ANY_MARKER)
+    parameter_map = {
+        'B12101': [
+            {'par_code': 'A', 'level': [103, 2000], 'trange': [0, 0, 3600]},
+            {'par_code': 'B', 'level': [103, any_value], 'trange': [0, 0, any_value]},
+            {'par_code': 'C', 'level': [103, 2000], 'trange': [0, 0, 3600]},
+            {'par_code': 'D', 'level': [103, 2000], 'trange': [1, 0, 3600]},
+        ]
+    }
+    matcher = arpaer.compile_parameters_matcher(parameter_map)
+
+    def matched(bcode, level, trange):
+        props = arpaer.match_parameters(matcher, bcode, level, trange)
+        return [p['par_code'] for p in props]
+
+    # exact and wildcard matches, in the order of the parameters
+    assert matched('B12101', [103, 2000], [0, 0, 3600]) == ['A', 'B', 'C']
+    assert matched('B12101', [103, 2000], [1, 0, 3600]) == ['D']
+    # wildcard only
+    assert matched('B12101', [103, 1000], [0, 0, 60]) == ['B']
+    # no matches
+    assert matched('B12101', [103, 2000], [2, 0, 3600]) == []
+    assert matched('B12101', [103, 2000, None], [0, 0, 3600]) == []
+    assert matched('B00000', [103, 2000], [0, 0, 3600]) == []
+    # results are memoized
+    assert len(matcher['B12101'][2]) == 5
+    assert matched('B12101', [103, 2000], [0, 0, 3600]) == ['A', 'B', 'C']
+    assert len(matcher['B12101'][2]) == 5
+
+
 def test_load_parameter_thresholds():
     test_filepath = join(TEST_DATA_PATH, 'arpaer', 'arpaer_params.csv')
     expected_thresholds = {
@@ -516,7 +621,22 @@ def test_parse_row():
     assert effective == expected
 
 
-def test_validate_format():
+def test_parsed_rows_generator():
+    filepath = join(TEST_DATA_PATH, 'arpaer', 'wrong_results1.json')
+    parameters_filepath = join(TEST_DATA_PATH, 'arpaer', 'arpaer_params.csv')
+    parameters_map = arpaer.load_parameter_file(parameters_filepath)
+    metadata = arpaer.extract_metadata(filepath, parameters_filepath)
+    found_errors = []
+    rows = list(arpaer.parsed_rows_generator(filepath, parameters_map, metadata, found_errors))
+    assert found_errors == arpaer.validate_format(filepath, parameters_filepath)
+    rows_with_errors = [i for i, _ in found_errors]
+    for i, row_measures in rows:
+        assert i not in rows_with_errors
+    data, _ = arpaer.parse(filepath, parameters_filepath)
+    assert [m for _, row_measures in rows for m in row_measures] == data
+
+
+def test_validate_format(tmpdir):
     # right file
     filepath = join(TEST_DATA_PATH, 'arpaer', 'results.json')
     err_msgs = arpaer.validate_format(filepath)
@@ -529,8 +649,14 @@ def test_validate_format():
         (2, 'information of the station is not parsable'),
         (3, 'information of the date is wrong')]
 
+    # gzipped file
+    gz_filepath = str(tmpdir.join('wrong_results1.json.gz'))
+    with open(filepath, 'rb') as f_in, gzip.open(gz_filepath, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    assert arpaer.validate_format(gz_filepath) == err_msgs
+
 
-def test_parse():
+def test_parse(tmpdir):
     filepath = join(TEST_DATA_PATH, 'arpaer', 'results.json')
     parameters_filepath = join(TEST_DATA_PATH, 'arpaer', 'arpaer_params.csv')
     metadata = {'cod_utente': "San Nicolo'", 'is_fixed': True, 'lat': 45.04139, 'lon': 9.58959,
@@ -555,10 +681,27 @@ def test_parse():
         assert effective_data[i][0] == expected_md
     assert errs == arpaer.validate_format(filepath)
 
+    # gzipped file
+    gz_filepath = str(tmpdir.join('results.json.gz'))
+    with open(filepath, 'rb') as f_in, gzip.open(gz_filepath, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    gz_data, gz_errs = arpaer.parse(gz_filepath, parameters_filepath)
+    assert [record[1:] for record in gz_data] == [record[1:] for record in effective_data]
+    assert gz_data[0][0]['source'].endswith('results.json.gz')
+    assert gz_errs == errs
 
-def test_is_format_compliant():
+
+def test_is_format_compliant(tmpdir):
     filepath = join(TEST_DATA_PATH, 'arpaer', 'results.json')
     assert arpaer.is_format_compliant(filepath)
+    gz_filepath = str(tmpdir.join('results.json.gz'))
+    with open(filepath, 'rb') as f_in, gzip.open(gz_filepath, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    assert arpaer.is_format_compliant(gz_filepath)
+    # not a gzip archive
+    filepath = str(tmpdir.join('wrong.json.gz'))
+    shutil.copy(join(TEST_DATA_PATH, 'arpaer', 'results.json'), filepath)
+    assert not arpaer.is_format_compliant(filepath)
     filepath = join(TEST_DATA_PATH, 'trentino', 'wrong1.csv')
     assert not arpaer.is_format_compliant(filepath)
     filepath = join(TEST_DATA_PATH, 'rmn', 'ancona_right.csv')
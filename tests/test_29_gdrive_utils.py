@@ -0,0 +1,153 @@
+import hashlib
+from os import listdir
+from os.path import exists, join
+
+import pytest
+import requests
+
+from sciafeed import gdrive_utils
+
+
+def test_file_sha256(tmpdir):
+    filepath = str(tmpdir.join('file.bin'))
+    content = b'0123456789' * 10000
+    with open(filepath, 'wb') as fp:
+        fp.write(content)
+    assert gdrive_utils.file_sha256(filepath) == hashlib.sha256(content).hexdigest()
+    assert gdrive_utils.file_sha256(filepath, chunk_size=7) == hashlib.sha256(content).hexdigest()
+
+
+def test_download_gdrive_public_file(tmpdir, http_server):
+    content = bytes(range(256)) * 1000
+    expected_result = (len(content), hashlib.sha256(content).hexdigest())
+    http_server.files['id1'] = content
+    output_path = str(tmpdir.join('file1.gz'))
+    part_path = output_path + gdrive_utils.PARTIAL_SUFFIX
+
+    # simple download
+    result = gdrive_utils.download_gdrive_public_file('id1', output_path, url=http_server.url)
+    assert result == expected_result
+    with open(output_path, 'rb') as fp:
+        assert fp.read() == content
+    assert not exists(part_path)
+    assert http_server.requests == [('id1', None)]
+
+    # resume of a partial file
+    http_server.requests.clear()
+    with open(part_path, 'wb') as fp:
+        fp.write(content[:1000])
+    result = gdrive_utils.download_gdrive_public_file('id1', output_path, url=http_server.url)
+    assert result == expected_result
+    assert http_server.requests == [('id1', 'bytes=1000-')]
+
+    # partial file already complete
+    http_server.requests.clear()
+    with open(part_path, 'wb') as fp:
+        fp.write(content)
+    result = gdrive_utils.download_gdrive_public_file('id1', output_path, url=http_server.url)
+    assert result == expected_result
+    assert http_server.requests == [('id1', 'bytes=%s-' % len(content))]
+
+    # retries after server errors and truncated responses, resuming the data received
+    http_server.requests.clear()
+    http_server.failures['id1'] = [503, 'truncate', 500]
+    result = gdrive_utils.download_gdrive_public_file(
+        'id1', output_path, url=http_server.url, backoff=0)
+    assert result == expected_result
+    assert http_server.requests[:2] == [('id1', None), ('id1', None)]
+    # the download resumes from the data received before the truncation
+    resume_ranges = [range_header for file_id, range_header in http_server.requests[2:]]
+    assert len(resume_ranges) == 2 and resume_ranges[0] == resume_ranges[1]
+    assert 0 < int(resume_ranges[0][6:-1]) <= len(content) // 2
+
+    # a range request answered with a different range: the download restarts
+    http_server.requests.clear()
+    with open(part_path, 'wb') as fp:
+        fp.write(content[:1000])
+    http_server.failures['id1'] = ['misaligned']
+    result = gdrive_utils.download_gdrive_public_file('id1', output_path, url=http_server.url)
+    assert result == expected_result
+    assert http_server.requests == [('id1', 'bytes=1000-'), ('id1', None)]
+
+    # partial file in another folder
+    http_server.requests.clear()
+    partial_folder = str(tmpdir.mkdir('partials'))
+    with open(join(partial_folder, 'file1.gz' + gdrive_utils.PARTIAL_SUFFIX), 'wb') as fp:
+        fp.write(content[:1000])
+    result = gdrive_utils.download_gdrive_public_file(
+        'id1', output_path, url=http_server.url, partial_folder=partial_folder)
+    assert result == expected_result
+    assert http_server.requests == [('id1', 'bytes=1000-')]
+    assert listdir(partial_folder) == []
+
+    # too many failures
+    http_server.failures['id1'] = [503, 503]
+    with pytest.raises(requests.HTTPError):
+        gdrive_utils.download_gdrive_public_file(
+            'id1', output_path, url=http_server.url, max_retries=1, backoff=0)
+
+    # client errors are not retried
+    http_server.requests.clear()
+    with pytest.raises(requests.HTTPError):
+        gdrive_utils.download_gdrive_public_file(
+            'not_existing', str(tmpdir.join('file2.gz')), url=http_server.url, backoff=0)
+    assert http_server.requests == [('not_existing', None)]
+
+
+def test_download_gdrive_public_files(tmpdir, http_server):
+    downloads = []
+    for i in range(6):
+        http_server.files['id%s' % i] = b'content of file %d' % i * 1000
+        downloads.append(('id%s' % i, str(tmpdir.join('file%s.gz' % i))))
+    downloads.append(('not_existing', str(tmpdir.join('file6.gz'))))
+    http_server.failures['id3'] = [503]
+    results = list(gdrive_utils.download_gdrive_public_files(
+        downloads, workers=3, url=http_server.url, backoff=0))
+    assert sorted(r[:2] for r in results) == sorted(downloads)
+    for file_id, output_path, result in results:
+        if file_id == 'not_existing':
+            assert isinstance(result, requests.HTTPError)
+            assert not exists(output_path)
+            continue
+        content = http_server.files[file_id]
+        assert result == (len(content), hashlib.sha256(content).hexdigest())
+        with open(output_path, 'rb') as fp:
+            assert fp.read() == content
+
+
+def test_manifest(tmpdir):
+    folder = str(tmpdir)
+    manifest_path = join(folder, 'manifest.json')
+    assert gdrive_utils.load_manifest(manifest_path) == {}
+    with open(join(folder, 'file1.json.gz'), 'wb') as fp:
+        fp.write(b'12345')
+    with open(join(folder, 'file2.json'), 'wb') as fp:
+        fp.write(b'1234567890')
+    manifest = {
+        'file1.json.gz': {'file_id': 'id1', 'size': 5,
+                          'sha256': hashlib.sha256(b'12345').hexdigest(),
+                          'saved_as': 'file1.json.gz'},
+        'file2.json.gz': {'file_id': 'id2', 'size': 5, 'sha256': 'yy', 'saved_as': 'file2.json'},
+        'file3.json.gz': {'file_id': 'id3', 'size': 5, 'sha256': 'zz',
+                          'saved_as': 'file3.json.gz'},
+    }
+    gdrive_utils.save_manifest(manifest_path, manifest)
+    assert gdrive_utils.load_manifest(manifest_path) == manifest
+    assert not exists(manifest_path + gdrive_utils.PARTIAL_SUFFIX)
+
+    assert gdrive_utils.is_downloaded(manifest, folder, 'file1.json.gz', 'id1')
+    # extracted
+    assert gdrive_utils.is_downloaded(manifest, folder, 'file2.json.gz', 'id2')
+    # different file id
+    assert not gdrive_utils.is_downloaded(manifest, folder, 'file1.json.gz', 'id2')
+    # removed from disk
+    assert not gdrive_utils.is_downloaded(manifest, folder, 'file3.json.gz', 'id3')
+    # not in the manifest
+    assert not gdrive_utils.is_downloaded(manifest, folder, 'file4.json.gz', 'id4')
+    # same size but different content
+    with open(join(folder, 'file1.json.gz'), 'wb') as fp:
+        fp.write(b'12346')
+    assert not gdrive_utils.is_downloaded(manifest, folder, 'file1.json.gz', 'id1')
+    # different size
+    manifest['file1.json.gz']['size'] = 4
+    assert not gdrive_utils.is_downloaded(manifest, folder, 'file1.json.gz', 'id1')
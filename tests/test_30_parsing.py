@@ -1,8 +1,9 @@
 
+import gzip
 from os.path import join
 
 from sciafeed import arpa19, arpa21, arpaer, arpafvg, bolzano, hiscentral, noaa, rmn, trentino
-from sciafeed import parsing
+from sciafeed import batch, parsing
 
 from . import TEST_DATA_PATH
 
@@ -44,6 +45,12 @@ def test_guess_format(tmpdir):
     test_filepath = join(TEST_DATA_PATH, 'trentino', 'T0001.csv')
     label, module = parsing.guess_format(test_filepath)
     assert label, module == (trentino.FORMAT_LABEL, trentino)
+    # arpaer gzipped
+    test_filepath = str(tmpdir.join('results.json.gz'))
+    with open(join(TEST_DATA_PATH, 'arpaer', 'results.json'), 'rb') as f_in:
+        with gzip.open(test_filepath, 'wb') as f_out:
+            f_out.write(f_in.read())
+    assert parsing.guess_format(test_filepath) == (arpaer.FORMAT_LABEL, arpaer)
     # unknown
     test_filepath = str(tmpdir.join('loc01_00001_2018010101_2019010101.dat'))
     with open(test_filepath, 'w') as fp:
@@ -51,6 +58,79 @@ def test_guess_format(tmpdir):
     label, module = parsing.guess_format(test_filepath)
     assert label, module == ('Unknown', None)
 
+    # cache: a change of the file is detected by the modification time and size
+    parsing.GUESS_FORMAT_CACHE.clear()
+    test_filepath = str(tmpdir.join('160080-99999-2019.op'))
+    with open(test_filepath, 'w') as fp:
+        fp.write("Hello, I'm an unknown format")
+    assert parsing.guess_format(test_filepath) == ('Unknown', None)
+    assert len(parsing.GUESS_FORMAT_CACHE) == 1
+    assert parsing.guess_format(test_filepath) == ('Unknown', None)
+    with open(join(TEST_DATA_PATH, 'noaa', '160080-99999-2019.op')) as fp:
+        noaa_content = fp.read()
+    with open(test_filepath, 'w') as fp:
+        fp.write(noaa_content)
+    assert parsing.guess_format(test_filepath) == (noaa.FORMAT_LABEL, noaa)
+    assert len(parsing.GUESS_FORMAT_CACHE) == 2
+    assert parsing.guess_format(test_filepath, use_cache=False) == (noaa.FORMAT_LABEL, noaa)
+
+
+def test_compile_signature():
+    extensions, filename_pattern, head_pattern = parsing.compile_signature({})
+    assert (extensions, filename_pattern, head_pattern) == (None, None, None)
+    signature = {'extensions': ('.CSV', '.txt'), 'filename_pattern': r'^a.*-',
+                 'head_pattern': rb'\AHEAD'}
+    extensions, filename_pattern, head_pattern = parsing.compile_signature(signature)
+    assert extensions == {'.csv', '.txt'}
+    assert filename_pattern.search('A_file-1.csv')
+    assert not filename_pattern.search('b_file-1.csv')
+    assert head_pattern.search(b'HEAD;A;B')
+    assert not head_pattern.search(b' HEAD;A;B')
+
+
+def test_candidate_formats(tmpdir):
+    # the file names restrict the candidates, without reading the files
+    test_filepath = join(TEST_DATA_PATH, 'arpa19', 'loc01_70001_201301010000_201401010100.dat')
+    assert parsing.candidate_formats(test_filepath) == [
+        arpa19.FORMAT_LABEL, arpa21.FORMAT_LABEL, arpafvg.FORMAT_LABEL, rmn.FORMAT_LABEL]
+    test_filepath = join(TEST_DATA_PATH, 'arpaer', 'results.json')
+    assert parsing.candidate_formats(test_filepath) == [arpaer.FORMAT_LABEL, rmn.FORMAT_LABEL]
+    test_filepath = join(TEST_DATA_PATH, 'hiscentral', 'serie_990-reg.abruzzoTmax.csv')
+    assert parsing.candidate_formats(test_filepath) == [
+        hiscentral.FORMAT_LABEL, rmn.FORMAT_LABEL, trentino.FORMAT_LABEL]
+    test_filepath = join(TEST_DATA_PATH, 'trentino', 'T0001.csv')
+    assert parsing.candidate_formats(test_filepath) == [
+        rmn.FORMAT_LABEL, trentino.FORMAT_LABEL]
+    # the first bytes restrict the candidates
+    test_filepath = join(TEST_DATA_PATH, 'noaa', '160080-99999-2019.op')
+    assert parsing.candidate_formats(test_filepath) == [noaa.FORMAT_LABEL, rmn.FORMAT_LABEL]
+    test_filepath = join(TEST_DATA_PATH, 'bolzano', 'MonteMaria.xls')
+    assert parsing.candidate_formats(test_filepath) == [bolzano.FORMAT_LABEL, rmn.FORMAT_LABEL]
+    test_filepath = str(tmpdir.join('160080-99999-2019.op'))
+    with open(test_filepath, 'w') as fp:
+        fp.write("Hello, I'm an unknown format")
+    assert parsing.candidate_formats(test_filepath) == [rmn.FORMAT_LABEL]
+    test_filepath = str(tmpdir.join('MonteMaria.xls'))
+    with open(test_filepath, 'w') as fp:
+        fp.write("Hello, I'm an unknown format")
+    assert parsing.candidate_formats(test_filepath) == [rmn.FORMAT_LABEL]
+
+
+def test_warm_up_parameters(mocker):
+    load_spy = mocker.spy(parsing.utils, 'load_parameters')
+    parsing.warm_up_parameters()
+    assert load_spy.call_count == 2 * len(parsing.FORMATS)
+    parameters_map = trentino.load_parameter_file()
+    cached_map = parsing.utils.load_parameters(
+        trentino.load_parameter_file, trentino.PARAMETERS_FILEPATH)
+    assert cached_map.keys() == parameters_map.keys()
+
+    # a parameters file not valid for some formats
+    load_spy.reset_mock()
+    parameters_filepath = join(TEST_DATA_PATH, 'trentino', 'trentino_params.csv')
+    parsing.warm_up_parameters(parameters_filepath)
+    assert load_spy.call_count == 2 * len(parsing.FORMATS)
+
 
 def test_validate_format():
     tests_paths = {
@@ -141,3 +221,36 @@ def test_parse():
     test_filepath = join(TEST_DATA_PATH, 'trentino', 'T0001.csv')
     data, found_errors = parsing.parse(test_filepath)
     assert data, found_errors == trentino.parse(test_filepath)
+
+
+def test_iter_parse():
+    # arpa19
+    test_filepath = join(TEST_DATA_PATH, 'arpa19', 'wrong_70001_201301010000_201401010100.dat')
+    found_errors = []
+    measures = parsing.iter_parse(test_filepath, found_errors=found_errors)
+    assert not isinstance(measures, list)
+    data = list(measures)
+    assert (data, found_errors) == arpa19.parse(test_filepath)
+    # trentino
+    test_filepath = join(TEST_DATA_PATH, 'trentino', 'T0001.csv')
+    found_errors = []
+    data = list(parsing.iter_parse(test_filepath, found_errors=found_errors))
+    assert (data, found_errors) == trentino.parse(test_filepath)
+    # guessing impossible
+    test_filepath = join(TEST_DATA_PATH, 'arpa19', 'arpa19_params.csv')
+    found_errors = []
+    data = list(parsing.iter_parse(test_filepath, found_errors=found_errors))
+    assert not data
+    assert found_errors == [(0, "file %r has unknown format" % test_filepath)]
+
+
+def test_parse_batch():
+    test_filepath = join(TEST_DATA_PATH, 'arpa19', 'wrong_70001_201301010000_201401010100.dat')
+    measure_batch, found_errors = parsing.parse_batch(test_filepath)
+    assert isinstance(measure_batch, batch.MeasureBatch)
+    assert (list(measure_batch), found_errors) == arpa19.parse(test_filepath)
+    # guessing impossible
+    test_filepath = join(TEST_DATA_PATH, 'arpa19', 'arpa19_params.csv')
+    measure_batch, found_errors = parsing.parse_batch(test_filepath)
+    assert len(measure_batch) == 0
+    assert found_errors == [(0, "file %r has unknown format" % test_filepath)]
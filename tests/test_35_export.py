@@ -2,7 +2,7 @@
 from datetime import datetime, date
 from os.path import exists
 
-from sciafeed import export
+from sciafeed import batch, export
 
 
 def test_export2csv(tmpdir):
@@ -30,6 +30,14 @@ def test_export2csv(tmpdir):
         rows = fp.readlines()
         assert rows == expected_rows
 
+    # columnar data
+    out_filepath2 = str(tmpdir.join('datafile_batch.csv'))
+    measure_batch = batch.MeasureBatch.from_measures(data)
+    export.export2csv(measure_batch, out_filepath2, omit_parameters=('5', '6', '12'))
+    with open(out_filepath2) as fp:
+        rows = fp.readlines()
+        assert rows == expected_rows
+
     expected_rows = [
         'cod_utente;cod_rete;date;time;parameter;value;valid;source;format;lat;lon\n',
         '70001;;2013-01-01;00:00:00;1;9.0;1;afile/path;arpa19;43.876999;\n',
@@ -69,6 +77,14 @@ def test_export2csv(tmpdir):
         rows = fp.readlines()
         assert rows == expected_rows
 
+    # streaming of already sorted data
+    out_filepath = str(tmpdir.join('datafile3.csv'))
+    sorted_data = (m for m in sorted(data, key=lambda m: m[1]))
+    export.export2csv(sorted_data, out_filepath, omit_missing=False, presorted=True)
+    with open(out_filepath) as fp:
+        rows = fp.readlines()
+        assert rows == expected_rows
+
 
 def test_csv2data(tmpdir):
     metadata = {'cod_utente': '70001', 'cod_rete': '11', 'source': 'afile/path', 'format':'arpa19',
@@ -86,3 +102,95 @@ def test_csv2data(tmpdir):
 
     imported_data = export.csv2data(csv_filepath)
     assert imported_data == data
+
+
+def test_export2npz(tmpdir):
+    metadata = {'cod_utente': '70001', 'lat': 43.876999, 'source': 'afile/path', 'format':'arpa19'}
+    metadata2 = {'cod_utente_prefix': 'X', 'cod_utente': '1', 'cod_rete': '2', 'lat': None,
+                 'row': 3}
+    data = [
+        [metadata, datetime(2013, 1, 1, 0, 0), '1', 9.04, True],
+        [metadata, datetime(2014, 1, 1, 0, 0), '2', 355.0, False],
+        [metadata2, datetime(2013, 2, 1, 0, 0), '3', 68.0, True],
+        [metadata, datetime(2013, 1, 2, 0, 0), '4', None, True],
+        [metadata2, datetime(2013, 1, 1, 3, 0), '5', None, False],
+        [metadata, datetime(2013, 1, 1, 0, 4, 0, 5), '6', 22.25, False],
+    ]
+    csv_filepath = str(tmpdir.join('datafile.csv'))
+    npz_filepath = str(tmpdir.join('datafile.npz'))
+    for kwargs in [dict(), dict(omit_missing=False), dict(omit_parameters=('5', '6'))]:
+        export.export2csv(data, csv_filepath, **kwargs)
+        export.export2npz(data, npz_filepath, **kwargs)
+        expected_data = export.csv2data(csv_filepath)
+        assert export.npz2data(npz_filepath) == expected_data
+        # columnar data
+        export.export2npz(batch.MeasureBatch.from_measures(data), npz_filepath, **kwargs)
+        assert export.npz2data(npz_filepath) == expected_data
+    measure_batch = export.npz2batch(npz_filepath)
+    assert measure_batch.stations == [
+        {'cod_utente': '70001', 'cod_rete': '', 'source': 'afile/path', 'format': 'arpa19',
+         'lat': '43.876999', 'lon': ''},
+        {'cod_utente': 'X1', 'cod_rete': '2', 'source': '', 'format': '', 'lat': '', 'lon': ''},
+    ]
+
+    # dates
+    data = [
+        [metadata, date(2013, 1, 2), '1', 9.0, True],
+        [metadata, date(2013, 1, 1), '2', 355.0, False],
+    ]
+    export.export2csv(data, csv_filepath)
+    export.export2npz(data, npz_filepath)
+    assert export.npz2data(npz_filepath) == export.csv2data(csv_filepath)
+
+    # no data
+    export.export2npz([], npz_filepath)
+    assert export.npz2data(npz_filepath) == []
+
+
+def test_load_data(tmpdir):
+    metadata = {'cod_utente': '70001', 'cod_rete': '11', 'source': 'afile/path', 'format':'arpa19',
+                'lat': '', 'lon': ''}
+    data = [
+        (metadata, datetime(2013, 1, 1, 0, 0), '1', 9.0, True),
+        (metadata, datetime(2013, 1, 1, 1, 0), '2', 355.0, False),
+    ]
+    for filename in ['datafile.csv', 'datafile.NPZ']:
+        filepath = str(tmpdir.join(filename))
+        export.export_data(data, filepath)
+        assert export.load_data(filepath) == data
+    with open(str(tmpdir.join('datafile.NPZ')), 'rb') as fp:
+        assert fp.read(2) == b'PK'
+
+
+def test_load_stations(tmpdir):
+    metadata = {'cod_utente': '70001', 'lat': 43.876999, 'source': 'afile/path', 'format':'arpa19'}
+    metadata2 = {'cod_utente_prefix': 'X', 'cod_utente': '1', 'cod_rete': '2', 'lat': None,
+                 'source': 'a "quoted;" source'}
+    data = [
+        [metadata, datetime(2013, 1, 1, 0, 0), '1', 9.04, True],
+        [metadata, datetime(2014, 1, 1, 0, 0), '2', 355.0, False],
+        [metadata2, datetime(2013, 1, 1, 3, 0), '5', 3, False],
+        [metadata, datetime(2013, 1, 2, 0, 0), '4', None, True],
+    ]
+    expected_stations = [
+        {'cod_utente': '70001', 'cod_rete': '', 'source': 'afile/path', 'format': 'arpa19',
+         'lat': '43.876999', 'lon': ''},
+        {'cod_utente': 'X1', 'cod_rete': '2', 'source': 'a "quoted;" source', 'format': '',
+         'lat': '', 'lon': ''},
+    ]
+    for filename in ['datafile.csv', 'datafile.npz']:
+        filepath = str(tmpdir.join(filename))
+        # quoted fields
+        export.export_data(data, filepath)
+        assert export.load_stations(filepath) == (3, expected_stations)
+        # only simple fields
+        export.export_data(data[:2] + data[3:], filepath, omit_missing=False)
+        assert export.load_stations(filepath) == (3, expected_stations[:1])
+        # same metadata of `csv2data`
+        records = export.load_data(filepath)
+        assert [records[0][0]] == expected_stations[:1]
+        # no data
+        export.export_data([], filepath)
+        assert export.load_stations(filepath) == (0, [])
+    open(str(tmpdir.join('empty.csv')), 'w').close()
+    assert export.csv2stations(str(tmpdir.join('empty.csv'))) == (0, [])
@@ -1,11 +1,15 @@
 
 from datetime import datetime
 from decimal import Decimal
+from os import listdir
 from os.path import join
 
-from sqlalchemy import MetaData, Table
+import numpy as np
+import pytest
+from sqlalchemy import Column, create_engine, Float, Integer, MetaData, String, Table
 
 from sciafeed import db_utils
+from sciafeed import export
 from sciafeed import querying
 from . import TEST_DATA_PATH
 
@@ -47,6 +51,174 @@ def test_get_db_station(conn):
     assert station.nome == 'Carloforte'
 
 
+def sqlite_anag_table(stations):
+    # in-memory table of stations, of (id_staz, nome, cod_utente, cod_rete, lat, lon)
+    engine = create_engine('sqlite:///:memory:')
+    conn = engine.connect()
+    conn.execute("ATTACH DATABASE ':memory:' AS dailypdbadmclima")
+    meta = MetaData()
+    anag_table = Table(
+        'anag__stazioni', meta,
+        Column('id_staz', Integer, primary_key=True), Column('nome', String),
+        Column('cod_utente', String), Column('cod_rete', Integer), Column('lat', Float),
+        Column('lon', Float), Column('note', String), schema='dailypdbadmclima')
+    meta.create_all(conn)
+    conn.execute(anag_table.insert(), [
+        dict(zip(['id_staz', 'nome', 'cod_utente', 'cod_rete', 'lat', 'lon'], station))
+        for station in stations])
+    return conn, anag_table
+
+
+def test_station_index():
+    stations = [
+        (1, 'Carloforte', '00001', 14, 39.14, 8.31),
+        (2, 'Corniolo', '00002', 20, 43.90708, 11.79314),
+        (3, 'Corniolo', '00003', 20, 44.1, 11.8),
+        (4, 'Bologna', '00002', 14, None, None),
+        (5, None, None, 20, None, None),
+    ]
+    conn, anag_table = sqlite_anag_table(stations)
+    station_index = querying.StationIndex(conn, anag_table)
+    assert len(station_index) == 5
+    queries = [
+        {'id_staz': 1},
+        {'id_staz': '2'},
+        {'cod_utente': '00002', 'cod_rete': 20},
+        {'cod_utente': '00002', 'cod_rete': '14'},
+        {'cod_utente': '00002', 'cod_rete': '14', 'lat': None},
+        {'cod_utente': '2', 'cod_rete': 20},
+        {'cod_rete': 20},
+        {'cod_rete': 1220},
+        {'cod_rete': 14, 'nome': 'carlo'},
+        {'cod_rete': 14, 'nome': 'carloforte'},
+        {'cod_rete': '20', 'nome': 'CORNIOLO'},
+        {'cod_rete': '20', 'nome': 'corniolo', 'lat': '43.90708', 'lon': '11.79314'},
+        {'cod_rete': '20', 'nome': 'corniolo', 'lat': '43.9'},
+        {'cod_rete': 'xx', 'cod_utente': '00002'},
+        {'nome': 'bologna'},
+    ]
+    for query in queries:
+        expected = querying.get_db_station(conn, anag_table, **query)
+        station = station_index.get(**query)
+        assert bool(station) == bool(expected), query
+        if station:
+            assert station.id_staz == expected.id_staz
+    assert station_index.get(cod_rete=14, nome='carloforte').id_staz == 1
+    assert station_index.get(cod_rete='20', nome='corniolo', lat='43.90708').id_staz == 2
+    with pytest.raises(ValueError):
+        station_index.get(note='a note')
+
+    # only the stations of the selected networks
+    station_index = querying.StationIndex(conn, anag_table, cod_reti=[20])
+    assert len(station_index) == 3
+    assert not station_index.get(cod_utente='00001', cod_rete=14)
+
+    # refresh
+    conn.execute(anag_table.insert().values(id_staz=6, nome='Zocca', cod_utente='00006',
+                                            cod_rete=20))
+    assert not station_index.get(cod_utente='00006', cod_rete=20)
+    station_index.refresh()
+    assert len(station_index) == 4
+    assert station_index.get(cod_utente='00006', cod_rete=20).id_staz == 6
+    conn.close()
+
+
+def test_haversine_distances():
+    distances = querying.haversine_distances(
+        44.5, 11.3, np.array([44.5, 45.5, 44.5, -44.5]), np.array([11.3, 11.3, 12.3, -168.7]))
+    assert distances[0] == 0
+    assert round(distances[1]) == round(np.radians(1) * querying.EARTH_RADIUS)
+    assert 78000 < distances[2] < 80000
+    assert round(distances[3]) == round(np.pi * querying.EARTH_RADIUS)
+
+
+def test_station_index_spatial():
+    rnd = np.random.RandomState(1)
+    stations = []
+    for i in range(300):
+        lat, lon = rnd.uniform(43.8, 44.2), (rnd.uniform(179.8, 180.2) + 180) % 360 - 180
+        stations.append((i, 'Station%s' % i, '%05d' % i, 20 + i % 2, lat, lon))
+    stations.append((300, 'Station0', '00300', 20, None, None))
+    stations.append((301, 'Station1', '00301', 21, 43.9, 11.8))
+    # a station without network
+    stations.append((302, 'Station302', '00302', None, 44.01, 179.99))
+    conn, anag_table = sqlite_anag_table(stations)
+    station_index = querying.StationIndex(conn, anag_table, cell_size=0.05)
+    located = [s for s in stations if s[4] is not None]
+    lats = np.array([s[4] for s in located])
+    lons = np.array([s[5] for s in located])
+    for lat, lon, radius, cod_rete in [(44, 180, 5000, None), (44, -179.95, 10000, '20'),
+                                       (43.85, 179.9, 3000, 21), (44.1, 0, 1000, None)]:
+        distances = querying.haversine_distances(lat, lon, lats, lons)
+        expected = sorted(
+            (d, s[0]) for d, s in zip(distances, located)
+            if d <= radius and (cod_rete is None or s[3] == int(cod_rete)))
+        results = station_index.within(lat, lon, radius, cod_rete=cod_rete)
+        # each station is found once
+        assert len({s.id_staz for d, s in results}) == len(results)
+        assert [(d, s.id_staz) for d, s in results] == expected
+        nearest = station_index.nearest(lat, lon, k=5, cod_rete=cod_rete)
+        expected = sorted(
+            (d, s[0]) for d, s in zip(distances, located)
+            if cod_rete is None or s[3] == int(cod_rete))[:5]
+        assert [(d, s.id_staz) for d, s in nearest] == expected
+    results = station_index.within(44.01, 179.99, 1)
+    assert [s.id_staz for d, s in results] == [302]
+    assert station_index.nearest(44.01, 179.99)[0][1].id_staz == 302
+    assert 302 not in [s.id_staz for d, s in station_index.within(44.01, 179.99, 10000, 20)]
+
+    # nearest with the same name
+    station = station_index.get_nearest(43.9, 11.8, 1000, cod_rete=21, nome='station1')
+    assert station.id_staz == 301
+    assert not station_index.get_nearest(43.9, 11.8, 1000, cod_rete=20, nome='station1')
+    assert not station_index.get_nearest(43.9, 11.81, 100, cod_rete=21, nome='station1')
+
+    # resolution of the stations of the measures
+    metadata = {'cod_utente': 'Station1', 'cod_rete': '21', 'lat': '43.9', 'lon': '11.8',
+                'format': 'RMN'}
+    station_props, station = querying.resolve_station(station_index, metadata)
+    assert station_props == {'cod_rete': '21', 'nome': 'Station1', 'lat': '43.9', 'lon': '11.8'}
+    assert station.id_staz == 301
+    metadata['lat'] = '43.9001'
+    assert not querying.resolve_station(station_index, metadata)[1]
+    assert querying.resolve_station(station_index, metadata, radius=50)[1].id_staz == 301
+    metadata = {'cod_utente': '00002', 'cod_rete': '20', 'lat': '43.9', 'lon': '11.8',
+                'format': 'ARPA19'}
+    station_props, station = querying.resolve_station(station_index, metadata, radius=50)
+    assert station_props == {'cod_rete': '20', 'cod_utente': '00002'}
+    assert station.id_staz == 2
+
+    # log on ER stations
+    messages = querying.get_er_station(
+        station_index, cod_utente='STATION1', cod_rete='21', lat='43.9', lon='11.8')
+    assert messages == [
+        "found 1 stations near this (radius 1000): [301]",
+        "found 2 stations with the same name (case insensitive): [1, 301]",
+        "no found any station with the same exact name (case sensitive)",
+    ]
+    messages = querying.get_er_station(
+        station_index, cod_utente='Station1', cod_rete='21', lat='43.9', lon='11.8')
+    assert messages[2:] == [
+        "found 2 stations with the same exact name (case sensitive): [1, 301]",
+        "(the station should be identified as id_staz 301)",
+    ]
+    conn.close()
+
+
+def test_iter_data_stations(tmpdir):
+    data_folder = join(TEST_DATA_PATH, 'indicators', 'input')
+    data_paths = [join(data_folder, file_name) for file_name in sorted(listdir(data_folder))]
+    data_paths.append(str(tmpdir))
+    expected = []
+    for data_path in data_paths[:-1]:
+        data = export.csv2data(data_path)
+        stations = list({tuple(sorted(record[0].items())): None for record in data})
+        expected.append((data_path, (len(data), [dict(station) for station in stations])))
+    expected.append((str(tmpdir), None))
+    assert list(querying.iter_data_stations(data_paths)) == expected
+    assert list(querying.iter_data_stations(data_paths, workers=2)) == expected
+
+
 def test_find_new_stations():
     dburi = db_utils.DEFAULT_DB_URI
     data_folder = join(TEST_DATA_PATH, 'indicators', 'input')
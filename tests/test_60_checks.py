@@ -4,6 +4,9 @@ from decimal import Decimal
 import math
 import operator
 
+import pytest
+
+from sciafeed import batch
 from sciafeed import checks
 
 
@@ -16,6 +19,30 @@ def set_row_index(input_data):
     return new_input_data
 
 
+def test_iter_data_internal_consistence_check():
+    metadata = {'cod_utente': '70001', 'lat': 43.876999, 'cod_rete': '15'}
+    input_data = [
+        (metadata, datetime(2013, 1, 1, 0, 0), '1', 9.0, True),
+        (metadata, datetime(2013, 1, 1, 0, 0), '2', 355.0, True),
+        (metadata, datetime(2013, 1, 1, 0, 0), '3', 68.0, True),
+        (metadata, datetime(2013, 1, 1, 1, 0), '1', 9.0, True),
+        (metadata, datetime(2013, 1, 1, 1, 0), '2', 5.0, True),
+        (metadata, datetime(2013, 1, 1, 1, 0), '3', 68.0, True),
+    ]
+    input_data = set_row_index(input_data)
+    limiting_params = {'3': ('1', '2')}
+    err_msgs = []
+    measures = checks.iter_data_internal_consistence_check(
+        iter(input_data), limiting_params, err_msgs=err_msgs)
+    assert not isinstance(measures, list)
+    out_data = list(measures)
+    assert err_msgs == [(6, "The values of '3' and '2' are not consistent")]
+    assert out_data == input_data[:5] + [input_data[5][:4] + (False,)]
+    # same result of the not streaming version
+    assert (err_msgs, out_data) == checks.data_internal_consistence_check(
+        input_data, limiting_params)
+
+
 def test_data_internal_consistence_check():
     # right data
     metadata = {'cod_utente': '70001', 'lat': 43.876999, 'cod_rete': '15'}
@@ -426,6 +453,127 @@ def test_data_internal_consistence_check():
     assert out_data == input_data
 
 
+def test_batch_data_internal_consistence_check():
+    metadata1 = {'cod_utente': '70001', 'lat': 43.876999, 'cod_rete': '15'}
+    metadata2 = {'cod_utente': '70002', 'lat': 43.8, 'cod_rete': '15'}
+    input_data = []
+    for metadata in (metadata1, metadata2):
+        for hour, (tmin, tmed, tmax) in enumerate([
+                (1, 2, 3), (3, 2, 1), (5, 4, 3), (None, 4, 3), (1, 2, None), (1, None, 3)]):
+            row_date = datetime(2013, 1, 1, hour, 0)
+            input_data.extend([
+                (metadata, row_date, 'Tmin', tmin, tmin is not None),
+                (metadata, row_date, 'Tmedia', tmed, tmed is not None),
+                (metadata, row_date, 'Tmax', tmax, True),
+            ])
+    input_data = set_row_index(input_data)
+    limiting_params = {'Tmedia': ('Tmin', 'Tmax'), 'Tmin': ('Tmin', 'Tmax')}
+    measure_batch = batch.MeasureBatch.from_measures(input_data)
+    err_msgs, out_batch = checks.data_internal_consistence_check(measure_batch, limiting_params)
+    assert isinstance(out_batch, batch.MeasureBatch)
+    assert err_msgs == [
+        (4, "The values of 'Tmin' and 'Tmax' are not consistent"),
+        (5, "The values of 'Tmedia' and 'Tmin' are not consistent"),
+        (5, "The values of 'Tmedia' and 'Tmax' are not consistent"),
+        (7, "The values of 'Tmin' and 'Tmax' are not consistent"),
+        (8, "The values of 'Tmedia' and 'Tmin' are not consistent"),
+        (8, "The values of 'Tmedia' and 'Tmax' are not consistent"),
+        (11, "The values of 'Tmedia' and 'Tmax' are not consistent"),
+        (22, "The values of 'Tmin' and 'Tmax' are not consistent"),
+        (23, "The values of 'Tmedia' and 'Tmin' are not consistent"),
+        (23, "The values of 'Tmedia' and 'Tmax' are not consistent"),
+        (25, "The values of 'Tmin' and 'Tmax' are not consistent"),
+        (26, "The values of 'Tmedia' and 'Tmin' are not consistent"),
+        (26, "The values of 'Tmedia' and 'Tmax' are not consistent"),
+        (29, "The values of 'Tmedia' and 'Tmax' are not consistent"),
+    ]
+    # same result of the not vectorized version
+    exp_err_msgs, exp_data = checks.data_internal_consistence_check(input_data, limiting_params)
+    assert sorted(err_msgs) == sorted(exp_err_msgs)
+    assert sorted(out_batch, key=lambda m: (m[0]['row'], m[2])) \
+        == sorted(exp_data, key=lambda m: (m[0]['row'], m[2]))
+
+    # missing limiting parameters: KeyError as the not vectorized version
+    for data in (measure_batch, input_data):
+        with pytest.raises(KeyError):
+            checks.data_internal_consistence_check(
+                data, {'Tmin': ('NotExisting', 'NotExisting2')})
+
+    # no limiting parameters: no check
+    err_msgs, out_batch = checks.data_internal_consistence_check(measure_batch)
+    assert not err_msgs
+    assert list(out_batch) == input_data
+
+    # duplicated parameters for the same station and date: the last occurrence wins
+    row_date = datetime(2013, 1, 1, 0, 0)
+    input_data = set_row_index([
+        (metadata1, row_date, 'Tmin', 5, True),
+        (metadata1, row_date, 'Tmedia', 2, True),
+        (metadata1, row_date, 'Tmax', 3, True),
+        (metadata1, row_date, 'Tmin', 1, True),
+        (metadata1, row_date, 'Tmedia', 4, True),
+    ])
+    measure_batch = batch.MeasureBatch.from_measures(input_data)
+    err_msgs, out_batch = checks.data_internal_consistence_check(measure_batch, limiting_params)
+    assert err_msgs == [(5, "The values of 'Tmedia' and 'Tmax' are not consistent")]
+    assert list(out_batch) == [input_data[2], input_data[3], input_data[4][:4] + (False,)]
+    exp_err_msgs, exp_data = checks.data_internal_consistence_check(input_data, limiting_params)
+    assert err_msgs == exp_err_msgs
+    assert sorted(out_batch, key=lambda m: m[0]['row']) \
+        == sorted(exp_data, key=lambda m: m[0]['row'])
+
+
+def test_iter_data_weak_climatologic_check():
+    parameters_thresholds = {'1': [0.0, 1020.0], '2': [0.0, 360.0]}
+    metadata = {'lat': 43.876999}
+    input_data = [
+        (metadata, datetime(2013, 1, 1, 0, 0), '1', 1030.0, True),
+        (metadata, datetime(2013, 1, 1, 0, 0), '2', 355.0, True),
+        (metadata, datetime(2013, 1, 1, 1, 0), '1', 1000.0, True),
+        (metadata, datetime(2013, 1, 1, 1, 0), '2', 365.0, False),
+    ]
+    input_data = set_row_index(input_data)
+    err_msgs = []
+    measures = checks.iter_data_weak_climatologic_check(
+        iter(input_data), parameters_thresholds, err_msgs=err_msgs)
+    assert not isinstance(measures, list)
+    out_data = list(measures)
+    assert err_msgs == [(1, "The value of '1' is out of range [0.0, 1020.0]")]
+    assert out_data == [input_data[0][:4] + (False,)] + input_data[1:]
+    # same result of the not streaming version
+    assert (err_msgs, out_data) == checks.data_weak_climatologic_check(
+        input_data, parameters_thresholds)
+
+
+def test_batch_data_weak_climatologic_check():
+    parameters_thresholds = {'1': [0.0, 1020.0], '2': [0.0, 360.0], '3': [-10.0, 10.0]}
+    metadata = {'lat': 43.876999}
+    input_data = [
+        (metadata, datetime(2013, 1, 1, 0, 0), '1', 1030.0, True),
+        (metadata, datetime(2013, 1, 1, 0, 0), '2', 355.0, True),
+        (metadata, datetime(2013, 1, 1, 0, 0), '4', 355.0, True),
+        (metadata, datetime(2013, 1, 1, 1, 0), '1', 1000.0, True),
+        (metadata, datetime(2013, 1, 1, 1, 0), '2', 365.0, False),
+        (metadata, datetime(2013, 1, 1, 1, 0), '2', None, True),
+        (metadata, datetime(2013, 1, 1, 2, 0), '2', -1, True),
+    ]
+    input_data = set_row_index(input_data)
+    measure_batch = batch.MeasureBatch.from_measures(input_data)
+    err_msgs, out_batch = checks.data_weak_climatologic_check(
+        measure_batch, parameters_thresholds)
+    assert isinstance(out_batch, batch.MeasureBatch)
+    assert (err_msgs, list(out_batch)) == checks.data_weak_climatologic_check(
+        input_data, parameters_thresholds)
+    assert err_msgs == [
+        (1, "The value of '1' is out of range [0.0, 1020.0]"),
+        (7, "The value of '2' is out of range [0.0, 360.0]"),
+    ]
+    # no thresholds: no check
+    err_msgs, out_batch = checks.data_weak_climatologic_check(measure_batch)
+    assert not err_msgs
+    assert list(out_batch) == input_data
+
+
 def test_data_weak_climatologic_check():
     parameters_thresholds = {
         '1': [0.0, 1020.0],
@@ -19,6 +19,21 @@ def create_samples(par_code, hour_step=1):
     return ret_value
 
 
+def test_bucket_by_par_code():
+    prec_records = create_samples('PREC')
+    temp_records = create_samples('Tmedia', hour_step=2)
+    not_valid = [
+        (sample_metadata, datetime(2020, 1, 1, 0, 0), 'PREC', None, True),
+        (sample_metadata, datetime(2020, 1, 1, 1, 0), 'Tmedia', 3, False),
+        (sample_metadata, datetime(2020, 1, 1, 1, 0), 'UR media', 3, False),
+    ]
+    measures = not_valid + [m for pair in zip(prec_records, temp_records) for m in pair] \
+        + prec_records[len(temp_records):]
+    buckets = compute.bucket_by_par_code(iter(measures))
+    assert buckets == {'PREC': prec_records, 'Tmedia': temp_records}
+    assert compute.bucket_by_par_code([]) == {}
+
+
 def test_sum_records_by_hour_groups():
     day_records = create_samples('PREC')
     # step h=1
@@ -101,6 +116,11 @@ def test_wet_distribution():
     day_records = create_samples('PREC')
     res = compute.wet_distribution(day_records)
     assert res == (2, 4, 5, 10, 3, 0)
+    # limits of the classes
+    day_records = [(sample_metadata, None, 'PREC', value, True)
+                   for value in (0, 1, 1.1, 5, 10, 20, 50, 50.1, 200)]
+    res = compute.wet_distribution(day_records)
+    assert res == (2, 2, 1, 1, 1, 2)
 
 
 def test_compute_prec24():
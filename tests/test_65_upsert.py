@@ -164,6 +164,165 @@ def test_create_upsert():
                   "WHERE atable.cod_staz = EXCLUDED.cod_staz AND atable.data_i = EXCLUDED.data_i"
 
 
+def test_field_expression():
+    assert upsert.field_expression('data_i', 't') == 't.data_i'
+    assert upsert.field_expression('prec24.val_tot', 'EXCLUDED') == '(EXCLUDED.prec24).val_tot'
+    assert upsert.field_expression('prec24.flag.wht', 't') == '((t.prec24).flag).wht'
+
+
+def test_create_copy_rows():
+    fields = ['col1', 'col2', 'col3']
+    data = [{'col1': 1, 'col2': 'a "b", c'}, {'col2': '', 'col3': None},
+            {'col1': datetime(2020, 1, 2), 'col3': Decimal('3.5')}]
+    assert upsert.create_copy_rows(fields, data) == \
+        '"1","a ""b"", c",\n' \
+        ',"",\n' \
+        '"2020-01-02 00:00:00",,"3.5"\n'
+
+
+def test_copy_upsert(mocker):
+    conn = mocker.MagicMock()
+    conn.in_transaction.return_value = False
+    conn.execute.return_value.rowcount = 3
+    cursor = conn.connection.cursor.return_value
+    copied = []
+    cursor.copy_expert.side_effect = lambda sql, fp: copied.append((sql, fp.read()))
+    mocker.patch.object(upsert, 'COPY_CHUNK_SIZE', 2)
+    fields = ['data_i', 'cod_staz', 'prec24.flag.wht', 'prec24.val_tot']
+    data = [
+        {'data_i': '2020-01-01', 'cod_staz': 1, 'prec24.flag.wht': 1, 'prec24.val_tot': 2.5},
+        {'data_i': '2020-01-02', 'cod_staz': 1, 'prec24.val_tot': 0},
+        {'data_i': '2020-01-03', 'cod_staz': 1},
+    ]
+    for policy in ['onlyinsert', 'upsert', None]:
+        conn.execute.reset_mock()
+        copied.clear()
+        assert upsert.copy_upsert(conn, 'ds__preci', 'aschema', fields, iter(data), policy) == 3
+        sqls = [c[0][0] for c in conn.execute.call_args_list]
+        assert len(sqls) == 4
+        staging_table = sqls[0].split()[3]
+        assert staging_table.startswith('aschema.ds__preci_stage')
+        assert sqls[0] == 'CREATE UNLOGGED TABLE %s AS SELECT t.data_i AS "data_i",' \
+                          't.cod_staz AS "cod_staz",((t.prec24).flag).wht AS "prec24.flag.wht",' \
+                          '(t.prec24).val_tot AS "prec24.val_tot" FROM aschema.ds__preci t ' \
+                          'WITH NO DATA' % staging_table
+        assert sqls[1] == 'ALTER TABLE %s ADD COLUMN stage_row bigserial' % staging_table
+        columns = '"data_i","cod_staz","prec24.flag.wht","prec24.val_tot"'
+        copy_sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (staging_table, columns)
+        assert copied == [
+            (copy_sql, '"2020-01-01","1","1","2.5"\n"2020-01-02","1",,"0"\n'),
+            (copy_sql, '"2020-01-03","1",,\n'),
+        ]
+        insert_sql = 'INSERT INTO aschema.ds__preci ' \
+                     '(data_i,cod_staz,prec24.flag.wht,prec24.val_tot) ' \
+                     'SELECT %s FROM %s' % (columns, staging_table)
+        if policy is not None:
+            # only the last record of each key is inserted
+            insert_sql = 'INSERT INTO aschema.ds__preci ' \
+                         '(data_i,cod_staz,prec24.flag.wht,prec24.val_tot) ' \
+                         'SELECT DISTINCT ON ("cod_staz","data_i") %s FROM %s ' \
+                         'ORDER BY "cod_staz","data_i", stage_row DESC' % (columns, staging_table)
+            insert_sql += upsert.create_conflict_clause('ds__preci', fields, policy)
+        assert sqls[2] == insert_sql
+        assert sqls[3] == 'DROP TABLE IF EXISTS %s' % staging_table
+
+    # nothing to do
+    conn.execute.reset_mock()
+    assert upsert.copy_upsert(conn, 'ds__preci', 'aschema', fields, [], 'upsert') == 0
+    assert upsert.copy_upsert(conn, 'ds__preci', 'aschema', [], data, 'upsert') == 0
+    assert not conn.execute.called
+
+    # the staging table is removed if something goes wrong
+    conn.execute.reset_mock()
+    cursor.copy_expert.side_effect = ValueError('wrong value')
+    with pytest.raises(ValueError):
+        upsert.copy_upsert(conn, 'ds__preci', 'aschema', fields, data, 'upsert')
+    assert conn.connection.rollback.called
+    assert conn.execute.call_args_list[-1][0][0].startswith('DROP TABLE IF EXISTS')
+
+
+def test_write_flags(mocker):
+    conn = mocker.MagicMock()
+    conn.in_transaction.return_value = False
+    conn.execute.return_value.rowcount = 2
+    cursor = conn.connection.cursor.return_value
+    copied = []
+    cursor.copy_expert.side_effect = lambda sql, fp: copied.append((sql, fp.read()))
+    tmxgg_records = [
+        [1, datetime(2020, 1, 1), 4.5, -10, 2.1, 1],
+        [1, datetime(2020, 1, 2), 4.5, -11, 2.1, -12],
+    ]
+    tmngg_records = [
+        [1, datetime(2020, 1, 2), 4.5, -11, 2.1, -12],
+        [2, datetime(2020, 1, 1), 4.5, 1, 2.1, -13],
+    ]
+    fields_records = [(['vntmxgg', 'vnt'], tmxgg_records, 3), (['vntmxgg'], tmngg_records, 5)]
+    result = upsert.write_flags(conn, 'ds__vnt10', fields_records, schema='aschema')
+    assert result == {'vntmxgg': 2}
+    sqls = [' '.join(c[0][0].split()) for c in conn.execute.call_args_list]
+    assert len(sqls) == 5
+    tmp_table = sqls[0].split()[3]
+    assert tmp_table.startswith('updates_flags')
+    assert sqls[0] == 'CREATE TEMP TABLE %s ( cod_staz integer NOT NULL, data_i timestamp ' \
+                      'without time zone NOT NULL, flag0 integer, flag1 integer, ' \
+                      'PRIMARY KEY (cod_staz, data_i) )' % tmp_table
+    assert copied == [(
+        'COPY %s FROM STDIN WITH (FORMAT csv)' % tmp_table,
+        '"1","2020-01-01 00:00:00","-10",\n'
+        '"1","2020-01-02 00:00:00","-11","-12"\n'
+        '"2","2020-01-01 00:00:00",,"-13"\n'
+    )]
+    assert sqls[1] == 'ANALYZE %s' % tmp_table
+    # an UPDATE for each element, writing only the rows with its flag changed
+    join_sql = 't.cod_staz = u.cod_staz AND t.data_i = u.data_i'
+    assert sqls[2] == 'UPDATE aschema.ds__vnt10 t SET vntmxgg.flag.wht = u.flag0, ' \
+                      'vnt.flag.wht = u.flag0 FROM %s u WHERE %s AND u.flag0 IS NOT NULL ' \
+                      'AND ((t.vntmxgg).flag).wht <> u.flag0' % (tmp_table, join_sql)
+    assert sqls[3] == 'UPDATE aschema.ds__vnt10 t SET vntmxgg.flag.wht = u.flag1 ' \
+                      'FROM %s u WHERE %s AND u.flag1 IS NOT NULL ' \
+                      'AND ((t.vntmxgg).flag).wht <> u.flag1' % (tmp_table, join_sql)
+    assert sqls[4] == 'DROP TABLE IF EXISTS %s' % tmp_table
+
+    # counts by field
+    conn.execute.reset_mock()
+    conn.execute.side_effect = [mocker.MagicMock(rowcount=n) for n in (0, 0, 2, 1, 0)]
+    fields_records = [(['tmxgg'], tmxgg_records, 3), (['tmngg'], tmngg_records, 5)]
+    result = upsert.write_flags(conn, 'ds__t200', fields_records, schema='aschema')
+    assert result == {'tmxgg': 2, 'tmngg': 1}
+    conn.execute.side_effect = None
+
+    # nothing to do
+    conn.execute.reset_mock()
+    assert upsert.write_flags(conn, 'ds__t200', [(['tmxgg'], [], 3)]) == {'tmxgg': 0}
+    assert not conn.execute.called
+
+    # the temp table is removed if something goes wrong
+    cursor.copy_expert.side_effect = ValueError('wrong value')
+    assert upsert.update_flags(conn, tmxgg_records, 'ds__t200', schema='aschema') == 0
+    assert conn.connection.rollback.called
+    assert conn.execute.call_args_list[-1][0][0].startswith('DROP TABLE IF EXISTS')
+
+
+def test_upsert_items_stream(mocker):
+    copied = []
+
+    def copy_upsert(conn, table_name, schema, fields, data, policy=None):
+        # the records are built while they are consumed
+        assert not isinstance(data, list)
+        copied.extend(data)
+        return len(copied)
+
+    mocker.patch.object(upsert, 'copy_upsert', side_effect=copy_upsert)
+    items = [
+        {'cod_staz': '2', 'data_i': '2020-01-01', 'cod_aggr': '4', 'prec24.val_tot': '1.5'},
+        {'cod_staz': '1', 'data_i': '2020-01-02', 'cod_aggr': '4', 'prec24.val_tot': '0'},
+        {'cod_staz': '1', 'data_i': '2020-01-01', 'cod_aggr': '4', 'prec24.val_tot': '2'},
+    ]
+    assert upsert.upsert_items(mocker.MagicMock(), items, 'upsert', 'aschema', 'ds__preci') == 3
+    assert [(r['cod_staz'], r['data_i']) for r in copied] == [
+        ('1', '2020-01-01'), ('1', '2020-01-02'), ('2', '2020-01-01')]
+
+
 def test_upsert_items(conn):
     # temperature
     table_name = 'ds__t200'
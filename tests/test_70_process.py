@@ -1,9 +1,10 @@
 
 from datetime import datetime
+import logging
 from os.path import exists, join
 import os
 
-from sciafeed import process, arpa19, utils
+from sciafeed import process, arpa19, export, utils
 
 from . import TEST_DATA_PATH
 
@@ -385,6 +386,123 @@ def test_make_report(tmpdir):
     for err_msg in err_msgs:
         assert err_msg in msgs
 
+    # streaming: same report and same output data
+    outdata_filepath2 = str(tmpdir.join('data4.csv'))
+    out_filepath2 = str(tmpdir.join('report4.txt'))
+    logger = utils.setup_log(out_filepath2)
+    data_parsed = process.make_report(
+        in_filepath, outdata_filepath2, parameters_filepath=parameters_filepath,
+        limiting_params=limiting_params, logger=logger, stream=True)
+    assert data_parsed is None
+    with open(out_filepath2) as fp:
+        msgs2 = fp.read()
+    for err_msg in err_msgs:
+        assert err_msg in msgs2
+    with open(outdata_filepath) as fp, open(outdata_filepath2) as fp2:
+        assert fp.read() == fp2.read()
+
+
+def test_make_report_stream_unsorted(tmpdir):
+    # a file of a format that does not yield the measures sorted by date
+    with open(join(TEST_DATA_PATH, 'arpaer', 'results.json')) as fp:
+        lines = fp.readlines()
+    in_filepath = str(tmpdir.join('results.json'))
+    with open(in_filepath, 'w') as fp:
+        fp.writelines(reversed(lines))
+    outdata_filepath = str(tmpdir.join('data.csv'))
+    outdata_filepath2 = str(tmpdir.join('data2.csv'))
+    process.make_report(in_filepath, outdata_filepath)
+    process.make_report(in_filepath, outdata_filepath2, stream=True)
+    with open(outdata_filepath) as fp, open(outdata_filepath2) as fp2:
+        assert fp.read() == fp2.read()
+
+
+def test_make_report_buffered(tmpdir):
+    in_filepath = join(TEST_DATA_PATH, 'arpa19', 'wrong_70001_201301010000_201401010100.dat')
+    outdata_filepath = str(tmpdir.join('data.csv'))
+    messages, seconds = process.make_report_buffered(in_filepath, outdata_filepath)
+    assert seconds > 0
+    assert exists(outdata_filepath)
+    assert messages[0] == (logging.INFO, "START OF ANALYSIS OF ARPA-19 FILE %r" % in_filepath)
+    assert (logging.INFO, "Row 2: The spacing in the row is wrong") in messages
+    assert messages[-1] == (logging.INFO, "END OF ANALYSIS OF ARPA-19 FILE")
+    # unknown format
+    in_filepath = join(TEST_DATA_PATH, 'arpa19', 'arpa19_params.csv')
+    messages, _ = process.make_report_buffered(in_filepath)
+    assert messages == [(logging.WARNING, "file %r has unknown format" % in_filepath)]
+
+
+def test_make_reports(tmpdir):
+    in_filepaths = [
+        join(TEST_DATA_PATH, 'arpa19', 'wrong_70001_201301010000_201401010100.dat'),
+        join(TEST_DATA_PATH, 'arpa19', 'arpa19_params.csv'),
+        join(TEST_DATA_PATH, 'arpa21', 'loc01_00201_201201010000_201301010100.dat'),
+        join(TEST_DATA_PATH, 'rmn', 'ancona_right.csv'),
+    ]
+    reports = []
+    for workers in (1, 2):
+        out_filepath = str(tmpdir.join('report%s.txt' % workers))
+        outdata_filepaths = [str(tmpdir.join('data%s_%s.csv' % (workers, i)))
+                             for i in range(len(in_filepaths))]
+        logger = utils.setup_log(out_filepath, log_format='%(levelname)s %(message)s')
+        process.make_reports(in_filepaths, outdata_filepaths, logger=logger, workers=workers)
+        with open(out_filepath) as fp:
+            lines = fp.readlines()
+        assert lines[0] == "INFO processing file 'wrong_70001_201301010000_201401010100.dat'\n"
+        assert lines[1].startswith('INFO START OF ANALYSIS OF ARPA-19 FILE')
+        assert "WARNING file %r has unknown format\n" % in_filepaths[1] in lines
+        assert lines[-1].startswith("INFO file 'ancona_right.csv' processed in ")
+        # timing is the only difference
+        reports.append([line.replace('data%s_' % workers, 'data_') for line in lines
+                        if ' processed in ' not in line])
+        assert len(lines) - len(reports[-1]) == len(in_filepaths)
+        for i, outdata_filepath in enumerate(outdata_filepaths):
+            assert exists(outdata_filepath) == (i != 1)
+    assert reports[0] == reports[1]
+    for i in (0, 2, 3):
+        with open(str(tmpdir.join('data1_%s.csv' % i))) as fp1, \
+                open(str(tmpdir.join('data2_%s.csv' % i))) as fp2:
+            assert fp1.read() == fp2.read()
+
+
+def test_partition_by_station(tmpdir, mocker):
+    data_path = join(TEST_DATA_PATH, 'indicators', 'input',
+                     'loc01_00009_201801010100_201801011000.dat.csv')
+    data = export.csv2data(data_path)
+    # the same station in two files, and another station in the second file
+    other_station = [(dict(m[0], cod_utente='00010'), ) + m[1:] for m in data[:30]]
+    data1_path = str(tmpdir.join('data1.csv'))
+    data2_path = str(tmpdir.join('data2.npz'))
+    export.export2csv(data[:100], data1_path)
+    export.export2npz(data[100:] + other_station, data2_path)
+    not_parsable_path = str(tmpdir.join('data3.csv'))
+    with open(not_parsable_path, 'w') as fp:
+        fp.write('not;a;data;file')
+    partitions_folder = str(tmpdir.mkdir('partitions'))
+    not_parsable_path2 = str(tmpdir.join('data4.npz'))
+    with open(not_parsable_path2, 'wb') as fp:
+        fp.write(b'not a data file')
+    logger = mocker.MagicMock()
+    partitions = process.partition_by_station(
+        [data1_path, not_parsable_path, not_parsable_path2, data2_path], partitions_folder,
+        logger=logger)
+    logger.error.assert_called_once_with('data file %r not parsable' % not_parsable_path2)
+    station_md = data[0][0]
+    station_key = (station_md['cod_utente'], station_md['cod_rete'], station_md['lat'],
+                   station_md['lon'])
+    other_key = ('00010', ) + station_key[1:]
+    assert list(partitions) == [station_key, other_key]
+    assert len(partitions[station_key]) == 2
+    assert all(p.startswith(partitions_folder) for p in partitions[station_key])
+    station_data = []
+    for partition_path in partitions[station_key]:
+        station_data.extend(export.npz2data(partition_path))
+    assert station_data == data
+    other_data = []
+    for partition_path in partitions[other_key]:
+        other_data.extend(export.npz2data(partition_path))
+    assert other_data == other_station
+
 
 def test_compute_daily_indicators(conn, tmpdir):
     data_folder = join(TEST_DATA_PATH, 'indicators', 'input')
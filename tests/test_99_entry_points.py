@@ -7,7 +7,7 @@ import shutil
 from click.testing import CliRunner
 
 from . import TEST_DATA_PATH
-from sciafeed import entry_points
+from sciafeed import entry_points, export
 
 
 def test_make_report(tmpdir):
@@ -166,6 +166,16 @@ def test_make_reports(tmpdir):
         line = 'START OF ANALYSIS OF %s FILE %r\n' % (label, filepath)
         assert line in lines
 
+    # run in parallel: same report (but timing)
+    out_filepath2 = str(tmpdir.join('report2.txt'))
+    result = runner.invoke(entry_points.make_reports,
+                           [in_folder, '-r', out_filepath2, '--workers', '2'])
+    assert result.exit_code == 0
+    with open(out_filepath2) as fp:
+        lines2 = fp.readlines()
+    assert [line for line in lines2 if ' processed in ' not in line] \
+        == [line for line in lines if ' processed in ' not in line]
+
     # run with data files
     outdata_folder = str(tmpdir.join('data'))
     assert not exists(outdata_folder)
@@ -177,6 +187,15 @@ def test_make_reports(tmpdir):
         outdata_file = filename + '.csv'
         assert outdata_file in data_files
 
+    # run with binary data files: same data
+    result = runner.invoke(entry_points.make_reports, [in_folder, '-d', outdata_folder, '-b'])
+    assert result.exit_code == 0
+    data_files = listdir(outdata_folder)
+    for format_folder, filename, label in files_to_parse:
+        outdata_filepath = join(outdata_folder, filename)
+        assert export.npz2data(outdata_filepath + '.npz') \
+            == export.csv2data(outdata_filepath + '.csv')
+
     # put also an unknown file inside the folder and an empty folder
     a_folder = join(in_folder, 'afolder')
     mkdir(a_folder)